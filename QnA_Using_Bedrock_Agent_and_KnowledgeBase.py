@@ -1,11 +1,11 @@
 from dotenv import load_dotenv
-import json
 import logging
 import logging.config
 import os
-import re
-from services import bedrock_agent_runtime
+from services import agent_response, agent_worker, answer_cache, history_store, input_filter, latency_analyzer, query_router, rate_limiter, request_coalescer, session_store, token_usage, trace_index
 import streamlit as st
+import time
+from ui import lazy_json, retrieval_filters
 import uuid
 import yaml
 
@@ -27,13 +27,54 @@ agent_id = os.environ.get("BEDROCK_AGENT_ID")
 agent_alias_id = os.environ.get("BEDROCK_AGENT_ALIAS_ID", "TSTALIASID")  # TSTALIASID is the default test alias ID
 ui_title = os.environ.get("BEDROCK_AGENT_TEST_UI_TITLE", "Agents for Amazon Bedrock Test UI")
 ui_icon = os.environ.get("BEDROCK_AGENT_TEST_UI_ICON")
+route_labels = {query_router.AGENT: "Agent", query_router.KNOWLEDGE_BASE: "Knowledge Base"}
 
 
-def init_session_state():
-    st.session_state.session_id = str(uuid.uuid4())
-    st.session_state.messages = []
+def init_session_state(session_id=None):
+    if "agent_run" in st.session_state:
+        st.session_state.pop("agent_run").cancel()
+    if "messages" in st.session_state:
+        # Drop the spilled history and the stored state of the session being reset
+        st.session_state.messages.delete()
+        session_store.store.delete(st.session_state.session_id)
+    st.session_state.session_id = session_id or str(uuid.uuid4())
+    st.session_state.turn_id = str(uuid.uuid4())
+    st.session_state.messages = history_store.HistoryStore(st.session_state.session_id)
+    st.session_state.visible_messages = history_store.page_size
     st.session_state.citations = []
-    st.session_state.trace = {}
+    st.session_state.trace = trace_index.TraceIndex()
+    st.session_state.latency = {}
+    st.session_state.token_usage = {}
+    st.session_state.session_token_usage = token_usage.new_usage()
+    # The session id in the URL lets a returning browser resume the session on any replica
+    st.query_params["session"] = st.session_state.session_id
+    if session_id is None:
+        session_store.store.create(
+            st.session_state.session_id,
+            {"agent_id": agent_id, "agent_alias_id": agent_alias_id, "created_at": time.time()}
+        )
+
+
+def resume_session_state(session_id, saved):
+    # Rebuilds the local state of a session from the session store, reusing its Bedrock session id
+    init_session_state(session_id)
+    # This replica may still have the session's history file from before, the session store is authoritative
+    st.session_state.messages.clear()
+    for turn in saved["turns"]:
+        message = turn["message"]
+        artifacts = {kind: turn[kind] for kind in ("citations", "trace") if kind in turn}
+        st.session_state.messages.append(message, artifacts=artifacts or None)
+        if "tokens" in message:
+            token_usage.add_usage(st.session_state.session_token_usage, message["tokens"])
+        if artifacts:
+            st.session_state.citations = turn.get("citations", [])
+            st.session_state.trace = trace_index.from_trace(turn.get("trace", {}))
+
+
+def append_message(message, artifacts=None):
+    # Adds a message to the local history and writes just that turn to the session store
+    seq = st.session_state.messages.append(message, artifacts=artifacts)
+    session_store.store.append_turn(st.session_state.session_id, seq, {"message": message, **(artifacts or {})})
 
 
 # General page configuration and initialization
@@ -41,152 +82,198 @@ def init_session_state():
 st.subheader('RAG Using Knowledge Base & Agents from Amazon Bedrock', divider='rainbow')
 #st.title(ui_title)
 if len(st.session_state.items()) == 0:
-    init_session_state()
+    saved_session_id = st.query_params.get("session")
+    saved_session = session_store.store.load(saved_session_id) if saved_session_id else None
+    if saved_session:
+        resume_session_state(saved_session_id, saved_session)
+    else:
+        init_session_state()
 
 # Sidebar button to reset session state
 with st.sidebar:
     if st.button("Reset Session"):
         init_session_state()
+# Metadata filter applied to the Knowledge Base searches of the next turn, on either route
+retrieval_filter = retrieval_filters.retrieval_filter_sidebar("agent")
 
-# Messages in the conversation
-for message in st.session_state.messages:
+# Messages in the conversation, only the most recent page is rendered
+if len(st.session_state.messages) > st.session_state.visible_messages:
+    if st.button("Load earlier messages"):
+        st.session_state.visible_messages += history_store.page_size
+for message in st.session_state.messages.recent(st.session_state.visible_messages):
     with st.chat_message(message["role"]):
         st.markdown(message["content"], unsafe_allow_html=True)
+        if message.get("cancelled"):
+            st.caption("Stopped")
+        if "tokens" in message:
+            st.caption(f"{route_labels[message.get('route', query_router.AGENT)]} | {token_usage.format_usage(message['tokens'])}")
 
-# Chat input that invokes the agent
-if prompt := st.chat_input():
-    st.session_state.messages.append({"role": "user", "content": prompt})
+# Chat input that starts an agent turn on a background worker, disabled while one is running
+if prompt := st.chat_input(disabled="agent_run" in st.session_state):
+    append_message({"role": "user", "content": prompt})
     with st.chat_message("user"):
         st.write(prompt)
+    # Latency, token usage and the trace index are all collected by the worker as the events stream in
+    st.session_state.agent_run = agent_worker.start(
+        agent_id,
+        agent_alias_id,
+        st.session_state.session_id,
+        prompt,
+        first_turn=len(st.session_state.messages) == 1,
+        retrieval_filter=retrieval_filter
+    )
 
+# Poll the running turn, this also resumes it on the rerun triggered by the Stop button
+if "agent_run" in st.session_state:
+    run = st.session_state.agent_run
     with st.chat_message("assistant"):
+        stop_button = st.empty()
+        if stop_button.button("Stop", key=f"stop:{run.run_id}"):
+            run.cancel()
         with st.empty():
-            with st.spinner():
-                response = bedrock_agent_runtime.invoke_agent(
-                    agent_id,
-                    agent_alias_id,
-                    st.session_state.session_id,
-                    prompt
-                )
-            output_text = response["output_text"]
-
-            # Check if the output is a JSON object with the instruction and result fields
-            try:
-                # When parsing the JSON, strict mode must be disabled to handle badly escaped newlines
-                # TODO: This is still broken in some cases - AWS needs to double sescape the field contents
-                output_json = json.loads(output_text, strict=False)
-                if "instruction" in output_json and "result" in output_json:
-                    output_text = output_json["result"]
-            except json.JSONDecodeError as e:
-                pass
-
-            # Add citations
-            if len(response["citations"]) > 0:
-                citation_num = 1
-                output_text = re.sub(r"%\[(\d+)\]%", r"<sup>[\1]</sup>", output_text)
-                citation_locs = ""
-                for citation in response["citations"]:
-                    for retrieved_ref in citation["retrievedReferences"]:
-                        citation_marker = f"[{citation_num}]"
-                        match retrieved_ref['location']['type']:
-                            case 'CONFLUENCE':
-                                citation_locs += f"\n<br>{citation_marker} {retrieved_ref['location']['confluenceLocation']['url']}"
-                            case 'CUSTOM':
-                                citation_locs += f"\n<br>{citation_marker} {retrieved_ref['location']['customDocumentLocation']['id']}"
-                            case 'KENDRA':
-                                citation_locs += f"\n<br>{citation_marker} {retrieved_ref['location']['kendraDocumentLocation']['uri']}"
-                            case 'S3':
-                                citation_locs += f"\n<br>{citation_marker} {retrieved_ref['location']['s3Location']['uri']}"
-                            case 'SALESFORCE':
-                                citation_locs += f"\n<br>{citation_marker} {retrieved_ref['location']['salesforceLocation']['url']}"
-                            case 'SHAREPOINT':
-                                citation_locs += f"\n<br>{citation_marker} {retrieved_ref['location']['sharePointLocation']['url']}"
-                            case 'SQL':
-                                citation_locs += f"\n<br>{citation_marker} {retrieved_ref['location']['sqlLocation']['query']}"
-                            case 'WEB':
-                                citation_locs += f"\n<br>{citation_marker} {retrieved_ref['location']['webLocation']['url']}"
-                            case _:
-                                logger.warning(f"Unknown location type: {retrieved_ref['location']['type']}")
-                        citation_num += 1
-                output_text += f"\n{citation_locs}"
-
-            st.session_state.messages.append({"role": "assistant", "content": output_text})
+            # Render the answer as it streams in, then replace it with the fully formatted message
+            while not run.wait(0.1):
+                st.markdown(run.text(), unsafe_allow_html=True)
+            stop_button.empty()
+            del st.session_state.agent_run
+            if run.error is not None:
+                raise run.error
+            response = run.response
+            output_text = agent_response.format_output(response["output_text"], response["citations"])
+
+            st.session_state.token_usage = run.usage.summary()
+            # The session total is kept with the page, the ledger drops totals of long idle sessions
+            token_usage.record(st.session_state.session_id, agent_id, agent_alias_id, run.usage)
+            token_usage.add_usage(st.session_state.session_token_usage, st.session_state.token_usage["total"])
+            message = {
+                "role": "assistant",
+                "content": output_text,
+                "tokens": st.session_state.token_usage["total"],
+                "route": run.route
+            }
+            if run.cancelled:
+                message["cancelled"] = True
+            append_message(message, artifacts={"citations": response["citations"], "trace": response["trace"]})
             st.session_state.citations = response["citations"]
-            st.session_state.trace = response["trace"]
+            st.session_state.trace = run.trace
+            st.session_state.turn_id = str(uuid.uuid4())
+            st.session_state.latency = run.timer.breakdown()
+            # Stopped turns would skew the percentiles, they are counted under Agent Runs instead
+            if not run.cancelled:
+                latency_analyzer.record(st.session_state.latency, run.route)
             st.markdown(output_text, unsafe_allow_html=True)
-
-trace_types_map = {
-    "Pre-Processing": ["preGuardrailTrace", "preProcessingTrace"],
-    "Orchestration": ["orchestrationTrace"],
-    "Post-Processing": ["postProcessingTrace", "postGuardrailTrace"]
-}
-
-trace_info_types_map = {
-    "preProcessingTrace": ["modelInvocationInput", "modelInvocationOutput"],
-    "orchestrationTrace": ["invocationInput", "modelInvocationInput", "modelInvocationOutput", "observation", "rationale"],
-    "postProcessingTrace": ["modelInvocationInput", "modelInvocationOutput", "observation"]
-}
+        if run.cancelled:
+            st.caption("Stopped")
+        st.caption(f"{route_labels[run.route]} | {token_usage.format_usage(st.session_state.token_usage['total'])}")
 
 # Sidebar section for trace
 with st.sidebar:
     st.title("Trace")
 
-    # Show each trace type in separate sections
-    step_num = 1
-    for trace_type_header in trace_types_map:
+    # Show each trace type in separate sections, steps are grouped as in the Bedrock console
+    for trace_type_header in agent_response.trace_types_map:
         st.subheader(trace_type_header)
 
-        # Organize traces by step similar to how it is shown in the Bedrock console
-        has_trace = False
-        for trace_type in trace_types_map[trace_type_header]:
-            if trace_type in st.session_state.trace:
-                has_trace = True
-                trace_steps = {}
-
-                for trace in st.session_state.trace[trace_type]:
-                    # Each trace type and step may have different information for the end-to-end flow
-                    if trace_type in trace_info_types_map:
-                        trace_info_types = trace_info_types_map[trace_type]
-                        for trace_info_type in trace_info_types:
-                            if trace_info_type in trace:
-                                trace_id = trace[trace_info_type]["traceId"]
-                                if trace_id not in trace_steps:
-                                    trace_steps[trace_id] = [trace]
-                                else:
-                                    trace_steps[trace_id].append(trace)
-                                break
-                    else:
-                        trace_id = trace["traceId"]
-                        trace_steps[trace_id] = [
-                            {
-                                trace_type: trace
-                            }
-                        ]
-
-                # Show trace steps in JSON similar to the Bedrock console
-                for trace_id in trace_steps.keys():
-                    with st.expander(f"Trace Step {str(step_num)}", expanded=False):
-                        for trace in trace_steps[trace_id]:
-                            trace_str = json.dumps(trace, indent=2)
-                            st.code(trace_str, language="json", line_numbers=True, wrap_lines=True)
-                    step_num += 1
-        if not has_trace:
+        trace_steps = st.session_state.trace.phase_steps(trace_type_header)
+        # Show trace steps in JSON similar to the Bedrock console, serialized only once opened
+        for trace_step in trace_steps:
+            lazy_json.lazy_json(
+                f"Trace Step {str(trace_step.number)}",
+                f"trace-{trace_step.number}",
+                st.session_state.turn_id,
+                texts=trace_step.texts
+            )
+        if len(trace_steps) == 0:
             st.text("None")
 
     st.subheader("Citations")
     if len(st.session_state.citations) > 0:
         citation_num = 1
         for citation in st.session_state.citations:
-            for retrieved_ref_num, retrieved_ref in enumerate(citation["retrievedReferences"]):
-                with st.expander(f"Citation [{str(citation_num)}]", expanded=False):
-                    citation_str = json.dumps(
+            for retrieved_ref in citation["retrievedReferences"]:
+                lazy_json.lazy_json(
+                    f"Citation [{str(citation_num)}]",
+                    f"citation-{citation_num}",
+                    st.session_state.turn_id,
+                    lambda citation=citation, retrieved_ref=retrieved_ref: [
                         {
                             "generatedResponsePart": citation["generatedResponsePart"],
-                            "retrievedReference": citation["retrievedReferences"][retrieved_ref_num]
-                        },
-                        indent=2
-                    )
-                    st.code(citation_str, language="json", line_numbers=True, wrap_lines=True)
+                            "retrievedReference": retrieved_ref
+                        }
+                    ]
+                )
                 citation_num = citation_num + 1
     else:
-        st.text("None")
\ No newline at end of file
+        st.text("None")
+
+    st.subheader("Latency")
+    if len(st.session_state.latency) > 0:
+        st.caption("Last turn")
+        st.table([
+            {"metric": metric, "value": round(value, 3) if isinstance(value, float) else value}
+            for metric, value in st.session_state.latency.items()
+        ])
+    latency_percentiles = latency_analyzer.percentiles()
+    if len(latency_percentiles) > 0:
+        st.caption(f"All turns in this process (last {latency_analyzer.sample_size})")
+        st.table([
+            {
+                "route": route_labels[route],
+                "metric": metric,
+                "p50": round(values["p50"], 3),
+                "p95": round(values["p95"], 3),
+                "p99": round(values["p99"], 3),
+                "turns": values["count"]
+            }
+            for route, route_percentiles in latency_percentiles.items()
+            for metric, values in route_percentiles.items()
+        ])
+    else:
+        st.text("None")
+
+    st.subheader("Token Usage")
+    if len(st.session_state.token_usage) > 0:
+        st.caption("Last turn")
+        st.table([
+            {"phase": phase, "input": usage["input_tokens"], "output": usage["output_tokens"], "calls": usage["model_invocations"]}
+            for phase, usage in st.session_state.token_usage["phases"].items()
+        ])
+    st.caption(f"Session: {token_usage.format_usage(st.session_state.session_token_usage)}")
+    process_usage = token_usage.stats()
+    st.caption(f"Process: {token_usage.format_usage(process_usage['total'])}")
+    if process_usage["coalesced"]["model_invocations"]:
+        st.caption(f"Shared by coalesced turns, not counted above: {token_usage.format_usage(process_usage['coalesced'])}")
+
+    st.subheader("Agent Runs")
+    run_stats = agent_worker.stats()
+    st.caption(f"Completed: {run_stats['completed']} | Stopped: {run_stats['cancelled']} | Failed: {run_stats['failed']} | "
+               f"Running: {run_stats['running']} | Output tokens of stopped runs: {run_stats['cancelled_output_tokens']}")
+
+    st.subheader("Query Routing")
+    routing_stats = query_router.stats()
+    st.caption(f"Policy: {routing_stats['policy']} | Agent: {routing_stats['routes'][query_router.AGENT]} | "
+               f"Knowledge Base: {routing_stats['routes'][query_router.KNOWLEDGE_BASE]} | "
+               f"Est. latency saved: {routing_stats['estimated_seconds_saved']:.1f}s")
+
+    st.subheader("Answer Cache")
+    cache_stats = answer_cache.stats()
+    st.caption(f"Hits: {cache_stats['exact_hits']} exact, {cache_stats['similar_hits']} similar | "
+               f"Misses: {cache_stats['misses']} | Hit rate: {cache_stats['hit_rate']:.0%} | Entries: {cache_stats['entries']}")
+
+    st.subheader("Input Filter")
+    filter_stats = input_filter.stats()
+    st.caption(f"Enabled: {input_filter.enabled} | Checked: {filter_stats['checked']} | Rejected: {filter_stats['rejected']} | "
+               f"Mean: {filter_stats['mean_microseconds']:.0f}µs")
+
+    st.subheader("Request Coalescing")
+    coalescing_stats = request_coalescer.stats()
+    st.caption(f"Policy: {coalescing_stats['policy']} | Upstream calls: {coalescing_stats['upstream_calls']} | "
+               f"Saved: {coalescing_stats['upstream_calls_saved']} | In flight: {coalescing_stats['in_flight']}")
+
+    st.subheader("Rate Limiting")
+    limiter_stats = rate_limiter.stats()
+    for limiter_key, key_stats in limiter_stats.items():
+        st.caption(f"{limiter_key} | Rate: {key_stats['rate']:.1f}/s | Waited: {key_stats['wait_seconds']:.2f}s | "
+                   f"Throttles: {key_stats['throttles']} | Retries: {key_stats['retries']}")
+    if len(limiter_stats) == 0:
+        st.text("None")
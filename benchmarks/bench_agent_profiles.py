@@ -0,0 +1,96 @@
+"""
+Compares agent latency profiles (src/deploy/agent_profiles.py) offline from recorded
+traffic. Record a set of questions against an alias of each profile into its own cassette
+directory, e.g. with BEDROCK_CASSETTE_MODE=record BEDROCK_CASSETTE_DIR=cassettes/balanced,
+then run from the project root:
+
+    python -m benchmarks.bench_agent_profiles thorough=cassettes/thorough balanced=cassettes/balanced low-latency=cassettes/low-latency
+
+Per profile it reports the mean model calls, input and output tokens and recorded
+seconds of a turn, and the model calls and tokens of each phase.
+"""
+import argparse
+import glob
+import json
+import os
+
+from services import bedrock_agent_runtime, cassette, latency_analyzer, token_usage
+
+
+def summarize_recordings(directory):
+    """
+    :return: Returns the per-turn means of every invoke_agent cassette in directory
+    """
+    paths = sorted(glob.glob(os.path.join(directory, "invoke_agent-*.json.gz")))
+    totals = {"turns": 0, "model_calls": 0, "input_tokens": 0, "output_tokens": 0, "seconds": 0.0}
+    phases = {phase: token_usage.new_usage() for phase in token_usage.phase_by_trace_type.values()}
+    for path in paths:
+        interaction = cassette.read_cassette(path)
+        if "events" not in interaction:
+            continue
+        turn_usage = token_usage.TurnUsage()
+        timer = latency_analyzer.TurnTimer()
+        for event in bedrock_agent_runtime.parse_completion(event for delay, event in interaction["events"]):
+            turn_usage.observe(event)
+            timer.observe(event)
+        total = turn_usage.total()
+        totals["turns"] += 1
+        totals["model_calls"] += timer.model_invocations
+        totals["input_tokens"] += total["input_tokens"]
+        totals["output_tokens"] += total["output_tokens"]
+        totals["seconds"] += interaction["response_delay"] + sum(delay for delay, event in interaction["events"])
+        for phase, usage in turn_usage.phases.items():
+            token_usage.add_usage(phases[phase], usage)
+
+    turns = totals["turns"] or 1
+    return {
+        "turns": totals["turns"],
+        "model_calls": totals["model_calls"] / turns,
+        "input_tokens": totals["input_tokens"] / turns,
+        "output_tokens": totals["output_tokens"] / turns,
+        "seconds": totals["seconds"] / turns,
+        "phases": {phase: {field: value / turns for field, value in usage.items()} for phase, usage in phases.items()}
+    }
+
+
+def print_comparison(summaries, baseline):
+    print(f"{'profile':<14}{'turns':>7}{'model calls':>13}{'input tok':>11}{'output tok':>12}{'seconds':>9}{'vs ' + baseline:>16}")
+    for profile, summary in summaries.items():
+        relative = ""
+        if baseline in summaries and summaries[baseline]["seconds"] and profile != baseline:
+            relative = f"{summary['seconds'] / summaries[baseline]['seconds'] - 1:+.0%}"
+        print(f"{profile:<14}{summary['turns']:>7}{summary['model_calls']:>13.2f}{summary['input_tokens']:>11.0f}"
+              f"{summary['output_tokens']:>12.0f}{summary['seconds']:>9.2f}{relative:>16}")
+    print()
+    for profile, summary in summaries.items():
+        phases = ", ".join(
+            f"{phase} {usage['model_invocations']:.1f} calls/{usage['input_tokens'] + usage['output_tokens']:.0f} tok"
+            for phase, usage in summary["phases"].items()
+        )
+        print(f"{profile}: {phases}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recordings", nargs="+", metavar="PROFILE=DIR", help="Cassette directory recorded against each profile")
+    parser.add_argument("--baseline", default="thorough", help="Profile the others are compared with")
+    parser.add_argument("--json", help="Write the summaries to this file")
+    args = parser.parse_args()
+
+    summaries = {}
+    for recording in args.recordings:
+        profile, _, directory = recording.partition("=")
+        if not directory:
+            parser.error(f"Expected PROFILE=DIR, got '{recording}'")
+        summaries[profile] = summarize_recordings(directory)
+        if summaries[profile]["turns"] == 0:
+            print(f"No recorded invoke_agent turns in {directory}")
+    print_comparison(summaries, args.baseline)
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(summaries, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
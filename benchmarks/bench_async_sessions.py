@@ -0,0 +1,60 @@
+"""
+Throughput of services.bedrock_agent_runtime_async at 1, 10 and 100 concurrent sessions
+against the local runtime stub, or against recorded cassettes. Run from the project root:
+
+    python -m benchmarks.bench_async_sessions --latency 0.01
+    python -m benchmarks.bench_async_sessions --cassette-dir cassettes --time-scale 0.5
+"""
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+from benchmarks.stub_runtime import StubAgentRuntimeClient
+from services import answer_cache, bedrock_agent_runtime_async, cassette, rate_limiter
+
+
+async def run_sessions(client, executor, concurrency, turns_per_session):
+    async def session(session_num):
+        for turn in range(turns_per_session):
+            response = await bedrock_agent_runtime_async.invoke_agent(
+                "stub-agent", "stub-alias", f"session-{session_num}", f"question {turn}",
+                client=client, executor=executor
+            )
+            assert response["output_text"]
+
+    start = time.perf_counter()
+    await asyncio.gather(*(session(num) for num in range(concurrency)))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--turns", type=int, default=3, help="Turns per session")
+    parser.add_argument("--latency", type=float, default=0.005, help="Stub inter-event latency in seconds")
+    parser.add_argument("--workers", type=int, default=bedrock_agent_runtime_async.max_workers)
+    parser.add_argument("--cassette-dir", help="Replay recorded invoke_agent cassettes instead of the stub")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Replay speed of recorded timings")
+    args = parser.parse_args()
+
+    # Every session asks the same questions, measure the upstream path rather than the answer cache
+    # or the client-side rate limit
+    answer_cache.enabled = False
+    rate_limiter.rate_overrides[rate_limiter.agent_key("stub-agent")] = 1e9
+
+    if args.cassette_dir:
+        client = cassette.CassetteClient(None, mode="replay", directory=args.cassette_dir,
+                                         time_scale=args.time_scale, match="any")
+    else:
+        client = StubAgentRuntimeClient(chunk_count=10, trace_count=5, latency=args.latency)
+    print(f"{'sessions':>8} {'turns':>7} {'seconds':>9} {'turns/s':>9}")
+    for concurrency in args.concurrency:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            elapsed = asyncio.run(run_sessions(client, executor, concurrency, args.turns))
+        turns = concurrency * args.turns
+        print(f"{concurrency:>8} {turns:>7} {elapsed:>9.3f} {turns / elapsed:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Client-side hot path benchmarks against the local bedrock-agent-runtime stub, no AWS
+account needed. Run from the project root:
+
+    python -m benchmarks.bench_hot_path --profile large
+    python -m benchmarks.bench_hot_path --json bench.json
+    python -m benchmarks.bench_hot_path --compare bench.json --threshold 0.2
+
+With --compare the exit status is 1 when any benchmark lost more than --threshold of
+its ops/sec, which makes it usable as a CI regression gate.
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import sys
+import tracemalloc
+
+from benchmarks.harness import compare, print_results, run_benchmark
+from benchmarks.stub_runtime import StubAgentRuntimeClient
+from services import agent_response, answer_cache, bedrock_agent_runtime, rate_limiter, trace_index
+from src.call_bedrock_agent import BedRockClient
+
+profiles = {
+    "small": {"chunk_count": 10, "chunk_size": 40, "citation_count": 1, "trace_count": 6},
+    "medium": {"chunk_count": 50, "chunk_size": 60, "citation_count": 5, "trace_count": 25},
+    "large": {"chunk_count": 200, "chunk_size": 80, "citation_count": 20, "trace_count": 100}
+}
+
+agent_id = "stub-agent"
+agent_alias_id = "stub-alias"
+
+
+class StubBedRockClient(BedRockClient):
+    def __init__(self, stub):
+        super().__init__()
+        self.stub = stub
+
+    def return_runtime_client(self, run_time=True):
+        return self.stub
+
+
+def render_sidebar(trace, citations):
+    # The serialization work the agent page sidebar does on every rerun
+    rendered = []
+    for trace_type_header in agent_response.trace_types_map:
+        for trace_type in agent_response.trace_types_map[trace_type_header]:
+            if trace_type in trace:
+                trace_steps = agent_response.group_trace_steps(trace_type, trace[trace_type])
+                for trace_id in trace_steps:
+                    for step in trace_steps[trace_id]:
+                        rendered.append(json.dumps(step, indent=2))
+    for citation in citations:
+        for retrieved_ref in citation["retrievedReferences"]:
+            rendered.append(json.dumps(
+                {"generatedResponsePart": citation["generatedResponsePart"], "retrievedReference": retrieved_ref},
+                indent=2
+            ))
+    return rendered
+
+
+def render_sidebar_indexed(index, citations):
+    # The same work on a rerun when rendering from a trace index built during streaming,
+    # trace steps keep their text from the first render
+    rendered = []
+    for trace_type_header in agent_response.trace_types_map:
+        for trace_step in index.phase_steps(trace_type_header):
+            rendered += trace_step.texts()
+    for citation in citations:
+        for retrieved_ref in citation["retrievedReferences"]:
+            rendered.append(json.dumps(
+                {"generatedResponsePart": citation["generatedResponsePart"], "retrievedReference": retrieved_ref},
+                indent=2
+            ))
+    return rendered
+
+
+def retained_bytes(build):
+    # Bytes still allocated after build() returns, i.e. what one turn keeps in session state
+    gc.collect()
+    tracemalloc.start()
+    kept = build()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def trace_memory_report(stub):
+    def nested_dicts():
+        response = bedrock_agent_runtime.new_response()
+        for event in bedrock_agent_runtime.parse_completion(stub.events()):
+            bedrock_agent_runtime.add_event(response, event)
+        return response["trace"]
+
+    def index():
+        built = trace_index.TraceIndex()
+        for event in bedrock_agent_runtime.parse_completion(stub.events()):
+            built.add_event(event)
+        built.phase_steps("Orchestration")
+        return built
+
+    nested = retained_bytes(nested_dicts)
+    indexed = retained_bytes(index)
+    print(f"Trace memory per turn: nested dicts {nested / 1024:.1f} KiB, "
+          f"trace index {indexed / 1024:.1f} KiB ({indexed / nested - 1:+.0%})")
+
+
+def build_benchmarks(stub):
+    raw_events = list(stub.events())
+    response = bedrock_agent_runtime.invoke_agent(agent_id, agent_alias_id, "bench", "warm up", client=stub)
+    chunks = [event["text"] for event in bedrock_agent_runtime.parse_completion(raw_events) if event["type"] == "chunk"]
+    bedrock_client = StubBedRockClient(stub)
+    index = trace_index.from_trace(response["trace"])
+
+    def invoke_bedrock_agent():
+        with contextlib.redirect_stdout(io.StringIO()):
+            bedrock_client.invoke_bedrock_agent(agent_id, agent_alias_id, "bench", "question")
+
+    return {
+        "parse_completion": lambda: list(bedrock_agent_runtime.parse_completion(raw_events)),
+        "invoke_agent": lambda: bedrock_agent_runtime.invoke_agent(agent_id, agent_alias_id, "bench", "question", client=stub),
+        "BedRockClient.invoke_bedrock_agent": invoke_bedrock_agent,
+        "rewrite_citation_markers": lambda: "".join(agent_response.rewrite_citation_markers(chunks)),
+        "format_output": lambda: agent_response.format_output(response["output_text"], response["citations"]),
+        "sidebar_render": lambda: render_sidebar(response["trace"], response["citations"]),
+        "trace_index_build": lambda: trace_index.from_trace(response["trace"]),
+        "sidebar_render_indexed": lambda: render_sidebar_indexed(index, response["citations"])
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profile", choices=profiles, default="medium")
+    parser.add_argument("--chunks", type=int, help="Override the profile's chunk count")
+    parser.add_argument("--chunk-size", type=int, help="Override the profile's chunk size")
+    parser.add_argument("--citations", type=int, help="Override the profile's citation count")
+    parser.add_argument("--traces", type=int, help="Override the profile's orchestration trace count")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--only", nargs="+", help="Run only these benchmarks")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--compare", help="Baseline results written by an earlier --json run")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed ops/sec loss against the baseline")
+    args = parser.parse_args()
+
+    stub_options = dict(profiles[args.profile])
+    for option, value in (("chunk_count", args.chunks), ("chunk_size", args.chunk_size),
+                          ("citation_count", args.citations), ("trace_count", args.traces)):
+        if value is not None:
+            stub_options[option] = value
+    stub = StubAgentRuntimeClient(guardrails=True, **stub_options)
+
+    # Measure the parsing path itself, not the answer cache or the client-side rate limit
+    answer_cache.enabled = False
+    rate_limiter.rate_overrides[rate_limiter.agent_key(agent_id)] = 1e9
+
+    results = []
+    for name, fn in build_benchmarks(stub).items():
+        if args.only and name not in args.only:
+            continue
+        results.append(run_benchmark(f"{args.profile}/{name}", fn, iterations=args.iterations))
+    print(f"Stub stream: {stub_options}")
+    print_results(results)
+    trace_memory_report(stub)
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print(f"Regressed: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Offline evaluation of the local input filter (services/input_filter.py) against the
+decisions of the agent's PRE_PROCESSING prompt, no AWS account needed. Run from the
+project root:
+
+    python -m benchmarks.eval_input_filter
+    python -m benchmarks.eval_input_filter --cassettes cassettes
+    python -m benchmarks.eval_input_filter --train-model input_filter_model.json
+
+The labeled set is JSONL with {"text": ..., "label": "M" or "N"}. With --cassettes the
+labels are taken from recorded invoke_agent turns instead, M when the recorded
+PRE_PROCESSING step parsed the input as invalid. It reports agreement with those labels,
+precision and recall of rejections, and the latency of each classification.
+
+The filter may only replace PRE_PROCESSING (AGENT_LOCAL_INPUT_FILTER) when its recall
+reaches INPUT_FILTER_MIN_RECALL (--min-recall), the run exits non-zero otherwise. The
+deploy script runs the same check before disabling the phase.
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+import time
+
+from services import bedrock_agent_runtime, cassette, input_filter, latency_analyzer, text_classifier
+
+default_labeled_path = os.path.join(os.path.dirname(__file__), "data", "input_filter_labeled.jsonl")
+
+
+def read_labeled(path):
+    with open(path, "r") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def labels_from_cassettes(directory):
+    # PRE_PROCESSING decisions of recorded turns, turns recorded without the phase are skipped
+    examples = []
+    for path in sorted(glob.glob(os.path.join(directory, "invoke_agent-*.json.gz"))):
+        interaction = cassette.read_cassette(path)
+        for event in bedrock_agent_runtime.parse_completion(event for delay, event in interaction.get("events", [])):
+            parsed = event["trace"].get("modelInvocationOutput", {}).get("parsedResponse") \
+                if event["type"] == "trace" and event["trace_type"] == "preProcessingTrace" else None
+            if parsed is not None and "isValid" in parsed:
+                label = input_filter.NOT_MALICIOUS if parsed["isValid"] else input_filter.MALICIOUS
+                examples.append({"text": interaction["request"]["inputText"], "label": label})
+                break
+    return examples
+
+
+def evaluate(classifier, examples, repeats=20):
+    confusion = {(expected, actual): 0 for expected in "MN" for actual in "MN"}
+    disagreements = []
+    timings = []
+    for example in examples:
+        verdict = classifier.classify(example["text"])
+        started = time.perf_counter()
+        for _ in range(repeats):
+            classifier.classify(example["text"])
+        timings.append((time.perf_counter() - started) / repeats)
+        confusion[(example["label"], verdict["category"])] += 1
+        if verdict["category"] != example["label"]:
+            disagreements.append((example["label"], verdict["category"], verdict["reason"], example["text"]))
+
+    rejected = confusion[("M", "M")] + confusion[("N", "M")]
+    malicious = confusion[("M", "M")] + confusion[("M", "N")]
+    timings.sort()
+    return {
+        "examples": len(examples),
+        "agreement": (confusion[("M", "M")] + confusion[("N", "N")]) / len(examples) if examples else 0.0,
+        "precision": confusion[("M", "M")] / rejected if rejected else 0.0,
+        "recall": confusion[("M", "M")] / malicious if malicious else 0.0,
+        "false_rejections": confusion[("N", "M")],
+        "missed": confusion[("M", "N")],
+        "p50_microseconds": latency_analyzer.percentile(timings, 0.50) * 1e6 if timings else 0.0,
+        "p99_microseconds": latency_analyzer.percentile(timings, 0.99) * 1e6 if timings else 0.0,
+        "disagreements": disagreements
+    }
+
+
+def recall_gate(result, min_recall=input_filter.min_recall):
+    """
+    :return: Returns True when the filter rejects enough of the malicious examples to replace PRE_PROCESSING
+    """
+    return result["examples"] > 0 and result["recall"] >= min_recall
+
+
+def evaluate_for_deploy(labeled=default_labeled_path, cassettes=None, min_recall=input_filter.min_recall):
+    """
+    Evaluates the filter as the app loads it, on recorded traffic when cassettes are given
+    :return: Returns (passed, result)
+    """
+    examples = labels_from_cassettes(cassettes) if cassettes else read_labeled(labeled)
+    result = evaluate(input_filter.InputFilter(), examples, repeats=1)
+    return recall_gate(result, min_recall), result
+
+
+def print_evaluation(name, result):
+    print(f"{name}: {result['examples']} examples | agreement {result['agreement']:.1%} | "
+          f"precision {result['precision']:.1%} | recall {result['recall']:.1%} | "
+          f"false rejections {result['false_rejections']} | missed {result['missed']} | "
+          f"p50 {result['p50_microseconds']:.1f}µs | p99 {result['p99_microseconds']:.1f}µs")
+    for expected, actual, reason, text in result["disagreements"]:
+        print(f"  expected {expected}, got {actual} ({reason}): {text}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--labeled", default=default_labeled_path, help="Labeled JSONL set")
+    parser.add_argument("--cassettes", help="Take the labels from the PRE_PROCESSING steps recorded in this directory")
+    parser.add_argument("--model", help="Also evaluate rules plus this text_classifier model")
+    parser.add_argument("--train-model", help="Train a model on the labeled set, save it here and evaluate it")
+    parser.add_argument("--holdout", type=float, default=0.3, help="Share of the set kept out of --train-model training")
+    parser.add_argument("--repeats", type=int, default=20, help="Classifications per example when timing")
+    parser.add_argument("--min-recall", type=float, default=input_filter.min_recall,
+                        help="Recall the filter needs before PRE_PROCESSING may be disabled")
+    args = parser.parse_args()
+
+    examples = labels_from_cassettes(args.cassettes) if args.cassettes else read_labeled(args.labeled)
+    result = evaluate(input_filter.InputFilter(model=False), examples, args.repeats)
+    print_evaluation("rules", result)
+
+    model = None
+    evaluated = examples
+    if args.train_model:
+        # Hold part of the set back so the model is not scored on what it was trained on
+        shuffled = list(examples)
+        random.Random(0).shuffle(shuffled)
+        cut = int(len(shuffled) * (1 - args.holdout))
+        training, evaluated = shuffled[:cut], shuffled[cut:]
+        model = text_classifier.TextClassifier([input_filter.MALICIOUS, input_filter.NOT_MALICIOUS])
+        model.fit([(example["text"], example["label"]) for example in training])
+        model.save(args.train_model)
+        print(f"Saved model to {args.train_model} ({os.path.getsize(args.train_model) / 1024:.1f} KiB), "
+              f"trained on {len(training)} examples")
+        print_evaluation("rules (held out)", evaluate(input_filter.InputFilter(model=False), evaluated, args.repeats))
+    elif args.model:
+        model = text_classifier.TextClassifier.load(args.model)
+    if model is not None:
+        result = evaluate(input_filter.InputFilter(model=model), evaluated, args.repeats)
+        print_evaluation("rules+model", result)
+
+    if recall_gate(result, args.min_recall):
+        print(f"Recall {result['recall']:.1%} reaches {args.min_recall:.1%}, AGENT_LOCAL_INPUT_FILTER=true may disable PRE_PROCESSING")
+    else:
+        print(f"Recall {result['recall']:.1%} is below {args.min_recall:.1%}, keep PRE_PROCESSING enabled")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
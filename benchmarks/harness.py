@@ -0,0 +1,76 @@
+import gc
+import json
+import time
+import tracemalloc
+
+from services.latency_analyzer import percentile
+
+
+def run_benchmark(name, fn, iterations=200, warmup=20, alloc_iterations=20):
+    """
+    Times fn over a number of iterations and measures its allocations in a separate pass,
+    since tracing allocations slows the timed loop down
+    :return: Returns a result row with ops/sec, latency percentiles and allocations per op
+    """
+    for _ in range(warmup):
+        fn()
+
+    gc.collect()
+    timings = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        op_start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - op_start)
+    elapsed = time.perf_counter() - start
+    timings.sort()
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    for _ in range(alloc_iterations):
+        fn()
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename") if stat.size_diff > 0)
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+
+    return {
+        "name": name,
+        "iterations": iterations,
+        "ops_per_sec": iterations / elapsed,
+        "p50_us": percentile(timings, 0.50) * 1e6,
+        "p95_us": percentile(timings, 0.95) * 1e6,
+        "p99_us": percentile(timings, 0.99) * 1e6,
+        "retained_bytes_per_op": allocated / alloc_iterations,
+        "retained_blocks_per_op": blocks / alloc_iterations,
+        "peak_bytes": peak
+    }
+
+
+def print_results(results):
+    print(f"{'benchmark':<40} {'ops/s':>10} {'p50 us':>10} {'p95 us':>10} {'p99 us':>10} {'peak KiB':>10}")
+    for result in results:
+        print(f"{result['name']:<40} {result['ops_per_sec']:>10.1f} {result['p50_us']:>10.1f} "
+              f"{result['p95_us']:>10.1f} {result['p99_us']:>10.1f} {result['peak_bytes'] / 1024:>10.1f}")
+
+
+def compare(results, baseline_path, threshold):
+    """
+    Compares ops/sec against a previous --json run
+    :return: Returns the names of benchmarks that slowed down by more than threshold
+    """
+    with open(baseline_path) as file:
+        baseline = {result["name"]: result for result in json.load(file)}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result["name"])
+        if previous is None:
+            continue
+        change = result["ops_per_sec"] / previous["ops_per_sec"] - 1
+        print(f"{result['name']:<40} {change:>+8.1%} vs baseline")
+        if change < -threshold:
+            regressions.append(result["name"])
+    return regressions
@@ -0,0 +1,121 @@
+import time
+
+
+class StubAgentRuntimeClient:
+    """
+    Local stand-in for the bedrock-agent-runtime client. invoke_agent returns a completion
+    stream shaped like the real one, with configurable size and inter-event latency.
+    retrieve_and_generate and retrieve_and_generate_stream answer with the same size.
+    """
+
+    def __init__(self,
+                 chunk_count=20,
+                 chunk_size=40,
+                 citation_count=2,
+                 trace_count=6,
+                 latency=0.0,
+                 first_event_latency=0.0,
+                 guardrails=False):
+        """
+        :param chunk_count: Number of answer chunks per turn
+        :param chunk_size: Characters per answer chunk
+        :param citation_count: Number of citation markers and attributions in the answer
+        :param trace_count: Number of orchestration trace events per turn
+        :param latency: Seconds to wait between events
+        :param first_event_latency: Seconds to wait before the first event
+        :param guardrails: Emit pre and post guardrail traces around the turn
+        """
+        self.chunk_count = chunk_count
+        self.chunk_size = chunk_size
+        self.citation_count = citation_count
+        self.trace_count = trace_count
+        self.latency = latency
+        self.first_event_latency = first_event_latency
+        self.guardrails = guardrails
+        self.calls = 0
+
+    def _citation(self, num):
+        return {
+            "generatedResponsePart": {
+                "textResponsePart": {"text": f"Generated part {num}", "span": {"start": 0, "end": 10}}
+            },
+            "retrievedReferences": [
+                {
+                    "content": {"text": f"Retrieved passage {num} " + "of the source document " * 20},
+                    "location": {"type": "S3", "s3Location": {"uri": f"s3://stub-bucket/data/doc_{num}.pdf"}},
+                    "metadata": {"x-amz-bedrock-kb-chunk-id": f"chunk-{num}"}
+                }
+            ]
+        }
+
+    def _trace(self, trace_type, trace_id, step):
+        if trace_type == "orchestrationTrace":
+            step_types = ["modelInvocationInput", "rationale", "invocationInput", "observation", "modelInvocationOutput"]
+            step_type = step_types[step % len(step_types)]
+        else:
+            step_type = ["modelInvocationInput", "modelInvocationOutput"][step % 2]
+        # Every decoded event owns its strings, as with real traffic, rather than sharing one literal
+        step_body = {"traceId": trace_id, "text": f"{trace_type} step {step}: " + "Trace detail " * 30}
+        if step_type == "modelInvocationOutput":
+            step_body["metadata"] = {"usage": {"inputTokens": 900, "outputTokens": 120}}
+        return {"trace": {"trace": {trace_type: {step_type: step_body}}}}
+
+    def _guardrail(self, trace_id):
+        return {"trace": {"trace": {"guardrailTrace": {"traceId": trace_id, "action": "NONE", "inputAssessments": []}}}}
+
+    def events(self):
+        if self.first_event_latency:
+            time.sleep(self.first_event_latency)
+        if self.guardrails:
+            yield self._guardrail("stub-guardrail-pre")
+        yield self._trace("preProcessingTrace", "stub-pre-0", 0)
+        yield self._trace("preProcessingTrace", "stub-pre-0", 1)
+        for step in range(self.trace_count):
+            if self.latency:
+                time.sleep(self.latency)
+            yield self._trace("orchestrationTrace", f"stub-orch-{step // 5}", step)
+        for num in range(self.chunk_count):
+            if self.latency:
+                time.sleep(self.latency)
+            text = ("x" * self.chunk_size)
+            chunk = {"bytes": text.encode()}
+            if num < self.citation_count:
+                chunk["bytes"] = (text + f" %[{num + 1}]%").encode()
+                chunk["attribution"] = {"citations": [self._citation(num + 1)]}
+            yield {"chunk": chunk}
+        yield self._trace("postProcessingTrace", "stub-post-0", 0)
+        yield self._trace("postProcessingTrace", "stub-post-0", 1)
+        if self.guardrails:
+            yield self._guardrail("stub-guardrail-post")
+
+    def invoke_agent(self, **kwargs):
+        self.calls += 1
+        return {"completion": self.events(), "sessionId": kwargs.get("sessionId")}
+
+    def retrieve_and_generate(self, **kwargs):
+        # The Knowledge Base only path, one response after the whole answer is generated
+        self.calls += 1
+        if self.first_event_latency:
+            time.sleep(self.first_event_latency)
+        if self.latency:
+            time.sleep(self.latency * self.chunk_count)
+        return {
+            "output": {"text": "x" * (self.chunk_size * self.chunk_count)},
+            "citations": [self._citation(num + 1) for num in range(self.citation_count)],
+            "sessionId": kwargs.get("sessionId") or "stub-kb-session"
+        }
+
+    def retrieve_and_generate_stream(self, **kwargs):
+        self.calls += 1
+
+        def stream():
+            if self.first_event_latency:
+                time.sleep(self.first_event_latency)
+            for num in range(self.chunk_count):
+                if self.latency:
+                    time.sleep(self.latency)
+                yield {"output": {"text": "x" * self.chunk_size}}
+                if num < self.citation_count:
+                    yield {"citation": {"citation": self._citation(num + 1)}}
+
+        return {"stream": stream(), "sessionId": kwargs.get("sessionId") or "stub-kb-session"}
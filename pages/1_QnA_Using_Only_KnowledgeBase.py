@@ -1,57 +1,139 @@
-import boto3
 import streamlit as st
 from dotenv import load_dotenv
-import os
+from services import agent_response, answer_cache, bedrock_agent_runtime, history_store, knowledge_base_runtime, latency_analyzer, rate_limiter, session_store
+import time
+from ui import retrieval_filters
+import uuid
 
 load_dotenv()
 
 st.subheader('RAG Using Knowledge Base from Amazon Bedrock', divider='rainbow')
 
+def initSession(savedSessionId=None, savedSession=None):
+    if 'chat_history' in st.session_state:
+        # Drop the spilled history and the stored state of the session being reset
+        st.session_state.chat_history.delete()
+        session_store.store.delete(st.session_state.kb_page_session_id)
+    st.session_state.kb_page_session_id = savedSessionId if savedSession else f"kb-{uuid.uuid4()}"
+    st.session_state.chat_history = history_store.HistoryStore(st.session_state.kb_page_session_id)
+    st.session_state.visible_chat_history = history_store.page_size
+    if savedSession:
+        st.session_state.chat_history.clear()
+        for turn in savedSession['turns']:
+            st.session_state.chat_history.append(turn['message'], artifacts={"citations": turn['citations']} if 'citations' in turn else None)
+    else:
+        session_store.store.create(st.session_state.kb_page_session_id, {"page": "knowledge_base", "created_at": time.time()})
+    # The session id in the URL lets a returning browser resume the conversation on any replica
+    st.query_params["kb_session"] = st.session_state.kb_page_session_id
+
+
 if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
+    savedSessionId = st.query_params.get("kb_session")
+    initSession(savedSessionId, session_store.store.load(savedSessionId) if savedSessionId else None)
+
+with st.sidebar:
+    if st.button("Reset Session"):
+        initSession()
+
+
+def kbSessionId():
+    # Bedrock-managed Knowledge Base session, follow-up questions continue its conversation context
+    return session_store.store.load_state(st.session_state.kb_page_session_id).get('kb_session_id')
+
+
+def appendMessage(message, artifacts=None):
+    # Adds a message to the local history and writes just that turn to the session store
+    seq = st.session_state.chat_history.append(message, artifacts=artifacts)
+    session_store.store.append_turn(st.session_state.kb_page_session_id, seq, {"message": message, **(artifacts or {})})
+
+
+def formatTiming(ttft, total):
+    ttftText = "-" if ttft is None else f"{ttft:.2f}s"
+    return f"Time to first token: {ttftText} | Total: {total:.2f}s"
+
 
-for message in st.session_state.chat_history:
+def showCitations(citations):
+    # Every retrieved reference of every citation, numbered like the citation list of the agent page
+    citationNum = 1
+    for citation in citations:
+        for retrievedRef in citation['retrievedReferences']:
+            context = retrievedRef['content']['text']
+            location = retrievedRef['location']
+            if location['type'] in agent_response.location_fields:
+                locationKey, field = agent_response.location_fields[location['type']]
+                docUrl = location[locationKey][field]
+            else:
+                docUrl = location['type']
+            st.markdown(f"<span style='color:#FFDA33'>[{citationNum}] Context used: </span>{context}", unsafe_allow_html=True)
+            st.markdown(f"<span style='color:#FFDA33'>Source Document: </span>{docUrl}", unsafe_allow_html=True)
+            citationNum += 1
+    if citationNum == 1:
+        st.markdown(f"<span style='color:red'>No Context</span>", unsafe_allow_html=True)
+
+
+# Only the most recent page of the conversation is rendered
+if len(st.session_state.chat_history) > st.session_state.visible_chat_history:
+    if st.button("Load earlier messages"):
+        st.session_state.visible_chat_history += history_store.page_size
+for message in st.session_state.chat_history.recent(st.session_state.visible_chat_history):
     with st.chat_message(message['role']):
         st.markdown(message['text'])
+        if 'ttft' in message:
+            st.caption(formatTiming(message['ttft'], message['total']))
 
 
-bedrockClient = boto3.client('bedrock-agent-runtime')
+def getAnswers(questions, kbSession, retrievalFilter=None):
+    # Streams the answer as typed events, continuing the Knowledge Base session of earlier turns.
+    # Turns answered from the cache started no session, the call that starts one hands them over
+    pageSessionId = st.session_state.kb_page_session_id
+    return knowledge_base_runtime.retrieve_and_generate_stream(
+        questions, kbSession, retrieval_filter=retrievalFilter,
+        first_turn=len(st.session_state.chat_history) == 1,
+        history=None if kbSession else knowledge_base_runtime.unrecorded_turns(pageSessionId)
+    )
 
-def getAnswers(questions):
-    knowledgeBaseResponse  = bedrockClient.retrieve_and_generate(
-        input={'text': questions},
-        retrieveAndGenerateConfiguration={
-            'knowledgeBaseConfiguration': {
-                'knowledgeBaseId': os.environ.get("KNOWLEDGE_BASE_ID"),
-                'modelArn': "<Replace it with your Foundation Model ID>"
-            },
-            'type': 'KNOWLEDGE_BASE'
-        })
-    return knowledgeBaseResponse
+
+retrievalFilter = retrieval_filters.retrieval_filter_sidebar("kb")
 
 
 questions = st.chat_input('Enter you questions here...')
 if questions:
     with st.chat_message('user'):
         st.markdown(questions)
-    st.session_state.chat_history.append({"role":'user', "text":questions})
-
-    response = getAnswers(questions)
-    # st.write(response)
-    answer = response['output']['text']
+    appendMessage({"role":'user', "text":questions})
 
+    response = bedrock_agent_runtime.new_response()
+    timer = latency_analyzer.TurnTimer()
+    kbSession = kbSessionId()
     with st.chat_message('assistant'):
-        st.markdown(answer)
-    st.session_state.chat_history.append({"role":'assistant', "text": answer})
-
-    if len(response['citations'][0]['retrievedReferences']) != 0:
-        context = response['citations'][0]['retrievedReferences'][0]['content']['text']
-        doc_url = response['citations'][0]['retrievedReferences'][0]['location']['s3Location']['uri']
-        
-        #Below lines are used to show the context and the document source for the latest Question Answer
-        st.markdown(f"<span style='color:#FFDA33'>Context used: </span>{context}", unsafe_allow_html=True)
-        st.markdown(f"<span style='color:#FFDA33'>Source Document: </span>{doc_url}", unsafe_allow_html=True)
-    
-    else:
-        st.markdown(f"<span style='color:red'>No Context</span>", unsafe_allow_html=True)
-    
\ No newline at end of file
+        # Render tokens as they arrive
+        st.write_stream(bedrock_agent_runtime.iter_output_text(
+            latency_analyzer.timed(getAnswers(questions, kbSession, retrievalFilter), timer), response
+        ))
+        latency = timer.breakdown()
+        st.caption(formatTiming(latency['time_to_first_chunk_seconds'], latency['total_seconds']))
+    answer = response['output_text']
+    if response.get('session_id'):
+        session_store.store.update_state(st.session_state.kb_page_session_id, kb_session_id=response['session_id'], kb_history=[])
+    elif not kbSession:
+        knowledge_base_runtime.record_unrecorded_turn(st.session_state.kb_page_session_id, questions, answer)
+
+    appendMessage({
+        "role":'assistant',
+        "text": answer,
+        "ttft": latency['time_to_first_chunk_seconds'],
+        "total": latency['total_seconds']
+    }, artifacts={"citations": response['citations']})
+
+    #Below lines are used to show the context and the document source for the latest Question Answer
+    showCitations(response['citations'])
+
+with st.sidebar:
+    cacheStats = answer_cache.stats()
+    st.subheader("Answer Cache")
+    st.caption(f"Hits: {cacheStats['exact_hits']} exact, {cacheStats['similar_hits']} similar | "
+               f"Misses: {cacheStats['misses']} | Hit rate: {cacheStats['hit_rate']:.0%} | Entries: {cacheStats['entries']}")
+    st.subheader("Rate Limiting")
+    for limiterKey, limiterStats in rate_limiter.stats().items():
+        st.caption(f"{limiterKey} | Rate: {limiterStats['rate']:.1f}/s | Waited: {limiterStats['wait_seconds']:.2f}s | "
+                   f"Throttles: {limiterStats['throttles']} | Retries: {limiterStats['retries']}")
@@ -1,11 +1,14 @@
-
-import boto3
 import datetime
 import streamlit as st
 import os
+from services import answer_cache, client_registry, document_manifest, document_metadata, ingestion, s3_upload
 
 file_name = ''
-s3_client = boto3.client('s3', region_name='us-east-1')
+s3_client = client_registry.get_client('s3', region_name='us-east-1')
+
+# Uploads already sent to S3, reruns of the page must not upload them again
+if 'uploaded_file_ids' not in st.session_state:
+    st.session_state.uploaded_file_ids = set()
 
 def process_file(document):
     name = document.name.split('.')[0]
@@ -15,21 +18,122 @@ def process_file(document):
     # st.write(file_name)
     return file_name
 
-def upload_file(file_name, renamed_file_name):
+def document_metadata_for(document):
+    # Fields filled in on the form win over the ones guessed from the file name
+    metadata = document_metadata.from_filename(document.name)
+    metadata.update({attribute: value for attribute, value in metadata_fields.items() if value})
+    return document_metadata.clean(metadata)
+
+def upload_files(documents):
     bucket_name = os.environ.get("DS_BUCKET_NAME")
-    try:
-        # Upload file to an S3 object from the specified local path
-        s3_client.upload_file(file_name, bucket_name, "data/"+renamed_file_name)
+    # Stream every in-memory upload buffer to S3 as a multipart upload, at most S3_UPLOAD_MAX_FILES at once
+    uploads = []
+    digests = set()
+    for document in documents:
+        # Content already in the bucket is neither uploaded nor ingested again
+        digest = document_manifest.content_hash(document)
+        existing = document_manifest.manifest.exists(digest, bucket_name, s3_client)
+        if existing or digest in digests:
+            st.markdown(f"{document.name} is already in the knowledge base" + (f" as {existing['key']}" if existing else ""))
+            st.session_state.uploaded_file_ids.add(document.file_id)
+            continue
+        digests.add(digest)
+        key = "data/"+process_file(document)
+        # Bedrock KB sidecar, lets the query pages restrict retrieval to e.g. Q1 2025 documents.
+        # Written before the document, an ingestion started by the S3 triggered Lambda must find it
+        metadata = document_metadata_for(document)
+        try:
+            s3_client.put_object(Bucket=bucket_name, Key=document_metadata.sidecar_key(key),
+                                 Body=document_metadata.sidecar(metadata), ContentType="application/json")
+        except Exception as e:
+            st.markdown(f"Error writing the metadata of {document.name}: {str(e)}")
+            metadata = {}
+        upload = s3_upload.start(document, bucket_name, key, document.size, client=s3_client, metadata={"sha256": digest})
+        uploads.append((document, upload, st.progress(0.0, text=f"{document.name} | Waiting"), digest, metadata))
+    if not uploads:
+        return []
+
+    while not all(upload.wait(0.2 / len(uploads)) for _, upload, _, _, _ in uploads):
+        for document, upload, progress_bar, _, _ in uploads:
+            if upload.started and not upload.done:
+                progress = upload.progress()
+                progress_bar.progress(min(progress["fraction"], 1.0), text=f"{document.name} | {s3_upload.format_progress(progress)}")
+
+    uploaded = []
+    for document, upload, progress_bar, digest, metadata in uploads:
+        progress = upload.progress()
+        progress_bar.progress(1.0 if upload.error is None else min(progress["fraction"], 1.0),
+                              text=f"{document.name} | {s3_upload.format_progress(progress)}")
+        if upload.error is None:
+            document_manifest.manifest.add(digest, upload.key, document.name, document.size, metadata)
+            if replace_superseded:
+                # The next ingestion job drops the deleted versions from the vector index
+                deleted, failed = document_manifest.manifest.replace_superseded(digest, bucket_name, s3_client)
+                for old_key in deleted:
+                    st.markdown(f"Replaced earlier version {old_key}")
+                for old_key, error in failed:
+                    st.markdown(f"Error deleting earlier version {old_key}: {str(error)}")
+            uploaded.append((document, upload.key))
+        else:
+            st.markdown(f"Error uploading {document.name}: {str(upload.error)}")
+            if metadata:
+                # Not left behind without its document
+                try:
+                    s3_client.delete_object(Bucket=bucket_name, Key=document_metadata.sidecar_key(upload.key))
+                except Exception as e:
+                    st.markdown(f"Error deleting the metadata of {document.name}: {str(e)}")
+    if uploaded:
         # st.markdown(f"Object '{file_name}' uploaded to bucket '{bucket_name}'")
-        st.markdown(f"Successfully uploaded the file!!! 😃", unsafe_allow_html=True)
-    except Exception as e:
-        st.markdown(f"Error: {str(e)}")
-
-document = st.file_uploader("Upload Document", type=["pdf"])
-
-if document:
-    with open(document.name, 'wb') as f:
-            f.write(document.getbuffer())
-            
-    modifed_file_name = process_file(document)
-    upload_file(document.name, modifed_file_name)
+        st.markdown(f"Successfully uploaded {len(uploaded)} file(s)!!! 😃", unsafe_allow_html=True)
+    return uploaded
+
+# Refreshes on its own while documents are waiting to become searchable
+@st.fragment(run_every=5)
+def show_ingestion_status():
+    status = ingestion.status()
+    if not status["documents"]:
+        return
+    st.subheader("Ingestion")
+    job = status["job"]
+    if status["pending"]:
+        st.caption(f"{status['pending']} document(s) waiting for the next ingestion job")
+    if job:
+        statistics = job["statistics"] or {}
+        st.caption(f"Job {job['id']}: {job['status']} | {job['documents']} document(s) | "
+                   f"{statistics.get('numberOfNewDocumentsIndexed', 0)} new, "
+                   f"{statistics.get('numberOfModifiedDocumentsIndexed', 0)} modified, "
+                   f"{statistics.get('numberOfDocumentsFailed', 0)} failed")
+    st.dataframe([{
+        "document": document["key"].split("/", 1)[-1],
+        "status": document["status"],
+        "uploaded": datetime.datetime.fromtimestamp(document["uploaded_at"]).strftime("%H:%M:%S"),
+        "time to searchable": f"{document['seconds_to_searchable']:.0f}s" if document["seconds_to_searchable"] is not None else ""
+    } for document in status["documents"]], hide_index=True)
+    if status["mean_seconds_to_searchable"] is not None:
+        st.caption(f"Mean time to searchable: {status['mean_seconds_to_searchable']:.0f}s over "
+                   f"{status['jobs_completed']} job(s)")
+
+with st.expander("Document metadata"):
+    st.caption("Applies to every document of the upload. Empty fields are taken from the file name, e.g. QIP_Q1_2025.pdf")
+    metadata_fields = {
+        "publisher": st.text_input("Publisher"),
+        "quarter": st.selectbox("Quarter", ["", "Q1", "Q2", "Q3", "Q4"]),
+        "year": st.number_input("Year", min_value=1900, max_value=2100, value=None, step=1)
+    }
+replace_superseded = st.toggle("Replace earlier versions of documents with the same name", value=True)
+documents = st.file_uploader("Upload Documents", type=["pdf"], accept_multiple_files=True)
+new_documents = [document for document in documents if document.file_id not in st.session_state.uploaded_file_ids]
+
+if new_documents:
+    uploaded = upload_files(new_documents)
+    for document, _ in uploaded:
+        st.session_state.uploaded_file_ids.add(document.file_id)
+    if uploaded and ingestion.configured():
+        # One ingestion job for the whole burst, shared with other sessions uploading at the same time
+        ingestion.request([key for _, key in uploaded])
+    elif uploaded:
+        # Ingestion is started by the S3 triggered Lambda, answers cached before these documents may now be incomplete
+        answer_cache.invalidate()
+
+if ingestion.configured():
+    show_ingestion_status()
@@ -0,0 +1,120 @@
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+citation_marker_pattern = re.compile(r"%\[(\d+)\]%")
+# A chunk may end in the middle of a marker such as "%[1" - hold those characters back
+partial_marker_pattern = re.compile(r"%(\[\d*(\]?))?$")
+
+location_fields = {
+    "CONFLUENCE": ("confluenceLocation", "url"),
+    "CUSTOM": ("customDocumentLocation", "id"),
+    "KENDRA": ("kendraDocumentLocation", "uri"),
+    "S3": ("s3Location", "uri"),
+    "SALESFORCE": ("salesforceLocation", "url"),
+    "SHAREPOINT": ("sharePointLocation", "url"),
+    "SQL": ("sqlLocation", "query"),
+    "WEB": ("webLocation", "url")
+}
+
+trace_types_map = {
+    "Pre-Processing": ["preGuardrailTrace", "preProcessingTrace"],
+    "Orchestration": ["orchestrationTrace"],
+    "Post-Processing": ["postProcessingTrace", "postGuardrailTrace"]
+}
+
+trace_info_types_map = {
+    "preProcessingTrace": ["modelInvocationInput", "modelInvocationOutput"],
+    "orchestrationTrace": ["invocationInput", "modelInvocationInput", "modelInvocationOutput", "observation", "rationale"],
+    "postProcessingTrace": ["modelInvocationInput", "modelInvocationOutput", "observation"]
+}
+
+
+def group_trace_steps(trace_type, traces):
+    """
+    Organizes traces by step similar to how it is shown in the Bedrock console
+    :return: Returns {trace_id: [trace, ...]} in step order
+    """
+    trace_steps = {}
+    for trace in traces:
+        # Each trace type and step may have different information for the end-to-end flow
+        if trace_type in trace_info_types_map:
+            trace_info_types = trace_info_types_map[trace_type]
+            for trace_info_type in trace_info_types:
+                if trace_info_type in trace:
+                    trace_id = trace[trace_info_type]["traceId"]
+                    if trace_id not in trace_steps:
+                        trace_steps[trace_id] = [trace]
+                    else:
+                        trace_steps[trace_id].append(trace)
+                    break
+        else:
+            trace_id = trace["traceId"]
+            trace_steps[trace_id] = [
+                {
+                    trace_type: trace
+                }
+            ]
+    return trace_steps
+
+
+def unwrap_instruction_result(output_text):
+    # Check if the output is a JSON object with the instruction and result fields
+    try:
+        # When parsing the JSON, strict mode must be disabled to handle badly escaped newlines
+        # TODO: This is still broken in some cases - AWS needs to double sescape the field contents
+        output_json = json.loads(output_text, strict=False)
+        if "instruction" in output_json and "result" in output_json:
+            output_text = output_json["result"]
+    except json.JSONDecodeError as e:
+        pass
+    return output_text
+
+
+def format_citation_locations(citations):
+    citation_num = 1
+    citation_locs = ""
+    for citation in citations:
+        for retrieved_ref in citation["retrievedReferences"]:
+            citation_marker = f"[{citation_num}]"
+            location = retrieved_ref['location']
+            if location['type'] in location_fields:
+                location_key, field = location_fields[location['type']]
+                citation_locs += f"\n<br>{citation_marker} {location[location_key][field]}"
+            else:
+                logger.warning(f"Unknown location type: {location['type']}")
+            citation_num += 1
+    return citation_locs
+
+
+def format_output(output_text, citations):
+    """
+    Builds the final assistant message: unwraps instruction/result JSON, turns citation
+    markers into superscripts and appends the list of citation locations
+    """
+    output_text = unwrap_instruction_result(output_text)
+
+    # Add citations
+    if len(citations) > 0:
+        output_text = citation_marker_pattern.sub(r"<sup>[\1]</sup>", output_text)
+        output_text += f"\n{format_citation_locations(citations)}"
+    return output_text
+
+
+def rewrite_citation_markers(text_chunks, replacement=r"[\1]"):
+    """
+    Rewrites citation markers in a stream of text chunks as they arrive. Text that could
+    be the start of a marker split across chunks is held back until the next chunk.
+    """
+    pending = ""
+    for text in text_chunks:
+        pending = citation_marker_pattern.sub(replacement, pending + text)
+        match = partial_marker_pattern.search(pending)
+        cut = match.start() if match else len(pending)
+        ready, pending = pending[:cut], pending[cut:]
+        if ready:
+            yield ready
+    if pending:
+        yield pending
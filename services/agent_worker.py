@@ -0,0 +1,144 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+from services import agent_response, bedrock_agent_runtime, cancellation, latency_analyzer, query_router, token_usage, trace_index
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Agent turns consumed in the background at once, further turns queue until a worker frees up
+max_workers = int(os.environ.get("AGENT_WORKER_MAX_WORKERS", "32"))
+
+_executor = None
+_executor_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"started": 0, "completed": 0, "cancelled": 0, "failed": 0, "running": 0, "cancelled_output_tokens": 0}
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent-worker")
+    return _executor
+
+
+def _count(**deltas):
+    with _stats_lock:
+        for stat, delta in deltas.items():
+            _stats[stat] += delta
+
+
+class AgentRun:
+    """
+    Handle of one agent turn consumed on a background worker. The page polls the text
+    streamed so far and may cancel, which interrupts the upstream read right away (see
+    services/cancellation.py) and keeps the partial answer, its trace and its token usage.
+    """
+
+    def __init__(self, events, route=query_router.AGENT):
+        self.run_id = str(uuid.uuid4())
+        self.route = route
+        self.response = bedrock_agent_runtime.new_response()
+        self.timer = latency_analyzer.TurnTimer()
+        self.usage = token_usage.TurnUsage()
+        self.trace = trace_index.TraceIndex()
+        self.cancelled = False
+        self.error = None
+        self._events = events
+        self._pieces = []
+        self._lock = threading.Lock()
+        self._cancel_requested = threading.Event()
+        self._cancel_scope = cancellation.CancelScope()
+        self._done = threading.Event()
+
+    def _until_cancelled(self, events):
+        try:
+            while not self._cancel_requested.is_set():
+                try:
+                    event = next(events, None)
+                except Exception:
+                    # cancel() interrupted a blocked read, the stream fails on the closed connection or
+                    # raises cancellation.Cancelled when the turn stopped following a coalesced call
+                    if not self._cancel_requested.is_set():
+                        raise
+                    break
+                if event is None:
+                    # An interrupted stream may also end quietly
+                    if not self._cancel_requested.is_set():
+                        return
+                    break
+                yield event
+            self.cancelled = True
+        finally:
+            # Closing the chain releases the HTTP connection of the event stream
+            events.close()
+
+    def _run(self):
+        try:
+            with cancellation.active(self._cancel_scope):
+                events = latency_analyzer.timed(self._events, self.timer)
+                events = token_usage.metered(events, self.usage)
+                events = trace_index.indexed(events, self.trace)
+                text = agent_response.rewrite_citation_markers(
+                    bedrock_agent_runtime.iter_output_text(self._until_cancelled(events), self.response)
+                )
+                for piece in text:
+                    with self._lock:
+                        self._pieces.append(piece)
+        except Exception as e:
+            logger.error(f"Agent run {self.run_id} failed: {e}")
+            self.error = e
+        finally:
+            if self.error is not None:
+                _count(failed=1, running=-1)
+            elif self.cancelled:
+                _count(cancelled=1, running=-1, cancelled_output_tokens=self.usage.total()["output_tokens"])
+            else:
+                _count(completed=1, running=-1)
+            self._done.set()
+
+    def text(self):
+        # The answer text streamed so far, citation markers already rewritten
+        with self._lock:
+            return "".join(self._pieces)
+
+    def cancel(self):
+        if not self._done.is_set():
+            self._cancel_requested.set()
+            self._cancel_scope.cancel()
+
+    def wait(self, timeout=None):
+        """
+        :return: Returns True once the run has finished, completed, cancelled or failed
+        """
+        return self._done.wait(timeout)
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+
+def start(agent_id, agent_alias_id, session_id, prompt, first_turn=False, client=None, retrieval_filter=None):
+    """
+    Starts a chat turn on a background worker, routed to the agent or the Knowledge Base
+    by services/query_router.py
+    :param retrieval_filter: Optional metadata filter, see document_metadata.build_filter
+    :return: Returns the AgentRun handle to poll or cancel
+    """
+    decision = query_router.classify(session_id, prompt)
+    run = AgentRun(
+        query_router.stream(decision, agent_id, agent_alias_id, session_id, prompt, client=client, first_turn=first_turn,
+                            retrieval_filter=retrieval_filter),
+        route=decision["route"]
+    )
+    _count(started=1, running=1)
+    get_executor().submit(run._run)
+    return run
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
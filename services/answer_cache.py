@@ -0,0 +1,209 @@
+from collections import OrderedDict
+import json
+import logging
+import math
+import os
+import re
+from services import prompt_rules
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration, see .env_sample
+enabled = os.environ.get("ANSWER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+max_entries = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "512"))
+ttl_seconds = float(os.environ.get("ANSWER_CACHE_TTL_SECONDS", "3600"))
+similarity_threshold = float(os.environ.get("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95"))
+
+_punctuation = re.compile(r"[^\w\s]")
+_whitespace = re.compile(r"\s+")
+# Tokens that change the answer however similar the rest of the prompt is, e.g. Q1 vs Q2 or a negation
+_negations = {"not", "no", "never", "without", "nor", "none", "cannot", "don", "doesn", "isn", "aren", "wasn",
+              "weren", "won", "didn", "shouldn", "couldn", "wouldn", "excluding", "except"}
+
+
+def normalize_prompt(prompt):
+    # Case, punctuation and spacing do not change the question being asked
+    prompt = _punctuation.sub(" ", prompt.lower())
+    return _whitespace.sub(" ", prompt).strip()
+
+
+def vectorize(normalized_prompt):
+    """
+    Local bag of word unigrams and bigrams, L2 normalized. Good enough to catch
+    re-phrasings of the same question without calling an embedding model.
+    """
+    tokens = normalized_prompt.split()
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    vector = {}
+    for feature in features:
+        vector[feature] = vector.get(feature, 0.0) + 1.0
+    norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+    if norm:
+        for feature in vector:
+            vector[feature] /= norm
+    return vector
+
+
+def exact_tokens(normalized_prompt):
+    # Numbers, quarters, years and negations must match exactly for a similar hit
+    return frozenset(token for token in normalized_prompt.split()
+                     if token in _negations or any(char.isdigit() for char in token))
+
+
+def cacheable(prompt, first_turn):
+    """
+    Only answers that do not depend on the session are shared: the first turn of a session,
+    and no request for the agent's actions, e.g. a password reset whose Lambda must run
+    """
+    return first_turn and prompt_rules.agent_rule(prompt) is None
+
+
+def cosine_similarity(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(feature, 0.0) for feature, weight in a.items())
+
+
+def agent_namespace(agent_id, agent_alias_id):
+    return f"agent:{agent_id}:{agent_alias_id}"
+
+
+def knowledge_base_namespace(knowledge_base_id):
+    return f"kb:{knowledge_base_id}"
+
+
+def filtered_namespace(namespace, retrieval_filter):
+    # Answers retrieved from a subset of the documents are kept apart from unfiltered ones
+    if not retrieval_filter:
+        return namespace
+    return f"{namespace}|{json.dumps(retrieval_filter, sort_keys=True)}"
+
+
+class _Entry:
+    __slots__ = ("namespace", "value", "vector", "exact", "expires_at")
+
+    def __init__(self, namespace, value, vector, exact, expires_at):
+        self.namespace = namespace
+        self.value = value
+        self.vector = vector
+        self.exact = exact
+        self.expires_at = expires_at
+
+
+class AnswerCache:
+    """
+    Answers keyed by (namespace, normalized prompt) with LRU and TTL eviction. Lookups try
+    the exact key first and then the most similar prompt cached in the same namespace
+    with the same numbers and negations.
+    Cached values are shared between sessions and must be treated as read-only.
+    """
+
+    def __init__(self, max_entries=max_entries, ttl_seconds=ttl_seconds, similarity_threshold=similarity_threshold):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = {"exact_hits": 0, "similar_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def _expire(self, now):
+        expired = [key for key, entry in self._entries.items() if entry.expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+        self._stats["evictions"] += len(expired)
+
+    def get(self, namespace, prompt):
+        """
+        Returns the cached value for the prompt, or None on a miss
+        :param namespace: Cache namespace, see agent_namespace and knowledge_base_namespace
+        :param prompt: The question as typed by the user
+        """
+        normalized = normalize_prompt(prompt)
+        with self._lock:
+            self._expire(time.monotonic())
+            key = (namespace, normalized)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["exact_hits"] += 1
+                return entry.value
+
+            if self.similarity_threshold < 1:
+                vector = vectorize(normalized)
+                exact = exact_tokens(normalized)
+                best_key, best_score = None, self.similarity_threshold
+                for candidate_key, candidate in self._entries.items():
+                    if candidate.namespace != namespace or candidate.exact != exact:
+                        continue
+                    score = cosine_similarity(vector, candidate.vector)
+                    if score >= best_score:
+                        best_key, best_score = candidate_key, score
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    self._stats["similar_hits"] += 1
+                    logger.debug(f"Similar cache hit ({best_score:.3f}) for '{normalized}' -> '{best_key[1]}'")
+                    return self._entries[best_key].value
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, namespace, prompt, value):
+        normalized = normalize_prompt(prompt)
+        entry = _Entry(namespace, value, vectorize(normalized), exact_tokens(normalized), time.monotonic() + self.ttl_seconds)
+        with self._lock:
+            key = (namespace, normalized)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, namespace=None):
+        """
+        Drops cached answers, e.g. after new documents are added to the knowledge base
+        :param namespace: Only drop this namespace and its filtered namespaces, or everything when None
+        """
+        with self._lock:
+            if namespace is None:
+                dropped = len(self._entries)
+                self._entries.clear()
+            else:
+                keys = [key for key, entry in self._entries.items()
+                        if entry.namespace == namespace or entry.namespace.startswith(f"{namespace}|")]
+                for key in keys:
+                    del self._entries[key]
+                dropped = len(keys)
+            self._stats["invalidations"] += 1
+        logger.info(f"Invalidated {dropped} cached answers")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["exact_hits"] + stats["similar_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["exact_hits"] + stats["similar_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+cache = AnswerCache()
+
+
+def get(namespace, prompt):
+    if not enabled:
+        return None
+    return cache.get(namespace, prompt)
+
+
+def put(namespace, prompt, value):
+    if enabled:
+        cache.put(namespace, prompt, value)
+
+
+def invalidate(namespace=None):
+    cache.invalidate(namespace)
+
+
+def stats():
+    return cache.stats()
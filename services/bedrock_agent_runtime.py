@@ -1,55 +1,222 @@
-import boto3
+
 from botocore.exceptions import ClientError
+import json
 import logging
+import os
+from services import answer_cache, cancellation, client_registry, document_metadata, input_filter, rate_limiter, request_coalescer, session_store
 
 logger = logging.getLogger(__name__)
 
+trace_types = ["guardrailTrace", "preProcessingTrace", "orchestrationTrace", "postProcessingTrace"]
+# Most recent turns handed to the agent as conversationHistory, older ones are dropped
+conversation_history_max_turns = 10
+
+_warned_unfiltered = False
+
+
+def get_knowledge_base_id():
+    # The Knowledge Base attached to the agent, read per call like knowledge_base_runtime.get_knowledge_base_id
+    knowledge_base_id = os.environ.get("KNOWLEDGE_BASE_ID")
+    return None if not knowledge_base_id or knowledge_base_id.startswith("<") else knowledge_base_id
+
 
-def invoke_agent(agent_id, agent_alias_id, session_id, prompt):
+def new_response():
+    return {
+        "output_text": "",
+        "citations": [],
+        "trace": {}
+    }
+
+
+def parse_completion(completion):
+    """
+    Turns the raw completion event stream into typed events as they arrive:
+    {"type": "chunk", "text": ...}, {"type": "citation", "citations": [...]} and
+    {"type": "trace", "trace_type": ..., "mapped_trace_type": ..., "trace": ...}
+    """
+    # A cancelled turn interrupts the read, see services/cancellation.py
+    cancellation.on_cancel(lambda: cancellation.close_stream(completion))
     try:
-        client = boto3.session.Session().client(service_name="bedrock-agent-runtime")
+        yield from _parse_events(completion)
+    finally:
+        # A consumer that stops early gets the HTTP connection closed instead of left to the garbage collector
+        if hasattr(completion, "close"):
+            completion.close()
+
+
+def _parse_events(completion):
+    has_guardrail_trace = False
+    for event in completion:
+        if "chunk" in event:
+            chunk = event["chunk"]
+            yield {"type": "chunk", "text": chunk["bytes"].decode()}
+            if "attribution" in chunk:
+                yield {"type": "citation", "citations": chunk["attribution"]["citations"]}
+
+        # Extract trace information from all events
+        if "trace" in event:
+            for trace_type in trace_types:
+                if trace_type in event["trace"]["trace"]:
+                    mapped_trace_type = trace_type
+                    if trace_type == "guardrailTrace":
+                        if not has_guardrail_trace:
+                            has_guardrail_trace = True
+                            mapped_trace_type = "preGuardrailTrace"
+                        else:
+                            mapped_trace_type = "postGuardrailTrace"
+                    yield {
+                        "type": "trace",
+                        "trace_type": trace_type,
+                        "mapped_trace_type": mapped_trace_type,
+                        "trace": event["trace"]["trace"][trace_type]
+                    }
+
+
+def add_event(response, event):
+    # Accumulates one typed event into the batch response shape
+    if event["type"] == "chunk":
+        response["output_text"] += event["text"]
+    elif event["type"] == "citation":
+        response["citations"] += event["citations"]
+    elif event["type"] == "session":
+        # Knowledge Base streams report the session id to continue the conversation with
+        response["session_id"] = event["session_id"]
+    elif event["type"] == "trace":
+        trace = response["trace"]
+        if event["mapped_trace_type"] not in trace:
+            trace[event["mapped_trace_type"]] = []
+        trace[event["mapped_trace_type"]].append(event["trace"])
+
+
+def iter_output_text(events, response):
+    """
+    Yields the answer text chunk by chunk while accumulating every event into response,
+    so that once the stream is exhausted response equals what invoke_agent returns
+    """
+    for event in events:
+        add_event(response, event)
+        if event["type"] == "chunk":
+            yield event["text"]
+
+
+def cached_events(cached):
+    # Replays a cached answer as typed events, there is no trace for a cache hit
+    yield {"type": "chunk", "text": cached["output_text"]}
+    if len(cached["citations"]) > 0:
+        yield {"type": "citation", "citations": cached["citations"]}
+
+
+def unrecorded_turns(session_id):
+    """
+    :return: Returns the conversationHistory messages of turns the agent session has not
+        seen, i.e. cached, coalesced or Knowledge Base routed answers
+    """
+    return session_store.store.load_state(session_id).get("agent_history", [])
+
+
+def record_unrecorded_turn(session_id, prompt, answer):
+    # Kept in the session store until the next agent call of the session hands it over
+    messages = unrecorded_turns(session_id) + [
+        {"role": "user", "content": [{"text": prompt}]},
+        {"role": "assistant", "content": [{"text": answer}]}
+    ]
+    session_store.store.update_state(session_id, agent_history=messages[-2 * conversation_history_max_turns:])
+
+
+def upstream_events(agent_id, agent_alias_id, session_id, prompt, client=None, retrieval_filter=None,
+                    conversation_history=None):
+    client = client or client_registry.get_client("bedrock-agent-runtime")
+    session_state = {}
+    knowledge_base_id = get_knowledge_base_id()
+    if retrieval_filter and knowledge_base_id:
+        session_state.update(document_metadata.agent_session_state(knowledge_base_id, retrieval_filter))
+    elif retrieval_filter:
+        # Without the Knowledge Base id the filter cannot be applied, the agent searches every document
+        global _warned_unfiltered
+        if not _warned_unfiltered:
+            _warned_unfiltered = True
+            logger.warning("KNOWLEDGE_BASE_ID is not set, the agent ignores the retrieval filter")
+    if conversation_history:
+        # Earlier turns answered without this agent session, see unrecorded_turns
+        session_state["conversationHistory"] = {"messages": conversation_history}
+    request = {"sessionState": session_state} if session_state else {}
+
+    def start_stream():
         # See https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/bedrock-agent-runtime/client/invoke_agent.html
         response = client.invoke_agent(
             agentId=agent_id,
             agentAliasId=agent_alias_id,
             enableTrace=True,
             sessionId=session_id,
-            inputText=prompt
+            inputText=prompt,
+            **request
         )
+        return parse_completion(response.get("completion"))
+
+    yield from rate_limiter.stream(rate_limiter.agent_key(agent_id), start_stream)
+
+
+def invoke_agent_stream(agent_id, agent_alias_id, session_id, prompt, client=None, first_turn=False, retrieval_filter=None):
+    """
+    Yields the typed events of one agent turn. Cached answers to first turns are replayed
+    (see answer_cache.cacheable), and identical prompts in flight from other sessions share one upstream call when the coalescing
+    policy allows it (see services/request_coalescer.py). The agent session records neither,
+    both are handed to it with its next call (see unrecorded_turns). Malicious prompts are answered
+    locally with the rejection message (see services/input_filter.py)
+    :param retrieval_filter: Optional metadata filter applied to the agent's Knowledge Base searches,
+        see document_metadata.build_filter
+    """
+    if not input_filter.allowed(prompt):
+        yield {"type": "chunk", "text": input_filter.rejection_message}
+        return
 
-        output_text = ""
-        citations = []
-        trace = {}
-
-        has_guardrail_trace = False
-        for event in response.get("completion"):
-            # Combine the chunks to get the output text
-            if "chunk" in event:
-                chunk = event["chunk"]
-                output_text += chunk["bytes"].decode()
-                if "attribution" in chunk:
-                    citations += chunk["attribution"]["citations"]
-
-            # Extract trace information from all events
-            if "trace" in event:
-                for trace_type in ["guardrailTrace", "preProcessingTrace", "orchestrationTrace", "postProcessingTrace"]:
-                    if trace_type in event["trace"]["trace"]:
-                        mapped_trace_type = trace_type
-                        if trace_type == "guardrailTrace":
-                            if not has_guardrail_trace:
-                                has_guardrail_trace = True
-                                mapped_trace_type = "preGuardrailTrace"
-                            else:
-                                mapped_trace_type = "postGuardrailTrace"
-                        if trace_type not in trace:
-                            trace[mapped_trace_type] = []
-                        trace[mapped_trace_type].append(event["trace"]["trace"][trace_type])
+    namespace = answer_cache.filtered_namespace(answer_cache.agent_namespace(agent_id, agent_alias_id), retrieval_filter)
+    cacheable = answer_cache.cacheable(prompt, first_turn)
+    cached = answer_cache.get(namespace, prompt) if cacheable else None
+    if cached is not None:
+        yield from cached_events(cached)
+        record_unrecorded_turn(session_id, prompt, cached["output_text"])
+        return
+
+    history = unrecorded_turns(session_id)
+
+    def start_upstream():
+        return upstream_events(agent_id, agent_alias_id, session_id, prompt, client, retrieval_filter, history)
+
+    # A session with unrecorded turns sends its own history, its request is not identical to anyone else's
+    if request_coalescer.allowed(first_turn) and not history:
+        key = (agent_id, agent_alias_id, json.dumps(retrieval_filter, sort_keys=True), answer_cache.normalize_prompt(prompt))
+        events = request_coalescer.stream(key, start_upstream)
+    else:
+        events = start_upstream()
+
+    answer = new_response()
+    coalesced = False
+    for event in events:
+        coalesced = coalesced or event.get("coalesced", False)
+        if event["type"] != "trace":
+            add_event(answer, event)
+        yield event
+
+    # Only complete answers are cached or recorded. A stream abandoned part way never reaches this
+    # point, one interrupted by Stop may end quietly (see services/cancellation.py)
+    if cancellation.cancelled():
+        return
+    if coalesced:
+        record_unrecorded_turn(session_id, prompt, answer["output_text"])
+    elif history:
+        session_store.store.update_state(session_id, agent_history=[])
+    if cacheable:
+        answer_cache.put(namespace, prompt, {"output_text": answer["output_text"], "citations": answer["citations"]})
+
+
+def invoke_agent(agent_id, agent_alias_id, session_id, prompt, client=None, first_turn=False, retrieval_filter=None):
+    try:
+        response = new_response()
+        for event in invoke_agent_stream(agent_id, agent_alias_id, session_id, prompt, client, first_turn, retrieval_filter):
+            add_event(response, event)
 
     except ClientError as e:
         raise
 
-    return {
-        "output_text": output_text,
-        "citations": citations,
-        "trace": trace
-    }
\ No newline at end of file
+    return response
@@ -0,0 +1,64 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+from services import bedrock_agent_runtime
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on blocking boto3 reads in flight, shared by every session in the process
+max_workers = int(os.environ.get("BEDROCK_ASYNC_MAX_WORKERS", "32"))
+
+_executor = None
+_executor_lock = threading.Lock()
+_end_of_stream = object()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bedrock-agent")
+    return _executor
+
+
+async def invoke_agent_stream(agent_id, agent_alias_id, session_id, prompt, client=None, first_turn=False,
+                              retrieval_filter=None, executor=None):
+    """
+    Async iterator over the typed events of bedrock_agent_runtime.invoke_agent_stream.
+    Each blocking read of the event stream runs on a bounded executor, which keeps the event
+    loop free and caps the threads used by all sessions. A read blocks its worker thread until
+    the next event arrives, including while the agent is still thinking, so a turn holds a
+    thread for nearly all of its duration. Sessions beyond max_workers wait for a free thread.
+    :param first_turn: See bedrock_agent_runtime.invoke_agent_stream
+    :param retrieval_filter: See bedrock_agent_runtime.invoke_agent_stream
+    """
+    loop = asyncio.get_running_loop()
+    executor = executor or get_executor()
+    events = bedrock_agent_runtime.invoke_agent_stream(
+        agent_id, agent_alias_id, session_id, prompt, client, first_turn, retrieval_filter
+    )
+    try:
+        while True:
+            event = await loop.run_in_executor(executor, next, events, _end_of_stream)
+            if event is _end_of_stream:
+                break
+            yield event
+    finally:
+        # Release the HTTP connection if the consumer stops early
+        try:
+            await loop.run_in_executor(executor, events.close)
+        except ValueError:
+            # Cancelled while a read was still running on the executor, the stream is dropped when it returns
+            logger.debug("Event stream still being read, skipping close")
+
+
+async def invoke_agent(agent_id, agent_alias_id, session_id, prompt, client=None, first_turn=False,
+                       retrieval_filter=None, executor=None):
+    response = bedrock_agent_runtime.new_response()
+    async for event in invoke_agent_stream(agent_id, agent_alias_id, session_id, prompt, client, first_turn,
+                                           retrieval_filter, executor):
+        bedrock_agent_runtime.add_event(response, event)
+    return response
@@ -0,0 +1,90 @@
+from contextlib import contextmanager
+import contextvars
+import logging
+import socket
+import threading
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar("cancel_scope", default=None)
+
+
+class Cancelled(Exception):
+    """
+    Raised into a stream the cancelled turn stopped following, so nothing downstream
+    mistakes the partial answer for a complete one
+    """
+
+
+class CancelScope:
+    """
+    Cancellation of one chat turn from another thread. Code reading an upstream stream on
+    behalf of the turn registers how to interrupt it, cancel() then runs every registered
+    callback so a read blocked on the network returns instead of waiting for the next event.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self.cancelled = False
+
+    def add(self, callback):
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.debug(f"Cancel callback failed: {e}")
+
+
+@contextmanager
+def active(scope):
+    # Makes scope the cancel scope of the code run by the current thread until the block exits
+    token = _current.set(scope)
+    try:
+        yield scope
+    finally:
+        _current.reset(token)
+
+
+def cancelled():
+    """
+    :return: Returns True when the turn run by the current thread was cancelled. An interrupted
+        stream may end quietly, so callers check this before treating an answer as complete
+    """
+    scope = _current.get()
+    return scope is not None and scope.cancelled
+
+
+def on_cancel(callback):
+    # Registers callback with the cancel scope of the current thread, if there is one
+    scope = _current.get()
+    if scope is not None:
+        scope.add(callback)
+
+
+def close_stream(stream):
+    """
+    Interrupts a botocore EventStream being read by another thread. Closing the response
+    alone does not wake a thread blocked in recv, shutting the socket down does.
+    """
+    raw = getattr(stream, "_raw_stream", stream)
+    sock = getattr(getattr(raw, "_connection", None), "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    if hasattr(stream, "close"):
+        stream.close()
@@ -0,0 +1,230 @@
+import base64
+import datetime
+import functools
+import glob
+import gzip
+import hashlib
+import itertools
+import json
+import logging
+import os
+from services import cancellation
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Record/replay of Bedrock runtime traffic, see .env_sample
+#   off    - talk to Bedrock (default)
+#   record - talk to Bedrock and write every response, with its event timings, to a cassette
+#   replay - serve responses from cassettes without any network call
+mode = os.environ.get("BEDROCK_CASSETTE_MODE", "off")
+cassette_dir = os.environ.get("BEDROCK_CASSETTE_DIR", "cassettes")
+# Multiplier for recorded delays on replay, 0 replays as fast as possible
+time_scale = float(os.environ.get("BEDROCK_CASSETTE_TIME_SCALE", "1.0"))
+# exact - replay the cassette recorded for the same request
+# any   - cycle through every cassette of the operation, for load tests with arbitrary prompts
+match = os.environ.get("BEDROCK_CASSETTE_MATCH", "exact")
+
+services = {"bedrock-agent-runtime"}
+recorded_operations = {"invoke_agent", "retrieve_and_generate", "retrieve_and_generate_stream", "retrieve"}
+stream_keys = ("completion", "stream")
+# Request parameters that differ between otherwise identical requests. Of sessionState only the
+# Knowledge Base configurations change the answer, they stay part of the request, see stable_params
+volatile_params = {"sessionId", "sessionState"}
+
+
+class CassetteMissError(LookupError):
+    pass
+
+
+def _encode(value):
+    if isinstance(value, bytes):
+        return {"__bytes__": base64.b64encode(value).decode()}
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"Cannot record value of type {type(value).__name__}")
+
+
+def _decode(obj):
+    if "__bytes__" in obj and len(obj) == 1:
+        return base64.b64decode(obj["__bytes__"])
+    return obj
+
+
+def stable_params(params):
+    # The parameters identifying a request, e.g. the same question with another retrieval filter is another request
+    stable = {key: value for key, value in params.items() if key not in volatile_params}
+    knowledge_base_configurations = (params.get("sessionState") or {}).get("knowledgeBaseConfigurations")
+    if knowledge_base_configurations:
+        stable["sessionState"] = {"knowledgeBaseConfigurations": knowledge_base_configurations}
+    return stable
+
+
+def request_key(operation, params):
+    stable = stable_params(params)
+    digest = hashlib.sha1(json.dumps(stable, sort_keys=True, default=_encode).encode()).hexdigest()[:16]
+    return f"{operation}-{digest}"
+
+
+def write_cassette(directory, key, interaction):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{key}.json.gz")
+    with gzip.open(path, "wt") as file:
+        json.dump(interaction, file, separators=(",", ":"), default=_encode)
+    logger.info(f"Recorded {interaction['operation']} to {path}")
+
+
+def read_cassette(path):
+    with gzip.open(path, "rt") as file:
+        return json.load(file, object_hook=_decode)
+
+
+class RecordingStream:
+    """
+    Passes the events of a response stream through while recording when each arrived, and
+    hands them to on_complete once the stream ends. Streams closed or abandoned part way are
+    not recorded. The wrapped EventStream stays reachable as _raw_stream, so a cancelled turn
+    can shut its socket down while recording, see cancellation.close_stream.
+    """
+
+    def __init__(self, stream, on_complete):
+        self._stream = stream
+        self._raw_stream = getattr(stream, "_raw_stream", stream)
+        self._on_complete = on_complete
+        self._closed = False
+        self._released = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        events = []
+        last = time.monotonic()
+        complete = False
+        try:
+            for event in self._stream:
+                now = time.monotonic()
+                events.append([now - last, event])
+                last = now
+                yield event
+            # A stream interrupted by close or by a cancelled turn may end quietly, see services/cancellation.py
+            complete = not self._closed and not cancellation.cancelled()
+        finally:
+            # A consumer that stops early gets the HTTP connection closed, see bedrock_agent_runtime.parse_completion
+            self._release()
+        if complete:
+            self._on_complete(events)
+
+    def close(self):
+        # Safe to call from another thread while a read is blocked, unlike closing a generator
+        self._closed = True
+        self._release()
+
+    def _release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        if hasattr(self._stream, "close"):
+            self._stream.close()
+
+
+class CassetteClient:
+    """
+    Wraps a bedrock-agent-runtime client and records or replays its responses. Event
+    streams are stored event by event together with the delay before each event, so a
+    replay reproduces time to first token and the trace volume of real traffic.
+    """
+
+    def __init__(self, client, mode=mode, directory=cassette_dir, time_scale=time_scale, match=match):
+        self._client = client
+        self._mode = mode
+        self._directory = directory
+        self._time_scale = time_scale
+        self._match = match
+        self._lock = threading.Lock()
+        self._loaded = {}
+        self._cycles = {}
+
+    def __getattr__(self, name):
+        if name in recorded_operations:
+            if self._mode == "record":
+                return functools.partial(self._record, name)
+            if self._mode == "replay":
+                return functools.partial(self._replay, name)
+        return getattr(self._client, name)
+
+    def _record(self, operation, **params):
+        started = time.monotonic()
+        response = getattr(self._client, operation)(**params)
+        interaction = {
+            "operation": operation,
+            "request": stable_params(params),
+            "response_delay": time.monotonic() - started,
+            "recorded_at": datetime.datetime.now(datetime.timezone.utc).isoformat()
+        }
+        key = request_key(operation, params)
+        for stream_key in stream_keys:
+            if stream_key in response:
+                interaction["stream_key"] = stream_key
+                interaction["response"] = {k: v for k, v in response.items() if k != stream_key}
+                response = dict(response)
+                response[stream_key] = self._record_stream(response[stream_key], interaction, key)
+                return response
+        interaction["response"] = response
+        write_cassette(self._directory, key, interaction)
+        return response
+
+    def _record_stream(self, stream, interaction, key):
+        return RecordingStream(stream, lambda events: self._write_events(interaction, key, events))
+
+    def _write_events(self, interaction, key, events):
+        interaction["events"] = events
+        write_cassette(self._directory, key, interaction)
+
+    def _load(self, path):
+        with self._lock:
+            if path not in self._loaded:
+                self._loaded[path] = read_cassette(path)
+            return self._loaded[path]
+
+    def _find(self, operation, params):
+        if self._match == "any":
+            with self._lock:
+                if operation not in self._cycles:
+                    paths = sorted(glob.glob(os.path.join(self._directory, f"{operation}-*.json.gz")))
+                    if len(paths) == 0:
+                        raise CassetteMissError(f"No {operation} cassettes in {self._directory}")
+                    self._cycles[operation] = itertools.cycle(paths)
+                path = next(self._cycles[operation])
+        else:
+            path = os.path.join(self._directory, f"{request_key(operation, params)}.json.gz")
+            if not os.path.exists(path):
+                raise CassetteMissError(f"No cassette for {operation} request at {path}")
+        return self._load(path)
+
+    def _sleep(self, seconds):
+        if self._time_scale > 0 and seconds > 0:
+            time.sleep(seconds * self._time_scale)
+
+    def _replay(self, operation, **params):
+        interaction = self._find(operation, params)
+        self._sleep(interaction["response_delay"])
+        response = dict(interaction["response"])
+        if "sessionId" in params and "sessionId" in response:
+            response["sessionId"] = params["sessionId"]
+        if "stream_key" in interaction:
+            response[interaction["stream_key"]] = self._replay_stream(interaction["events"])
+        return response
+
+    def _replay_stream(self, events):
+        for delay, event in events:
+            self._sleep(delay)
+            yield event
+
+
+def wrap(service_name, client):
+    # Hook used by the client registry, returns the client unchanged when cassettes are off
+    if mode not in ("record", "replay") or service_name not in services:
+        return client
+    logger.info(f"Cassette {mode} mode for {service_name} using {cassette_dir}")
+    return CassetteClient(client)
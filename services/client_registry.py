@@ -0,0 +1,145 @@
+import boto3
+from botocore.config import Config
+import logging
+import os
+from services import cassette
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Size of the urllib3 connection pool kept by every client and whether idle sockets use TCP keep-alive
+max_pool_connections = int(os.environ.get("BEDROCK_MAX_POOL_CONNECTIONS", "50"))
+tcp_keepalive = os.environ.get("BEDROCK_TCP_KEEPALIVE", "true").lower() in ("1", "true", "yes")
+
+# Per-service client settings. Runtime calls that are throttled or fail transiently (5xx,
+# ModelNotReadyException, dropped connections) are retried by services/rate_limiter.py under
+# its retry budget, so the SDK must not retry them again underneath
+service_configs = {
+    "bedrock-agent-runtime": Config(retries={"max_attempts": 1, "mode": "standard"})
+}
+
+
+def _config_key(config):
+    # Clients built with different settings must not be shared, Config itself is not hashable
+    if config is None:
+        return None
+    options = getattr(config, "_user_provided_options", None)
+    if options is None:
+        options = vars(config)
+    return tuple(sorted((name, repr(value)) for name, value in options.items()))
+
+
+class ClientRegistry:
+    """
+    Process-wide cache of boto3 clients keyed by (service, region, profile).
+    Clients are thread-safe once built, so every Streamlit session and script shares
+    the same client, its resolved credentials and its pool of open connections.
+    """
+
+    def __init__(self, max_pool_connections=max_pool_connections, tcp_keepalive=tcp_keepalive):
+        self.max_pool_connections = max_pool_connections
+        self.tcp_keepalive = tcp_keepalive
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._clients = {}
+        self._clients_created = 0
+        self._client_reuses = 0
+
+    def _session(self, profile_name):
+        # boto3 sessions are not thread-safe, callers must hold the lock
+        if profile_name not in self._sessions:
+            self._sessions[profile_name] = boto3.session.Session(profile_name=profile_name)
+        return self._sessions[profile_name]
+
+    def get_client(self, service_name, region_name=None, profile_name=None, config=None):
+        """
+        Returns a shared client, creating it on first use
+        :param service_name: The boto3 service name, e.g. bedrock-agent-runtime
+        :param region_name: The region of the service, defaults to REGION_NAME or the profile's region
+        :param profile_name: The shared credentials profile, defaults to AWS_PROFILE
+        :param config: Optional botocore Config merged over the pool settings, part of the cache key
+        :return: Returns the boto3 client
+        """
+        region_name = region_name or os.environ.get("REGION_NAME")
+        profile_name = profile_name or os.environ.get("AWS_PROFILE")
+        key = (service_name, region_name, profile_name, _config_key(config))
+
+        client = self._clients.get(key)
+        if client is not None:
+            with self._lock:
+                self._client_reuses += 1
+            return client
+
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._client_reuses += 1
+                return client
+
+            client_config = Config(
+                max_pool_connections=self.max_pool_connections,
+                tcp_keepalive=self.tcp_keepalive
+            )
+            if service_name in service_configs:
+                client_config = client_config.merge(service_configs[service_name])
+            if config is not None:
+                client_config = client_config.merge(config)
+            client = self._session(profile_name).client(
+                service_name=service_name,
+                region_name=region_name,
+                config=client_config
+            )
+            client = cassette.wrap(service_name, client)
+            self._clients[key] = client
+            self._clients_created += 1
+            logger.info(f"Created {service_name} client for region={region_name} profile={profile_name}")
+        return client
+
+    def connection_stats(self):
+        """
+        Sums the urllib3 pool counters of every cached client. A request that did not
+        need a new connection reused a kept-alive one.
+        """
+        connections_created = 0
+        requests_sent = 0
+        for client in list(self._clients.values()):
+            try:
+                pools = client._endpoint.http_session._manager.pools
+                for pool_key in list(pools.keys()):
+                    pool = pools[pool_key]
+                    connections_created += pool.num_connections
+                    requests_sent += pool.num_requests
+            except (AttributeError, KeyError):
+                # Internals differ between botocore versions, skip clients we cannot inspect
+                continue
+        return {
+            "connections_created": connections_created,
+            "requests_sent": requests_sent,
+            "connection_reuses": max(requests_sent - connections_created, 0)
+        }
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "clients": len(self._clients),
+                "clients_created": self._clients_created,
+                "client_reuses": self._client_reuses
+            }
+        stats.update(self.connection_stats())
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+            self._sessions.clear()
+
+
+registry = ClientRegistry()
+
+
+def get_client(service_name, region_name=None, profile_name=None, config=None):
+    return registry.get_client(service_name, region_name, profile_name, config)
+
+
+def stats():
+    return registry.stats()
@@ -0,0 +1,140 @@
+from botocore.exceptions import BotoCoreError, ClientError
+import hashlib
+import json
+import logging
+import os
+from services import document_metadata
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Local record of the documents uploaded to the data source bucket, see .env_sample
+manifest_path = os.environ.get("DOCUMENT_MANIFEST_PATH", "document_manifest.json")
+hash_chunk_size = 1024 * 1024
+
+
+def content_hash(fileobj, chunk_size=hash_chunk_size):
+    """
+    SHA-256 of a file-like object, read chunk by chunk and rewound for the upload
+    """
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(chunk_size), b""):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+class DocumentManifest:
+    """
+    Maps the content hash of every uploaded document to its S3 key, so the same content is
+    not uploaded, chunked and embedded twice. Documents are grouped by their original file
+    name, an upload with new content under the same name supersedes the earlier versions.
+    """
+
+    def __init__(self, path=manifest_path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._documents = {}
+        if path and os.path.exists(path):
+            with open(path, "r") as file:
+                self._documents = json.load(file).get("documents", {})
+
+    def _save(self):
+        # Callers must hold the lock. Written to a temporary file first, a crash never leaves half a manifest
+        if not self.path:
+            return
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump({"documents": self._documents}, file, indent=1, sort_keys=True)
+        os.replace(temporary_path, self.path)
+
+    def find(self, digest):
+        with self._lock:
+            entry = self._documents.get(digest)
+            return dict(entry) if entry else None
+
+    def exists(self, digest, bucket, client):
+        """
+        :return: Returns the manifest entry of the content if its S3 object is still there, else None
+        """
+        entry = self.find(digest)
+        if entry is None:
+            return None
+        try:
+            client.head_object(Bucket=bucket, Key=entry["key"])
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey", "NotFound"):
+                raise
+            # Deleted outside the app, upload it again
+            logger.info(f"{entry['key']} is in the manifest but not in {bucket}, forgetting it")
+            self.remove(digest)
+            return None
+        return entry
+
+    def versions(self, name):
+        """
+        :return: Returns {digest: entry} of every recorded upload of this file name
+        """
+        with self._lock:
+            return {digest: dict(entry) for digest, entry in self._documents.items() if entry["name"] == name}
+
+    def add(self, digest, key, name, size, metadata=None):
+        with self._lock:
+            self._documents[digest] = {
+                "key": key, "name": name, "size": size, "uploaded_at": time.time(), "metadata": metadata or {}
+            }
+            self._save()
+
+    def remove(self, digest):
+        with self._lock:
+            if self._documents.pop(digest, None) is not None:
+                self._save()
+
+    def attribute_values(self):
+        """
+        :return: Returns {attribute: sorted values} over the metadata of every recorded document
+        """
+        values = {attribute: set() for attribute in document_metadata.attributes}
+        with self._lock:
+            for entry in self._documents.values():
+                for attribute, value in entry.get("metadata", {}).items():
+                    if attribute in values:
+                        values[attribute].add(value)
+        return {attribute: sorted(attribute_values) for attribute, attribute_values in values.items()}
+
+    def replace_superseded(self, digest, bucket, client):
+        """
+        Deletes the S3 objects of earlier versions of the document recorded under digest.
+        The next ingestion job removes them from the vector index. A failed delete does not
+        stop the others, the version stays recorded and the next upload of the document retries it.
+        :return: Returns (deleted S3 keys, [(S3 key, error)] of the failed deletes)
+        """
+        entry = self.find(digest)
+        if entry is None:
+            return [], []
+        deleted = []
+        failed = []
+        for old_digest, old_entry in self.versions(entry["name"]).items():
+            if old_digest == digest:
+                continue
+            try:
+                client.delete_object(Bucket=bucket, Key=old_entry["key"])
+            except (BotoCoreError, ClientError) as e:
+                logger.warning(f"Could not delete superseded {old_entry['key']}: {e}")
+                failed.append((old_entry["key"], e))
+                continue
+            self.remove(old_digest)
+            deleted.append(old_entry["key"])
+            if old_entry.get("metadata"):
+                sidecar_key = document_metadata.sidecar_key(old_entry["key"])
+                try:
+                    client.delete_object(Bucket=bucket, Key=sidecar_key)
+                except (BotoCoreError, ClientError) as e:
+                    logger.warning(f"Could not delete superseded {sidecar_key}: {e}")
+                    failed.append((sidecar_key, e))
+        return deleted, failed
+
+
+manifest = DocumentManifest()
@@ -0,0 +1,77 @@
+import json
+import os
+import re
+
+# Metadata attributes written next to every uploaded document and their Bedrock types.
+# See https://docs.aws.amazon.com/bedrock/latest/userguide/knowledge-base-ds.html
+attributes = {"title": "string", "publisher": "string", "quarter": "string", "year": "number"}
+
+quarter_pattern = re.compile(r"(?<![A-Za-z0-9])Q([1-4])(?![0-9])", re.IGNORECASE)
+year_pattern = re.compile(r"(?<![0-9])((?:19|20)[0-9]{2})(?![0-9])")
+# Timestamp appended by the upload page, e.g. _20250131_142501
+upload_timestamp_pattern = re.compile(r"_[0-9]{8}_[0-9]{6}$")
+
+
+def from_filename(name):
+    """
+    Guesses the metadata of a document from its file name, e.g. QIP_Q1_2025.pdf
+    :return: Returns {attribute: value} of the attributes found
+    """
+    stem = upload_timestamp_pattern.sub("", os.path.splitext(os.path.basename(name))[0])
+    metadata = {"title": re.sub(r"[_-]+", " ", stem).strip()}
+    quarter = quarter_pattern.search(stem)
+    if quarter:
+        metadata["quarter"] = f"Q{quarter.group(1)}"
+    year = year_pattern.search(stem)
+    if year:
+        metadata["year"] = int(year.group(1))
+    return metadata
+
+
+def clean(metadata):
+    # Drops empty values and gives number attributes their type
+    cleaned = {}
+    for attribute, value in metadata.items():
+        if attribute not in attributes or value is None or value == "":
+            continue
+        cleaned[attribute] = int(value) if attributes[attribute] == "number" else str(value).strip()
+    return cleaned
+
+
+def sidecar_key(key):
+    # Bedrock reads the metadata of data/report.pdf from data/report.pdf.metadata.json
+    return f"{key}.metadata.json"
+
+
+def sidecar(metadata):
+    return json.dumps({"metadataAttributes": clean(metadata)})
+
+
+def build_filter(selection):
+    """
+    Turns the sidebar selection into a Knowledge Base retrieval filter
+    :param selection: {attribute: [values]}, attributes without values are not filtered on
+    :return: Returns the filter, or None to search every document
+    """
+    conditions = []
+    for attribute, values in selection.items():
+        values = [int(value) if attributes[attribute] == "number" else value for value in values]
+        if len(values) == 1:
+            conditions.append({"equals": {"key": attribute, "value": values[0]}})
+        elif len(values) > 1:
+            conditions.append({"in": {"key": attribute, "value": values}})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"andAll": conditions}
+
+
+def retrieval_configuration(retrieval_filter):
+    return {"vectorSearchConfiguration": {"filter": retrieval_filter}}
+
+
+def agent_session_state(knowledge_base_id, retrieval_filter):
+    # Applies the filter to the agent's Knowledge Base searches during the turn
+    return {"knowledgeBaseConfigurations": [{
+        "knowledgeBaseId": knowledge_base_id,
+        "retrievalConfiguration": retrieval_configuration(retrieval_filter)
+    }]}
@@ -0,0 +1,174 @@
+from collections import deque
+from contextlib import closing
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Turns (a user message and its answer) kept in memory before older ones spill to disk
+memory_turns = int(os.environ.get("HISTORY_MEMORY_TURNS", "20"))
+# Messages rendered at once, "Load earlier" pages back by the same amount
+page_size = int(os.environ.get("HISTORY_PAGE_SIZE", "20"))
+history_dir = os.environ.get("HISTORY_DIR", ".chat_history")
+# History files untouched for this long belong to sessions that ended without a reset
+max_age_seconds = int(os.environ.get("HISTORY_MAX_AGE_SECONDS", str(7 * 24 * 3600)))
+cleanup_interval_seconds = 3600
+
+_last_cleanup = {}
+_cleanup_lock = threading.Lock()
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def remove_stale(directory=history_dir, max_age_seconds=max_age_seconds):
+    """
+    Deletes the history files of directory not modified for max_age_seconds. A resumed
+    session rebuilds its history from the session store, so nothing is lost for it.
+    :return: Returns the number of files deleted
+    """
+    cutoff = time.time() - max_age_seconds
+    removed = 0
+    for entry in os.scandir(directory):
+        if not entry.name.endswith(".sqlite3"):
+            continue
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    if removed:
+        logger.info(f"Removed {removed} chat history file(s) older than {max_age_seconds}s from {directory}")
+    return removed
+
+
+def _remove_stale_now_and_then(directory):
+    # At most once per cleanup_interval_seconds and directory, new sessions trigger it
+    now = time.monotonic()
+    with _cleanup_lock:
+        last = _last_cleanup.get(directory)
+        if last is not None and now - last < cleanup_interval_seconds:
+            return
+        _last_cleanup[directory] = now
+    try:
+        remove_stale(directory)
+    except OSError as e:
+        logger.warning(f"Could not clean up {directory}: {e}")
+
+
+class HistoryStore:
+    """
+    Chat history of one session. The last memory_turns turns stay in memory and older
+    messages spill to a SQLite file of the session. Large per-turn artifacts such as
+    citations and traces go straight to disk and messages only keep their ids.
+    """
+
+    def __init__(self, session_id, memory_turns=memory_turns, directory=history_dir):
+        self.session_id = session_id
+        self.path = os.path.join(directory, f"{session_id}.sqlite3")
+        self._memory = deque()
+        self._max_memory = max(2, memory_turns * 2)
+        self._next_seq = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        _remove_stale_now_and_then(directory)
+        with closing(self._connect()):
+            pass
+
+    def _connect(self):
+        # Streamlit reruns a session on different threads, so every operation opens its own connection.
+        # The tables are created on every connect, remove_stale may have deleted the file of an idle session
+        connection = sqlite3.connect(self.path)
+        connection.execute("CREATE TABLE IF NOT EXISTS messages (seq INTEGER PRIMARY KEY, message TEXT NOT NULL)")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS artifacts "
+            "(artifact_id TEXT PRIMARY KEY, seq INTEGER, kind TEXT, payload TEXT NOT NULL)"
+        )
+        return connection
+
+    def append(self, message, artifacts=None):
+        """
+        Adds a message to the end of the history
+        :param message: The message dict as rendered by the page, e.g. {"role": ..., "content": ...}
+        :param artifacts: Optional {kind: payload} stored on disk, the message gets {kind: artifact_id} under "artifacts"
+        :return: Returns the sequence number of the message
+        """
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            if artifacts:
+                message = dict(message)
+                message["artifacts"] = {}
+                rows = []
+                for kind, payload in artifacts.items():
+                    artifact_id = str(uuid.uuid4())
+                    message["artifacts"][kind] = artifact_id
+                    rows.append((artifact_id, seq, kind, _dumps(payload)))
+                with closing(self._connect()) as connection, connection:
+                    connection.executemany("INSERT INTO artifacts VALUES (?, ?, ?, ?)", rows)
+
+            self._memory.append((seq, message))
+            spilled = []
+            while len(self._memory) > self._max_memory:
+                spilled.append(self._memory.popleft())
+            if spilled:
+                with closing(self._connect()) as connection, connection:
+                    connection.executemany(
+                        "INSERT INTO messages VALUES (?, ?)",
+                        [(spilled_seq, _dumps(spilled_message)) for spilled_seq, spilled_message in spilled]
+                    )
+        return seq
+
+    def __len__(self):
+        return self._next_seq
+
+    def recent(self, count):
+        """
+        :return: Returns the last count messages, reading spilled ones back from disk
+        """
+        with self._lock:
+            start = max(0, self._next_seq - count)
+            memory = list(self._memory)
+        first_in_memory = memory[0][0] if memory else self._next_seq
+        messages = []
+        if start < first_in_memory:
+            with closing(self._connect()) as connection:
+                rows = connection.execute(
+                    "SELECT message FROM messages WHERE seq >= ? AND seq < ? ORDER BY seq",
+                    (start, first_in_memory)
+                ).fetchall()
+            messages = [json.loads(row[0]) for row in rows]
+        messages += [message for seq, message in memory if seq >= start]
+        return messages
+
+    def load_artifact(self, artifact_id):
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT payload FROM artifacts WHERE artifact_id = ?", (artifact_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def clear(self):
+        """
+        Empties the history but keeps its file, e.g. before replaying a session resumed from the session store
+        """
+        with self._lock:
+            self._memory.clear()
+            self._next_seq = 0
+            with closing(self._connect()) as connection, connection:
+                connection.execute("DELETE FROM messages")
+                connection.execute("DELETE FROM artifacts")
+
+    def delete(self):
+        with self._lock:
+            self._memory.clear()
+            self._next_seq = 0
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,205 @@
+from botocore.exceptions import ClientError
+from collections import OrderedDict
+import logging
+import os
+from services import answer_cache, client_registry, knowledge_base_runtime
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Batching of ingestion jobs, see .env_sample. A job starts once no document was added for
+# debounce_seconds, or max_wait_seconds after the first document of the batch at the latest
+debounce_seconds = float(os.environ.get("INGESTION_DEBOUNCE_SECONDS", "20"))
+max_wait_seconds = float(os.environ.get("INGESTION_MAX_WAIT_SECONDS", "120"))
+poll_seconds = float(os.environ.get("INGESTION_POLL_SECONDS", "5"))
+# Documents whose ingestion status is kept for the upload page
+max_documents = int(os.environ.get("INGESTION_MAX_DOCUMENTS", "200"))
+
+PENDING = "PENDING"
+INGESTING = "INGESTING"
+SEARCHABLE = "SEARCHABLE"
+FAILED = "FAILED"
+
+
+# Read on every call rather than at import, the pages load their .env file after importing services
+def get_data_source_id():
+    return os.environ.get("DATA_SOURCE_ID")
+
+
+def configured():
+    return bool(knowledge_base_runtime.get_knowledge_base_id()) and bool(get_data_source_id())
+
+
+class IngestionScheduler:
+    """
+    Starts one ingestion job for a burst of uploaded documents instead of one per document.
+    Bedrock runs a single ingestion job per data source at a time, documents added while a
+    job runs are picked up by the next one. Shared by every Streamlit session of the process.
+    """
+
+    def __init__(self, debounce_seconds=debounce_seconds, max_wait_seconds=max_wait_seconds,
+                 poll_seconds=poll_seconds, max_documents=max_documents, client=None):
+        self.debounce_seconds = debounce_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.poll_seconds = poll_seconds
+        self.max_documents = max_documents
+        self.client = client
+        self._condition = threading.Condition()
+        self._thread = None
+        # S3 key -> time the document was uploaded, waiting for the next job
+        self._pending = {}
+        self._first_requested_at = None
+        self._last_requested_at = None
+        self._job = None
+        self._documents = OrderedDict()
+        self._stats = {"documents_requested": 0, "jobs_started": 0, "jobs_completed": 0, "jobs_failed": 0, "conflicts": 0}
+        self._searchable_seconds = 0.0
+        self._searchable = 0
+
+    def _get_client(self):
+        return self.client or client_registry.get_client("bedrock-agent")
+
+    def request(self, keys):
+        """
+        Schedules the ingestion of uploaded documents
+        :param keys: S3 keys of the documents, used to report their status
+        """
+        uploaded_at = time.time()
+        with self._condition:
+            for key in keys:
+                self._pending[key] = uploaded_at
+                self._documents.pop(key, None)
+                self._documents[key] = {
+                    "key": key, "status": PENDING, "job_id": None, "uploaded_at": uploaded_at, "seconds_to_searchable": None
+                }
+                self._stats["documents_requested"] += 1
+            while len(self._documents) > self.max_documents:
+                self._documents.popitem(last=False)
+            now = time.monotonic()
+            if self._first_requested_at is None:
+                self._first_requested_at = now
+            self._last_requested_at = now
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ingestion-scheduler", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _next_batch(self):
+        with self._condition:
+            while True:
+                if not self._pending:
+                    self._condition.wait()
+                    continue
+                due = min(self._last_requested_at + self.debounce_seconds, self._first_requested_at + self.max_wait_seconds)
+                remaining = due - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = self._pending
+            self._pending = {}
+            self._first_requested_at = None
+            self._last_requested_at = None
+            return batch
+
+    def _requeue(self, batch):
+        with self._condition:
+            for key, uploaded_at in batch.items():
+                self._pending.setdefault(key, uploaded_at)
+            now = time.monotonic()
+            # Already waited for, start as soon as the data source is free
+            self._first_requested_at = now - self.max_wait_seconds
+            self._last_requested_at = self._last_requested_at or now
+
+    def _set_documents(self, batch, **fields):
+        with self._condition:
+            for key in batch:
+                document = self._documents.get(key)
+                # A newer upload of the same key is tracked by a later batch
+                if document is not None and document["uploaded_at"] == batch[key]:
+                    document.update(fields)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._ingest(batch)
+            except Exception as e:
+                logger.error(f"Ingestion of {len(batch)} documents failed: {e}")
+                with self._condition:
+                    self._stats["jobs_failed"] += 1
+                self._set_documents(batch, status=FAILED)
+
+    def _ingest(self, batch):
+        client = self._get_client()
+        knowledge_base_id = knowledge_base_runtime.get_knowledge_base_id()
+        data_source_id = get_data_source_id()
+        try:
+            # See https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/bedrock-agent/client/start_ingestion_job.html
+            job = client.start_ingestion_job(knowledgeBaseId=knowledge_base_id, dataSourceId=data_source_id)["ingestionJob"]
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "ConflictException":
+                raise
+            # A job started elsewhere, e.g. by another replica, is still running
+            with self._condition:
+                self._stats["conflicts"] += 1
+            self._requeue(batch)
+            time.sleep(self.poll_seconds)
+            return
+
+        with self._condition:
+            self._stats["jobs_started"] += 1
+            self._job = {"id": job["ingestionJobId"], "status": job["status"], "documents": len(batch),
+                         "started_at": time.time(), "statistics": None}
+        self._set_documents(batch, status=INGESTING, job_id=job["ingestionJobId"])
+
+        while job["status"] not in ("COMPLETE", "FAILED", "STOPPED"):
+            time.sleep(self.poll_seconds)
+            job = client.get_ingestion_job(
+                knowledgeBaseId=knowledge_base_id, dataSourceId=data_source_id, ingestionJobId=job["ingestionJobId"]
+            )["ingestionJob"]
+            with self._condition:
+                self._job.update(status=job["status"], statistics=job.get("statistics"))
+
+        finished_at = time.time()
+        if job["status"] != "COMPLETE":
+            logger.error(f"Ingestion job {job['ingestionJobId']} ended {job['status']}: {job.get('failureReasons')}")
+            with self._condition:
+                self._stats["jobs_failed"] += 1
+            self._set_documents(batch, status=FAILED)
+            return
+
+        # Answers cached before these documents became searchable may now be incomplete, the agent's included
+        answer_cache.invalidate()
+        with self._condition:
+            self._stats["jobs_completed"] += 1
+            for key, uploaded_at in batch.items():
+                self._searchable_seconds += finished_at - uploaded_at
+                self._searchable += 1
+                document = self._documents.get(key)
+                if document is not None and document["uploaded_at"] == uploaded_at:
+                    document.update(status=SEARCHABLE, seconds_to_searchable=finished_at - uploaded_at)
+
+    def status(self):
+        """
+        :return: Returns the pending documents, the last job, the most recent documents and the job counts
+        """
+        with self._condition:
+            return {
+                "pending": len(self._pending),
+                "job": dict(self._job) if self._job else None,
+                "documents": [dict(document) for document in reversed(self._documents.values())],
+                "mean_seconds_to_searchable": self._searchable_seconds / self._searchable if self._searchable else None,
+                **self._stats
+            }
+
+
+scheduler = IngestionScheduler()
+
+
+def request(keys):
+    scheduler.request(keys)
+
+
+def status():
+    return scheduler.status()
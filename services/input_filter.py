@@ -0,0 +1,122 @@
+import logging
+import os
+import re
+from services import text_classifier
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Local stand-in for the agent's PRE_PROCESSING phase, see .env_sample
+enabled = os.environ.get("INPUT_FILTER_ENABLED", "true").lower() in ("1", "true", "yes")
+# A text_classifier model with the labels M (harmful or malicious) and N, consulted when no rule matches
+model_path = os.environ.get("INPUT_FILTER_MODEL_PATH")
+model_threshold = float(os.environ.get("INPUT_FILTER_MODEL_THRESHOLD", "0.9"))
+rejection_message = os.environ.get("INPUT_FILTER_REJECTION_MESSAGE", "Sorry, I am unable to assist you with this request.")
+# Share of malicious examples the filter must reject before the agent's PRE_PROCESSING phase may be
+# disabled, enforced by benchmarks/eval_input_filter.py and src/deploy/create_bedrock_components.py
+min_recall = float(os.environ.get("INPUT_FILTER_MIN_RECALL", "0.95"))
+
+MALICIOUS = "M"
+NOT_MALICIOUS = "N"
+
+# Clearly malicious input, the categories the PRE_PROCESSING prompt sorts into M
+rules = {
+    "instruction_override": re.compile(
+        r"\b(ignore|disregard|forget|override)\b.{0,30}\b(previous|prior|above|earlier|all|your|system)\b.{0,20}"
+        r"\b(instructions?|prompts?|rules|guidelines|directions)\b",
+        re.IGNORECASE
+    ),
+    "prompt_extraction": re.compile(
+        r"\b(reveal|show|print|repeat|output|leak|tell me)\b.{0,30}\b(system prompt|your (instructions|prompt|rules)|"
+        r"hidden (instructions|prompt)|initial prompt)\b",
+        re.IGNORECASE
+    ),
+    "jailbreak": re.compile(
+        r"\b(jailbreak|do anything now|developer mode|DAN mode)\b|\byou are (now )?DAN\b|"
+        r"\b(pretend|act as if|imagine) (you are|you're|to be)\b.{0,40}\b(no|without) (restrictions|rules|filters|limits)\b",
+        re.IGNORECASE
+    ),
+    "weapons": re.compile(
+        r"\b(make|build|assemble|synthesi[sz]e|produce)\b.{0,30}\b(bomb|explosives?|pipe bomb|nerve agent|bioweapon|chemical weapon|napalm)\b",
+        re.IGNORECASE
+    ),
+    "malware": re.compile(
+        r"\b(write|create|code|build|generate)\b.{0,30}\b(ransomware|keylogger|malware|computer virus|trojan|botnet|spyware)\b",
+        re.IGNORECASE
+    ),
+    "fraud": re.compile(
+        r"\b(phishing (email|page|site)|steal (their |someone's |the )?(credentials|passwords|identity|credit card)|"
+        r"launder(ing)? money|insider trading tips?)\b",
+        re.IGNORECASE
+    )
+}
+
+
+class InputFilter:
+    """
+    CPU-only input classifier run before any Bedrock call. Rules catch clearly malicious
+    input, the optional compact model decides the rest, anything else is let through.
+    Classifying takes microseconds where the PRE_PROCESSING phase costs a model call.
+    """
+
+    def __init__(self, model=None, model_threshold=model_threshold):
+        # model=None loads INPUT_FILTER_MODEL_PATH, model=False runs the rules only
+        self.model = model if model is not None else text_classifier.load_optional(model_path)
+        self.model_threshold = model_threshold
+        self._lock = threading.Lock()
+        self._checked = 0
+        self._seconds = 0.0
+        self._rejected = {}
+
+    def classify(self, prompt):
+        """
+        :return: Returns {"category": "M" or "N", "reason": ...}
+        """
+        for name, rule in rules.items():
+            if rule.search(prompt):
+                return {"category": MALICIOUS, "reason": f"rule:{name}"}
+        if self.model:
+            label, probability = self.model.predict(prompt)
+            if label == MALICIOUS and probability >= self.model_threshold:
+                return {"category": MALICIOUS, "reason": "model"}
+        return {"category": NOT_MALICIOUS, "reason": "default"}
+
+    def check(self, prompt):
+        """
+        Classifies a prompt and counts the outcome
+        :return: Returns True when the prompt may be sent to Bedrock
+        """
+        started = time.perf_counter()
+        verdict = self.classify(prompt)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._checked += 1
+            self._seconds += elapsed
+            if verdict["category"] == MALICIOUS:
+                self._rejected[verdict["reason"]] = self._rejected.get(verdict["reason"], 0) + 1
+        if verdict["category"] == MALICIOUS:
+            logger.info(f"Rejected input ({verdict['reason']})")
+            return False
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "checked": self._checked,
+                "rejected": sum(self._rejected.values()),
+                "rejected_by_reason": dict(self._rejected),
+                "mean_microseconds": self._seconds / self._checked * 1e6 if self._checked else 0.0
+            }
+
+
+input_filter = InputFilter()
+
+
+def allowed(prompt):
+    # True when the filter is off or the prompt is not malicious
+    return not enabled or input_filter.check(prompt)
+
+
+def stats():
+    return input_filter.stats()
@@ -0,0 +1,169 @@
+import logging
+import os
+from services import answer_cache, bedrock_agent_runtime, cancellation, client_registry, document_metadata, input_filter, rate_limiter, session_store
+
+logger = logging.getLogger(__name__)
+
+
+# Read on every call rather than at import, the pages load their .env file after importing services
+def get_knowledge_base_id():
+    return os.environ.get("KNOWLEDGE_BASE_ID")
+
+
+def get_model_arn():
+    # Foundation model that generates Knowledge Base answers, e.g. arn:aws:bedrock:us-east-1::foundation-model/anthropic.claude-v2
+    return os.environ.get("KNOWLEDGE_BASE_MODEL_ARN", "<Replace it with your Foundation Model ID>")
+
+
+def configured():
+    return bool(get_knowledge_base_id()) and not get_model_arn().startswith("<")
+
+
+def unrecorded_turns(session_id):
+    """
+    :return: Returns the turns of the chat session answered without a Knowledge Base session,
+        i.e. from the answer cache, as {"prompt": ..., "answer": ...}
+    """
+    return session_store.store.load_state(session_id).get("kb_history", [])
+
+
+def record_unrecorded_turn(session_id, prompt, answer):
+    # Kept in the session store until the call that starts the Knowledge Base session hands it over
+    turns = unrecorded_turns(session_id) + [{"prompt": prompt, "answer": answer}]
+    session_store.store.update_state(
+        session_id, kb_history=turns[-bedrock_agent_runtime.conversation_history_max_turns:]
+    )
+
+
+def input_text(prompt, history=None):
+    # retrieve_and_generate takes no conversation history, earlier turns are put in front of the question
+    if not history:
+        return prompt
+    turns = "\n".join(f"User: {turn['prompt']}\nAssistant: {turn['answer']}" for turn in history)
+    return f"Earlier in this conversation:\n{turns}\n\nQuestion: {prompt}"
+
+
+def _request(knowledge_base_id, prompt, session_id, retrieval_filter=None, history=None):
+    request = {
+        "input": {"text": input_text(prompt, history)},
+        "retrieveAndGenerateConfiguration": {
+            "knowledgeBaseConfiguration": {
+                "knowledgeBaseId": knowledge_base_id,
+                "modelArn": get_model_arn()
+            },
+            "type": "KNOWLEDGE_BASE"
+        }
+    }
+    if retrieval_filter:
+        request["retrieveAndGenerateConfiguration"]["knowledgeBaseConfiguration"]["retrievalConfiguration"] = \
+            document_metadata.retrieval_configuration(retrieval_filter)
+    if session_id:
+        request["sessionId"] = session_id
+    return request
+
+
+def retrieve_and_generate(prompt, session_id=None, client=None, retrieval_filter=None, first_turn=False, history=None):
+    """
+    Answers a prompt from the Knowledge Base with a single retrieve_and_generate call.
+    Answers to first turns are cached per Knowledge Base and calls are rate limited like the agent's.
+    :param session_id: Optional Knowledge Base session id returned by an earlier call, keeps the conversation context
+    :param retrieval_filter: Optional metadata filter, see document_metadata.build_filter
+    :param first_turn: True for the first turn of the chat session, only its answer may be shared
+    :param history: Earlier turns no Knowledge Base session has seen, see unrecorded_turns
+    :return: Returns the retrieve_and_generate response, a cached or rejected answer only has output and citations
+    """
+    if not input_filter.allowed(prompt):
+        return {"output": {"text": input_filter.rejection_message}, "citations": []}
+
+    knowledge_base_id = get_knowledge_base_id()
+    namespace = answer_cache.filtered_namespace(answer_cache.knowledge_base_namespace(knowledge_base_id), retrieval_filter)
+    # Follow-up turns depend on the conversation, only first turns are shared. A cached first turn
+    # starts no Knowledge Base session, so session_id cannot tell a follow-up from a first turn
+    cacheable = answer_cache.cacheable(prompt, first_turn)
+    cached = answer_cache.get(namespace, prompt) if cacheable else None
+    if cached is not None:
+        return cached
+
+    client = client or client_registry.get_client("bedrock-agent-runtime")
+    # See https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/bedrock-agent-runtime/client/retrieve_and_generate.html
+    response = rate_limiter.call(
+        rate_limiter.knowledge_base_key(knowledge_base_id),
+        client.retrieve_and_generate,
+        **_request(knowledge_base_id, prompt, session_id, retrieval_filter, history)
+    )
+    if cacheable:
+        answer_cache.put(namespace, prompt, {"output": response["output"], "citations": response["citations"]})
+    return response
+
+
+def response_events(response):
+    # The Knowledge Base answer as the typed events of bedrock_agent_runtime.parse_completion
+    yield {"type": "chunk", "text": response["output"]["text"]}
+    if len(response["citations"]) > 0:
+        yield {"type": "citation", "citations": response["citations"]}
+
+
+def parse_stream(response):
+    """
+    Turns a retrieve_and_generate_stream response into typed events as they arrive. A
+    {"type": "session", "session_id": ...} event comes first, then the chunk and citation
+    events of bedrock_agent_runtime.parse_completion.
+    """
+    stream = response["stream"]
+    # A cancelled turn interrupts the read, see services/cancellation.py
+    cancellation.on_cancel(lambda: cancellation.close_stream(stream))
+    try:
+        yield {"type": "session", "session_id": response.get("sessionId")}
+        for event in stream:
+            if "output" in event:
+                yield {"type": "chunk", "text": event["output"]["text"]}
+            elif "citation" in event:
+                # Newer responses nest the citation, older ones have its fields at the top level
+                citation = event["citation"].get("citation", event["citation"])
+                yield {"type": "citation", "citations": [citation]}
+    finally:
+        # Release the HTTP connection when the consumer stops early
+        if hasattr(stream, "close"):
+            stream.close()
+
+
+def retrieve_and_generate_stream(prompt, session_id=None, client=None, retrieval_filter=None, first_turn=False,
+                                 history=None):
+    """
+    Like retrieve_and_generate, but yields the answer as typed events while it is generated.
+    A cached answer yields no session event, callers record it with record_unrecorded_turn
+    :param session_id: Optional Knowledge Base session id from the session event of an earlier turn
+    :param retrieval_filter: Optional metadata filter, see document_metadata.build_filter
+    :param first_turn: True for the first turn of the chat session, only its answer may be shared
+    :param history: Earlier turns no Knowledge Base session has seen, see unrecorded_turns
+    """
+    if not input_filter.allowed(prompt):
+        yield {"type": "chunk", "text": input_filter.rejection_message}
+        return
+
+    knowledge_base_id = get_knowledge_base_id()
+    namespace = answer_cache.filtered_namespace(answer_cache.knowledge_base_namespace(knowledge_base_id), retrieval_filter)
+    # Follow-up turns depend on the conversation, only first turns are shared. A cached first turn
+    # starts no Knowledge Base session, so session_id cannot tell a follow-up from a first turn
+    cacheable = answer_cache.cacheable(prompt, first_turn)
+    cached = answer_cache.get(namespace, prompt) if cacheable else None
+    if cached is not None:
+        yield from response_events(cached)
+        return
+
+    client = client or client_registry.get_client("bedrock-agent-runtime")
+
+    def start_stream():
+        # See https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/bedrock-agent-runtime/client/retrieve_and_generate_stream.html
+        return parse_stream(client.retrieve_and_generate_stream(
+            **_request(knowledge_base_id, prompt, session_id, retrieval_filter, history)
+        ))
+
+    answer = bedrock_agent_runtime.new_response()
+    for event in rate_limiter.stream(rate_limiter.knowledge_base_key(knowledge_base_id), start_stream):
+        bedrock_agent_runtime.add_event(answer, event)
+        yield event
+
+    # Only complete answers are cached, in the shape retrieve_and_generate returns
+    if cacheable and not cancellation.cancelled():
+        answer_cache.put(namespace, prompt, {"output": {"text": answer["output_text"]}, "citations": answer["citations"]})
@@ -0,0 +1,153 @@
+from collections import deque
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Number of recent turns kept per metric for the process-wide percentiles
+sample_size = int(os.environ.get("LATENCY_SAMPLE_SIZE", "1000"))
+
+phase_by_trace_type = {
+    "preGuardrailTrace": "pre_processing",
+    "preProcessingTrace": "pre_processing",
+    "orchestrationTrace": "orchestration",
+    "postProcessingTrace": "post_processing",
+    "postGuardrailTrace": "post_processing"
+}
+phases = ["pre_processing", "orchestration", "post_processing", "response"]
+# Metrics only an agent trace can measure. Turns without one, e.g. cache hits, leave them out
+# of the percentiles instead of adding zeros
+traced_metrics = {f"{phase}_seconds" for phase in phases if phase != "response"} | {"kb_retrieval_seconds"}
+
+
+class TurnTimer:
+    """
+    Timing of one agent turn, built from the typed events of invoke_agent_stream as the
+    caller consumes them. The wait before each event is attributed to that event's phase,
+    so the phase durations add up to the total turn time.
+    """
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.last_event_at = 0.0
+        self.first_event = None
+        self.first_chunk = None
+        self.trace_events = 0
+        self.phase_seconds = dict.fromkeys(phases, 0.0)
+        self.model_invocations = 0
+        self.kb_retrieval_seconds = 0.0
+        self.kb_retrievals = 0
+        self._kb_lookup_started = None
+
+    def observe(self, event):
+        elapsed = time.monotonic() - self.started_at
+        gap = elapsed - self.last_event_at
+        self.last_event_at = elapsed
+        if self.first_event is None:
+            self.first_event = elapsed
+
+        if event["type"] == "chunk":
+            if self.first_chunk is None:
+                self.first_chunk = elapsed
+            self.phase_seconds["response"] += gap
+        elif event["type"] == "trace":
+            self.trace_events += 1
+            self.phase_seconds[phase_by_trace_type.get(event["mapped_trace_type"], "orchestration")] += gap
+            step = event["trace"]
+            if "modelInvocationInput" in step:
+                self.model_invocations += 1
+            if "knowledgeBaseLookupInput" in step.get("invocationInput", {}):
+                self._kb_lookup_started = elapsed
+            if self._kb_lookup_started is not None and "knowledgeBaseLookupOutput" in step.get("observation", {}):
+                self.kb_retrieval_seconds += elapsed - self._kb_lookup_started
+                self.kb_retrievals += 1
+                self._kb_lookup_started = None
+
+    def breakdown(self):
+        breakdown = {
+            "total_seconds": time.monotonic() - self.started_at,
+            "time_to_first_event_seconds": self.first_event,
+            "time_to_first_chunk_seconds": self.first_chunk,
+            "trace_events": self.trace_events,
+            "model_invocations": self.model_invocations,
+            "kb_retrievals": self.kb_retrievals,
+            "kb_retrieval_seconds": self.kb_retrieval_seconds
+        }
+        for phase in phases:
+            breakdown[f"{phase}_seconds"] = self.phase_seconds[phase]
+        return breakdown
+
+
+def timed(events, timer):
+    # Passes events through while recording when the consumer received each of them
+    for event in events:
+        timer.observe(event)
+        yield event
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile
+    if len(sorted_values) == 0:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class LatencyHistogram:
+    def __init__(self, sample_size=sample_size):
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._sample_size = sample_size
+        self.turns = 0
+
+    def record(self, breakdown):
+        traced = breakdown.get("trace_events", 0) > 0
+        with self._lock:
+            self.turns += 1
+            for metric, value in breakdown.items():
+                if value is None or not metric.endswith("_seconds"):
+                    continue
+                if not traced and metric in traced_metrics:
+                    continue
+                if metric not in self._samples:
+                    self._samples[metric] = deque(maxlen=self._sample_size)
+                self._samples[metric].append(value)
+
+    def percentiles(self):
+        """
+        :return: {metric: {"p50": ..., "p95": ..., "p99": ..., "count": ...}} over recent turns
+        """
+        with self._lock:
+            samples = {metric: sorted(values) for metric, values in self._samples.items()}
+        return {
+            metric: {
+                "p50": percentile(values, 0.50),
+                "p95": percentile(values, 0.95),
+                "p99": percentile(values, 0.99),
+                "count": len(values)
+            }
+            for metric, values in samples.items()
+        }
+
+
+# One histogram per route, Knowledge Base turns skip the agent's phases and would drag its percentiles down
+histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def record(breakdown, route="agent"):
+    with _histograms_lock:
+        histogram = histograms.setdefault(route, LatencyHistogram())
+    histogram.record(breakdown)
+
+
+def percentiles():
+    """
+    :return: {route: {metric: {"p50": ..., "p95": ..., "p99": ..., "count": ...}}} over recent turns
+    """
+    with _histograms_lock:
+        routes = dict(histograms)
+    return {route: histogram.percentiles() for route, histogram in routes.items()}
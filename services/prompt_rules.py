@@ -0,0 +1,23 @@
+import re
+
+# Requests only the agent's action groups can fulfil, e.g. the /reset password API. Their
+# answers depend on side effects, so they are routed to the agent and never cached
+agent_rules = {
+    "action_path": re.compile(r"(^|\s)/\w+"),
+    "password": re.compile(r"\b(pass ?word|passcode|credentials?)\b", re.IGNORECASE),
+    "account_action": re.compile(
+        r"\b(reset|unlock|change|recover|forgot|create|update|delete|cancel)\b.*\b(account|login|log in|sign in|access)\b",
+        re.IGNORECASE
+    ),
+    "personal_details": re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+|\b(my|our) (id|email|name) is\b", re.IGNORECASE)
+}
+
+
+def agent_rule(prompt):
+    """
+    :return: Returns the name of the first agent rule matching the prompt, or None
+    """
+    for name, rule in agent_rules.items():
+        if rule.search(prompt):
+            return name
+    return None
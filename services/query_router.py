@@ -0,0 +1,189 @@
+import logging
+import os
+import re
+from services import bedrock_agent_runtime, cancellation, knowledge_base_runtime, prompt_rules, session_store, text_classifier
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# How chat turns are routed, see .env_sample
+#   off   - every turn goes to the agent
+#   rules - keyword rules send plain document questions to the Knowledge Base (default)
+#   model - like rules, the optional local model decides what the rules leave open
+policies = ("off", "rules", "model")
+policy = os.environ.get("QUERY_ROUTER_POLICY", "rules")
+if policy not in policies:
+    logger.warning(f"Unknown QUERY_ROUTER_POLICY '{policy}', using 'rules'")
+    policy = "rules"
+# A text_classifier model with the labels agent and knowledge_base
+model_path = os.environ.get("QUERY_ROUTER_MODEL_PATH")
+model_threshold = float(os.environ.get("QUERY_ROUTER_MODEL_THRESHOLD", "0.8"))
+
+AGENT = "agent"
+KNOWLEDGE_BASE = "knowledge_base"
+
+# Questions about the documents, answered by a single retrieve_and_generate_stream call
+knowledge_base_rule = re.compile(
+    r"^\s*(what|who|whom|whose|when|where|which|why|how|is|are|does|do|did|can|could|should|"
+    r"summari[sz]e|explain|describe|list|compare|define|tell me about|give me an overview)\b",
+    re.IGNORECASE
+)
+# Turns that only make sense in the context of the previous one stay on its route
+follow_up_rule = re.compile(
+    r"^\s*(and|also|what about|how about|why not|yes|no|ok|okay|sure|more|continue|go on)\b|\b(it|that|this|those|them|they)\b\W*$",
+    re.IGNORECASE
+)
+
+
+class QueryRouter:
+    """
+    Classifies each chat turn locally and sends plain document questions to
+    retrieve_and_generate_stream, which skips the agent's pre-processing, orchestration and
+    post-processing prompts. Both routes yield the typed events of
+    bedrock_agent_runtime.parse_completion, so callers cannot tell them apart.
+    The route and outcome of the last turn and the Knowledge Base session id are kept in the
+    state of the chat session in the session store, any replica can route the next turn.
+    Knowledge Base turns are handed to the agent session with its next call, see
+    bedrock_agent_runtime.unrecorded_turns, and cached Knowledge Base turns to the call that
+    starts the Knowledge Base session, see knowledge_base_runtime.unrecorded_turns.
+    """
+
+    def __init__(self, policy=policy, model=None, store=None):
+        self.policy = policy
+        self.model = model if model is not None else text_classifier.load_optional(model_path)
+        self.store = store
+        self._lock = threading.Lock()
+        self._routes = {AGENT: 0, KNOWLEDGE_BASE: 0}
+        self._reasons = {}
+        self._seconds = {AGENT: 0.0, KNOWLEDGE_BASE: 0.0}
+        self._completed = {AGENT: 0, KNOWLEDGE_BASE: 0}
+
+    def _store(self):
+        # Resolved per call, tests and tools may replace session_store.store
+        return self.store if self.store is not None else session_store.store
+
+    def _session(self, session_id):
+        state = self._store().load_state(session_id)
+        return {
+            "route": state.get("route"),
+            "asked": state.get("asked", False),
+            "kb_session_id": state.get("kb_session_id")
+        }
+
+    def classify(self, session_id, prompt):
+        """
+        :return: Returns {"route": "agent" or "knowledge_base", "reason": ...}
+        """
+        if self.policy == "off":
+            return {"route": AGENT, "reason": "policy_off"}
+        if not knowledge_base_runtime.configured():
+            return {"route": AGENT, "reason": "knowledge_base_not_configured"}
+
+        rule = prompt_rules.agent_rule(prompt)
+        if rule is not None:
+            return {"route": AGENT, "reason": f"rule:{rule}"}
+
+        session = self._session(session_id)
+        if session["route"] == AGENT and session["asked"]:
+            # The agent asked for something, e.g. the details a password reset needs
+            return {"route": AGENT, "reason": "agent_asked"}
+        if session["route"] is not None and follow_up_rule.search(prompt):
+            return {"route": session["route"], "reason": "follow_up"}
+
+        if self.policy == "model" and self.model is not None:
+            label, probability = self.model.predict(prompt)
+            if probability >= model_threshold and label in self._routes:
+                return {"route": label, "reason": "model"}
+
+        if knowledge_base_rule.search(prompt):
+            return {"route": KNOWLEDGE_BASE, "reason": "rule:question"}
+        # Anything unclear goes to the agent, which can handle every kind of request
+        return {"route": AGENT, "reason": "default"}
+
+    def stream(self, decision, agent_id, agent_alias_id, session_id, prompt, client=None, first_turn=False,
+               retrieval_filter=None):
+        """
+        Yields the typed events of the turn from the route chosen by classify
+        :param retrieval_filter: Optional metadata filter, applied on either route
+        """
+        with self._lock:
+            self._routes[decision["route"]] += 1
+            self._reasons[decision["reason"]] = self._reasons.get(decision["reason"], 0) + 1
+
+        session = self._session(session_id)
+        started_at = time.monotonic()
+        kb_history = []
+        if decision["route"] == KNOWLEDGE_BASE:
+            # Cached turns started no Knowledge Base session, the call that starts one hands them over
+            if session["kb_session_id"] is None:
+                kb_history = knowledge_base_runtime.unrecorded_turns(session_id)
+            events = knowledge_base_runtime.retrieve_and_generate_stream(
+                prompt, session["kb_session_id"], client, retrieval_filter, first_turn, kb_history
+            )
+        else:
+            events = bedrock_agent_runtime.invoke_agent_stream(
+                agent_id, agent_alias_id, session_id, prompt, client, first_turn, retrieval_filter
+            )
+
+        output_text = ""
+        for event in events:
+            if event["type"] == "chunk":
+                output_text += event["text"]
+            elif event["type"] == "session":
+                session["kb_session_id"] = event["session_id"]
+            yield event
+
+        # Only complete turns count towards the latency comparison or reach the session state
+        if cancellation.cancelled():
+            return
+        with self._lock:
+            self._seconds[decision["route"]] += time.monotonic() - started_at
+            self._completed[decision["route"]] += 1
+        if decision["route"] == KNOWLEDGE_BASE:
+            # The agent's own session never saw this turn, a follow-up routed to the agent needs it
+            bedrock_agent_runtime.record_unrecorded_turn(session_id, prompt, output_text)
+            if session["kb_session_id"] is None:
+                knowledge_base_runtime.record_unrecorded_turn(session_id, prompt, output_text)
+        state = {"route": decision["route"], "asked": output_text.rstrip().endswith("?"),
+                 "kb_session_id": session["kb_session_id"]}
+        if kb_history and session["kb_session_id"] is not None:
+            # The Knowledge Base session has seen the handed over turns now
+            state["kb_history"] = []
+        self._store().update_state(session_id, **state)
+
+    def stats(self):
+        """
+        :return: Returns the routing split and the latency saved, estimated from the mean
+            duration of complete agent turns against complete Knowledge Base turns
+        """
+        with self._lock:
+            mean_seconds = {
+                route: self._seconds[route] / self._completed[route] if self._completed[route] else None
+                for route in self._routes
+            }
+            saved = 0.0
+            if mean_seconds[AGENT] is not None and mean_seconds[KNOWLEDGE_BASE] is not None:
+                saved = (mean_seconds[AGENT] - mean_seconds[KNOWLEDGE_BASE]) * self._completed[KNOWLEDGE_BASE]
+            return {
+                "policy": self.policy,
+                "routes": dict(self._routes),
+                "reasons": dict(self._reasons),
+                "mean_seconds": mean_seconds,
+                "estimated_seconds_saved": saved
+            }
+
+
+router = QueryRouter()
+
+
+def classify(session_id, prompt):
+    return router.classify(session_id, prompt)
+
+
+def stream(decision, agent_id, agent_alias_id, session_id, prompt, client=None, first_turn=False, retrieval_filter=None):
+    return router.stream(decision, agent_id, agent_alias_id, session_id, prompt, client, first_turn, retrieval_filter)
+
+
+def stats():
+    return router.stats()
@@ -0,0 +1,246 @@
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+import json
+import logging
+import os
+import random
+from services import cancellation
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Requests per second allowed for each agent / knowledge base key, see .env_sample
+default_rate = float(os.environ.get("BEDROCK_RATE_LIMIT_PER_SECOND", "10"))
+rate_overrides = json.loads(os.environ.get("BEDROCK_RATE_LIMITS", "{}"))
+max_retries = int(os.environ.get("BEDROCK_MAX_RETRIES", "4"))
+retry_base_delay = float(os.environ.get("BEDROCK_RETRY_BASE_DELAY", "0.5"))
+retry_max_delay = float(os.environ.get("BEDROCK_RETRY_MAX_DELAY", "20"))
+# Retries earned per successful call, so retries can add at most this fraction of extra load
+retry_budget_ratio = float(os.environ.get("BEDROCK_RETRY_BUDGET_RATIO", "0.1"))
+retry_budget_min = float(os.environ.get("BEDROCK_RETRY_BUDGET_MIN", "5"))
+
+# Error codes are compared lower-cased: a stream failing mid-way reports them as
+# throttlingException rather than ThrottlingException
+throttle_error_codes = {"throttlingexception", "servicequotaexceededexception", "toomanyrequestsexception"}
+# Transient failures the SDK would otherwise have retried, see services/client_registry.py
+transient_error_codes = {"internalserverexception", "serviceunavailableexception", "modelnotreadyexception",
+                         "dependencyfailedexception", "badgatewayexception"}
+
+
+def agent_key(agent_id):
+    return f"agent:{agent_id}"
+
+
+def knowledge_base_key(knowledge_base_id):
+    return f"kb:{knowledge_base_id}"
+
+
+def error_code(error):
+    return (error.response.get("Error", {}).get("Code") or "").lower()
+
+
+def is_throttle(error):
+    return isinstance(error, ClientError) and error_code(error) in throttle_error_codes
+
+
+def is_transient(error):
+    if isinstance(error, (ConnectionError, HTTPClientError)):
+        return True
+    if not isinstance(error, ClientError):
+        return False
+    status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+    return error_code(error) in transient_error_codes or status >= 500
+
+
+def backoff_delay(attempt):
+    # Full jitter: uniform in [0, min(max, base * 2^attempt)]
+    return random.uniform(0, min(retry_max_delay, retry_base_delay * (2 ** attempt)))
+
+
+class TokenBucket:
+    """
+    Token bucket whose rate adapts to throttling: it halves on every throttle and
+    climbs back towards the configured rate with each success.
+    """
+
+    def __init__(self, rate):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = rate / 16
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a token, sleeping until one is available
+        :return: Seconds spent waiting
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Reserve the token even if it has not been refilled yet, then wait for it outside the lock
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def on_throttle(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class RetryBudget:
+    def __init__(self, ratio=retry_budget_ratio, minimum=retry_budget_min):
+        self.ratio = ratio
+        self.balance = minimum
+        self.maximum = max(minimum, 10.0)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.balance = min(self.maximum, self.balance + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self.balance < 1:
+                return False
+            self.balance -= 1
+            return True
+
+
+class _Limiter:
+    def __init__(self, rate):
+        self.bucket = TokenBucket(rate)
+        self.budget = RetryBudget()
+        self.stats = {
+            "calls": 0,
+            "wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "throttles": 0,
+            "transient_errors": 0,
+            "retries": 0,
+            "budget_exhausted": 0
+        }
+        self.stats_lock = threading.Lock()
+
+    def acquire(self):
+        wait = self.bucket.acquire()
+        with self.stats_lock:
+            self.stats["calls"] += 1
+            self.stats["wait_seconds"] += wait
+            self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], wait)
+
+    def should_retry(self, error, attempt):
+        """
+        Records a failed attempt and decides whether to try again. Only throttles slow the
+        bucket down, transient server and connection errors are retried at the current rate
+        """
+        if is_throttle(error):
+            self.bucket.on_throttle()
+            with self.stats_lock:
+                self.stats["throttles"] += 1
+        elif is_transient(error):
+            with self.stats_lock:
+                self.stats["transient_errors"] += 1
+        else:
+            return False
+        # A stream interrupted by Stop fails like a dropped connection, it must not be retried
+        if attempt >= max_retries or cancellation.cancelled():
+            return False
+        if not self.budget.withdraw():
+            with self.stats_lock:
+                self.stats["budget_exhausted"] += 1
+            logger.warning("Retry budget exhausted, not retrying failed call")
+            return False
+        with self.stats_lock:
+            self.stats["retries"] += 1
+        return True
+
+    def succeeded(self):
+        self.bucket.on_success()
+        self.budget.deposit()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(key):
+    limiter = _limiters.get(key)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(key)
+            if limiter is None:
+                limiter = _Limiter(float(rate_overrides.get(key, default_rate)))
+                _limiters[key] = limiter
+    return limiter
+
+
+def call(key, fn, *args, **kwargs):
+    """
+    Calls fn once a token for key is available, retrying throttled and transiently failed
+    calls with jittered exponential backoff while the retry budget allows
+    :param key: Rate limit key, see agent_key and knowledge_base_key
+    """
+    limiter = get_limiter(key)
+    attempt = 0
+    while True:
+        limiter.acquire()
+        try:
+            result = fn(*args, **kwargs)
+        except (ClientError, ConnectionError, HTTPClientError) as e:
+            if not limiter.should_retry(e, attempt):
+                raise
+            attempt += 1
+            delay = backoff_delay(attempt)
+            logger.info(f"Retry {attempt} on {key} in {delay:.2f}s after {e}")
+            time.sleep(delay)
+            continue
+        limiter.succeeded()
+        return result
+
+
+def stream(key, start_stream):
+    """
+    Like call for event streams. A failed stream is only retried before its first
+    event, after that the consumer has already seen part of the answer.
+    :param start_stream: Callable returning the event iterator
+    """
+    limiter = get_limiter(key)
+    attempt = 0
+    while True:
+        limiter.acquire()
+        started = False
+        try:
+            for event in start_stream():
+                started = True
+                yield event
+        except (ClientError, ConnectionError, HTTPClientError) as e:
+            if started or not limiter.should_retry(e, attempt):
+                raise
+            attempt += 1
+            delay = backoff_delay(attempt)
+            logger.info(f"Retry {attempt} on {key} in {delay:.2f}s after {e}")
+            time.sleep(delay)
+            continue
+        limiter.succeeded()
+        return
+
+
+def stats():
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    result = {}
+    for key, limiter in limiters.items():
+        with limiter.stats_lock:
+            result[key] = dict(limiter.stats)
+        result[key]["rate"] = limiter.bucket.rate
+    return result
@@ -0,0 +1,181 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+from services import cancellation
+import threading
+
+logger = logging.getLogger(__name__)
+
+# When identical in-flight prompts may share one upstream call. Agent sessions keep
+# conversation memory server-side, so an answer is only session independent when the
+# session has no history yet. Under either policy a follower's agent session does not
+# record the turn itself, bedrock_agent_runtime hands it to the agent with the
+# follower's next call instead:
+#   off        - never coalesce
+#   first_turn - coalesce only the first turn of a session (default)
+#   always     - coalesce every identical prompt of sessions without such unrecorded turns
+policies = ("off", "first_turn", "always")
+policy = os.environ.get("REQUEST_COALESCING_POLICY", "first_turn")
+if policy not in policies:
+    logger.warning(f"Unknown REQUEST_COALESCING_POLICY '{policy}', using 'first_turn'")
+    policy = "first_turn"
+# Upstream calls of coalesced requests read at once, each on a worker of its own
+max_workers = int(os.environ.get("REQUEST_COALESCING_MAX_WORKERS", "32"))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="request-coalescer")
+    return _executor
+
+
+def allowed(first_turn):
+    if policy == "always":
+        return True
+    return policy == "first_turn" and first_turn
+
+
+class _Flight:
+    """
+    Events of one upstream call, replayed to every waiter as they are published
+    """
+
+    def __init__(self):
+        self.events = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.condition = threading.Condition()
+
+    def publish(self, event):
+        with self.condition:
+            self.events.append(event)
+            self.condition.notify_all()
+
+    def finish(self, error=None):
+        with self.condition:
+            self.done = True
+            self.error = error
+            self.condition.notify_all()
+
+    def wake(self, left):
+        # Stops one subscriber waiting for the next event, see subscribe
+        with self.condition:
+            left.set()
+            self.condition.notify_all()
+
+    def subscribe(self, left):
+        """
+        Yields the events published so far and then as they come, until the flight is done.
+        Raises cancellation.Cancelled once left is set
+        """
+        position = 0
+        while True:
+            with self.condition:
+                while position >= len(self.events) and not self.done and not left.is_set():
+                    self.condition.wait()
+                if left.is_set():
+                    raise cancellation.Cancelled()
+                if position < len(self.events):
+                    event = self.events[position]
+                    position += 1
+                elif self.error is not None:
+                    raise self.error
+                else:
+                    return
+            yield event
+
+
+class RequestCoalescer:
+    """
+    Single-flight execution of identical requests. The first caller for a key (the leader)
+    starts the upstream call, concurrent callers with the same key (followers) share it.
+    The call is read on a worker of its own and every caller, the leader too, follows its
+    events, so any of them can stop at once while the others keep receiving. The call is
+    closed once nobody follows it any more. Events replayed to followers carry
+    "coalesced": True.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._upstream_calls = 0
+        self._coalesced_calls = 0
+
+    def stream(self, key, start_upstream):
+        """
+        Yields the events for key. Leader or follower is decided on the first iteration
+        :param key: Hashable identity of the request, e.g. (agent_id, agent_alias_id, normalized prompt)
+        :param start_upstream: Callable returning the upstream event iterator, only called for the leader
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+                self._upstream_calls += 1
+            else:
+                self._coalesced_calls += 1
+            flight.subscribers += 1
+        if leader:
+            get_executor().submit(self._pump, key, flight, start_upstream)
+
+        left = threading.Event()
+        # A cancelled turn stops following, the shared call goes on for the others
+        cancellation.on_cancel(lambda: flight.wake(left))
+        try:
+            for event in flight.subscribe(left):
+                yield event if leader else {**event, "coalesced": True}
+        finally:
+            with self._lock:
+                flight.subscribers -= 1
+
+    def _pump(self, key, flight, start_upstream):
+        error = None
+        upstream = None
+        try:
+            upstream = start_upstream()
+            for event in upstream:
+                flight.publish(event)
+                with self._lock:
+                    if flight.subscribers == 0:
+                        # Nobody follows any more, later callers start a call of their own
+                        if self._flights.get(key) is flight:
+                            del self._flights[key]
+                        break
+        except Exception as e:
+            error = e
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.finish(error)
+            if upstream is not None and hasattr(upstream, "close"):
+                upstream.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "policy": policy,
+                "upstream_calls": self._upstream_calls,
+                "upstream_calls_saved": self._coalesced_calls,
+                "in_flight": len(self._flights)
+            }
+
+
+coalescer = RequestCoalescer()
+
+
+def stream(key, start_upstream):
+    return coalescer.stream(key, start_upstream)
+
+
+def stats():
+    return coalescer.stats()
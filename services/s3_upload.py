@@ -0,0 +1,116 @@
+from boto3.s3.transfer import TransferConfig
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+from services import client_registry
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Multipart upload settings, see .env_sample. At most max_concurrency parts of part_size
+# are read from the upload buffer at once, whatever the size of the document
+part_size = int(float(os.environ.get("S3_UPLOAD_PART_SIZE_MB", "8")) * 1024 * 1024)
+max_concurrency = int(os.environ.get("S3_UPLOAD_MAX_CONCURRENCY", "4"))
+multipart_threshold = int(float(os.environ.get("S3_UPLOAD_MULTIPART_THRESHOLD_MB", "8")) * 1024 * 1024)
+# Documents transferred at once, further documents of a batch wait for a free slot
+max_files = int(os.environ.get("S3_UPLOAD_MAX_FILES", "4"))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max_files, thread_name_prefix="s3-upload")
+    return _executor
+
+
+def transfer_config():
+    return TransferConfig(
+        multipart_threshold=multipart_threshold,
+        multipart_chunksize=part_size,
+        max_concurrency=max_concurrency,
+        use_threads=max_concurrency > 1
+    )
+
+
+class Upload:
+    """
+    Handle of one upload streamed from an in-memory buffer to S3 on a background thread.
+    s3transfer reports progress from its own worker threads, the page polls it.
+    """
+
+    def __init__(self, key, size):
+        self.key = key
+        self.size = size
+        self.error = None
+        self._lock = threading.Lock()
+        self._sent = 0
+        self._started_at = None
+        self._finished_at = None
+        self._done = threading.Event()
+
+    def _progress(self, sent):
+        with self._lock:
+            self._sent += sent
+
+    def _run(self, client, fileobj, bucket, extra_args):
+        self._started_at = time.monotonic()
+        try:
+            # upload_fileobj reads the buffer part by part, nothing is written to local disk
+            client.upload_fileobj(fileobj, bucket, self.key, ExtraArgs=extra_args, Config=transfer_config(),
+                                  Callback=self._progress)
+        except Exception as e:
+            logger.error(f"Upload of {self.key} failed: {e}")
+            self.error = e
+        finally:
+            self._finished_at = time.monotonic()
+            self._done.set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def started(self):
+        return self._started_at is not None
+
+    def progress(self):
+        """
+        :return: Returns {"sent", "size", "fraction", "seconds", "bytes_per_second"} of the upload so far
+        """
+        with self._lock:
+            sent = self._sent
+        seconds = (self._finished_at or time.monotonic()) - self._started_at if self._started_at is not None else 0.0
+        return {
+            "sent": sent,
+            "size": self.size,
+            "fraction": sent / self.size if self.size else 1.0,
+            "seconds": seconds,
+            "bytes_per_second": sent / seconds if seconds > 0 else 0.0
+        }
+
+
+def start(fileobj, bucket, key, size, client=None, metadata=None):
+    """
+    Starts a multipart upload of a file-like object, e.g. a Streamlit UploadedFile
+    :param metadata: Optional user metadata stored with the object, e.g. its content hash
+    :return: Returns the Upload handle to poll
+    """
+    client = client or client_registry.get_client("s3", region_name="us-east-1")
+    fileobj.seek(0)
+    upload = Upload(key, size)
+    get_executor().submit(upload._run, client, fileobj, bucket, {"Metadata": metadata} if metadata else None)
+    return upload
+
+
+def format_progress(progress):
+    return (f"{progress['sent'] / 1024 / 1024:.1f} of {progress['size'] / 1024 / 1024:.1f} MiB | "
+            f"{progress['bytes_per_second'] / 1024 / 1024:.1f} MiB/s | {progress['seconds']:.1f}s")
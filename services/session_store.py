@@ -0,0 +1,330 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import closing
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Where conversation state lives so any replica can resume a session, see .env_sample
+#   memory - this process only (default)
+#   sqlite - a SQLite file, shared by replicas on the same volume
+#   kv     - a network key-value store such as Redis, "fake://" uses an in-process stand-in
+backend = os.environ.get("SESSION_STORE_BACKEND", "memory")
+sqlite_path = os.environ.get("SESSION_STORE_PATH", "sessions.sqlite3")
+kv_url = os.environ.get("SESSION_STORE_KV_URL", "fake://")
+kv_prefix = os.environ.get("SESSION_STORE_KV_PREFIX", "bedrock-chat:")
+ttl_seconds = int(os.environ.get("SESSION_STORE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Sessions kept by the memory backend, the least recently used are evicted first
+memory_max_sessions = int(os.environ.get("SESSION_STORE_MAX_SESSIONS", "10000"))
+
+
+def encode(value):
+    return zlib.compress(json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str).encode())
+
+
+def decode(data):
+    return json.loads(zlib.decompress(data))
+
+
+class SessionStore(ABC):
+    """
+    Conversation state of a chat session outside the Streamlit process. A session is its
+    metadata (e.g. the Bedrock sessionId) plus its turns, each written once when added,
+    plus a small state record rewritten as the conversation goes on (e.g. the Knowledge
+    Base session id and the router's view of the last turn).
+    """
+
+    @abstractmethod
+    def create(self, session_id, meta):
+        pass
+
+    @abstractmethod
+    def append_turn(self, session_id, seq, turn):
+        pass
+
+    @abstractmethod
+    def load(self, session_id):
+        """
+        :return: Returns {"meta": ..., "turns": [...]} or None when the session is unknown
+        """
+
+    @abstractmethod
+    def load_state(self, session_id):
+        """
+        :return: Returns the state dict of the session, empty when none was saved
+        """
+
+    @abstractmethod
+    def save_state(self, session_id, state):
+        pass
+
+    @abstractmethod
+    def delete(self, session_id):
+        pass
+
+    def update_state(self, session_id, **fields):
+        # Read-modify-write of a few state fields, the last writer wins
+        state = self.load_state(session_id)
+        state.update(fields)
+        self.save_state(session_id, state)
+        return state
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Keeps sessions in this process. Sessions idle for longer than ttl_seconds expire like
+    the kv backend's, and beyond max_sessions the least recently used one is evicted.
+    """
+
+    def __init__(self, ttl_seconds=ttl_seconds, max_sessions=memory_max_sessions):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._states = {}
+        # Session id -> time of last access, least recently used first
+        self._used = OrderedDict()
+
+    def _touch(self, session_id):
+        # Called with the lock held, marks the session as used and evicts idle or surplus sessions
+        now = time.monotonic()
+        self._used[session_id] = now
+        self._used.move_to_end(session_id)
+        while self._used:
+            oldest, used_at = next(iter(self._used.items()))
+            if now - used_at <= self.ttl_seconds and len(self._used) <= self.max_sessions:
+                break
+            self._forget(oldest)
+
+    def _forget(self, session_id):
+        self._used.pop(session_id, None)
+        self._sessions.pop(session_id, None)
+        self._states.pop(session_id, None)
+
+    def _expired(self, session_id):
+        used_at = self._used.get(session_id)
+        return used_at is not None and time.monotonic() - used_at > self.ttl_seconds
+
+    def create(self, session_id, meta):
+        with self._lock:
+            self._sessions[session_id] = {"meta": encode(meta), "turns": {}}
+            self._touch(session_id)
+
+    def append_turn(self, session_id, seq, turn):
+        with self._lock:
+            # A session evicted while its page is still open starts over, like an expired kv session
+            session = self._sessions.setdefault(session_id, {"meta": encode({}), "turns": {}})
+            session["turns"][seq] = encode(turn)
+            self._touch(session_id)
+
+    def load(self, session_id):
+        with self._lock:
+            if self._expired(session_id):
+                self._forget(session_id)
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            self._touch(session_id)
+            return {
+                "meta": decode(session["meta"]),
+                "turns": [decode(session["turns"][seq]) for seq in sorted(session["turns"])]
+            }
+
+    def load_state(self, session_id):
+        with self._lock:
+            if self._expired(session_id):
+                self._forget(session_id)
+            state = self._states.get(session_id)
+            if state is not None:
+                self._touch(session_id)
+        return decode(state) if state is not None else {}
+
+    def save_state(self, session_id, state):
+        with self._lock:
+            self._states[session_id] = encode(state)
+            self._touch(session_id)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._forget(session_id)
+
+
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, path=sqlite_path):
+        self.path = path
+        with closing(self._connect()) as connection, connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, meta BLOB NOT NULL)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS turns "
+                "(session_id TEXT NOT NULL, seq INTEGER NOT NULL, turn BLOB NOT NULL, PRIMARY KEY (session_id, seq))"
+            )
+            connection.execute("CREATE TABLE IF NOT EXISTS states (session_id TEXT PRIMARY KEY, state BLOB NOT NULL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def create(self, session_id, meta):
+        with closing(self._connect()) as connection, connection:
+            connection.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?)", (session_id, encode(meta)))
+
+    def append_turn(self, session_id, seq, turn):
+        with closing(self._connect()) as connection, connection:
+            connection.execute("INSERT OR REPLACE INTO turns VALUES (?, ?, ?)", (session_id, seq, encode(turn)))
+
+    def load(self, session_id):
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT meta FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                return None
+            turns = connection.execute(
+                "SELECT turn FROM turns WHERE session_id = ? ORDER BY seq", (session_id,)
+            ).fetchall()
+        return {"meta": decode(row[0]), "turns": [decode(turn[0]) for turn in turns]}
+
+    def load_state(self, session_id):
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT state FROM states WHERE session_id = ?", (session_id,)).fetchone()
+        return decode(row[0]) if row else {}
+
+    def save_state(self, session_id, state):
+        with closing(self._connect()) as connection, connection:
+            connection.execute("INSERT OR REPLACE INTO states VALUES (?, ?)", (session_id, encode(state)))
+
+    def delete(self, session_id):
+        with closing(self._connect()) as connection, connection:
+            connection.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            connection.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            connection.execute("DELETE FROM states WHERE session_id = ?", (session_id,))
+
+
+class FakeKVClient:
+    """
+    In-process stand-in for the subset of the Redis client API the KV store uses
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def _live(self, key, now):
+        value = self._data.get(key)
+        if value is not None and value[1] is not None and value[1] <= now:
+            del self._data[key]
+            return None
+        return value
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ex if ex else None)
+        return True
+
+    def mget(self, keys):
+        now = time.monotonic()
+        with self._lock:
+            return [value[0] if value else None for value in (self._live(key, now) for key in keys)]
+
+    def get(self, key):
+        return self.mget([key])[0]
+
+    def expire(self, key, seconds):
+        now = time.monotonic()
+        with self._lock:
+            value = self._live(key, now)
+            if value is None:
+                return False
+            self._data[key] = (value[0], now + seconds)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(1 for key in keys if self._data.pop(key, None) is not None)
+
+
+class KVSessionStore(SessionStore):
+    """
+    Stores every turn under its own key, so an update is a single small SET. Loading
+    reads turns in batches until the first missing sequence number. Every write extends the
+    expiry of the session's meta and state, loading extends the expiry of its turns.
+    """
+
+    def __init__(self, client, prefix=kv_prefix, ttl_seconds=ttl_seconds, batch_size=50):
+        self.client = client
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+        self.batch_size = batch_size
+
+    def _meta_key(self, session_id):
+        return f"{self.prefix}{session_id}:meta"
+
+    def _turn_key(self, session_id, seq):
+        return f"{self.prefix}{session_id}:turn:{seq}"
+
+    def _state_key(self, session_id):
+        return f"{self.prefix}{session_id}:state"
+
+    def _touch(self, keys):
+        for key in keys:
+            self.client.expire(key, self.ttl_seconds)
+
+    def create(self, session_id, meta):
+        self.client.set(self._meta_key(session_id), encode(meta), ex=self.ttl_seconds)
+
+    def append_turn(self, session_id, seq, turn):
+        self.client.set(self._turn_key(session_id, seq), encode(turn), ex=self.ttl_seconds)
+        # An active session must not lose its meta while its turns are still written
+        self._touch([self._meta_key(session_id), self._state_key(session_id)])
+
+    def load(self, session_id):
+        meta = self.client.get(self._meta_key(session_id))
+        if meta is None:
+            return None
+        turns = []
+        while True:
+            keys = [self._turn_key(session_id, seq) for seq in range(len(turns), len(turns) + self.batch_size)]
+            values = self.client.mget(keys)
+            for value in values:
+                if value is None:
+                    # A resumed session lives another ttl_seconds, its oldest turns included
+                    self._touch([self._meta_key(session_id), self._state_key(session_id)] +
+                                [self._turn_key(session_id, seq) for seq in range(len(turns))])
+                    return {"meta": decode(meta), "turns": turns}
+                turns.append(decode(value))
+
+    def load_state(self, session_id):
+        state = self.client.get(self._state_key(session_id))
+        return decode(state) if state is not None else {}
+
+    def save_state(self, session_id, state):
+        self.client.set(self._state_key(session_id), encode(state), ex=self.ttl_seconds)
+        self._touch([self._meta_key(session_id)])
+
+    def delete(self, session_id):
+        loaded = self.load(session_id)
+        count = len(loaded["turns"]) if loaded else 0
+        self.client.delete(self._meta_key(session_id), self._state_key(session_id),
+                           *[self._turn_key(session_id, seq) for seq in range(count)])
+
+
+def create_store(backend=backend):
+    if backend == "memory":
+        return InMemorySessionStore()
+    if backend == "sqlite":
+        return SQLiteSessionStore(sqlite_path)
+    if backend == "kv":
+        if kv_url.startswith("fake://"):
+            return KVSessionStore(FakeKVClient())
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("SESSION_STORE_BACKEND=kv needs the redis package: pip install redis")
+        return KVSessionStore(redis.Redis.from_url(kv_url))
+    raise ValueError(f"Unknown SESSION_STORE_BACKEND '{backend}'")
+
+
+store = create_store()
@@ -0,0 +1,93 @@
+import json
+import logging
+import math
+import random
+
+from services.answer_cache import normalize_prompt, vectorize
+
+logger = logging.getLogger(__name__)
+
+
+class TextClassifier:
+    """
+    Small local multinomial logistic regression over the word unigram and bigram features
+    of answer_cache.vectorize. Trains in well under a second on a few thousand prompts and
+    classifies in microseconds, no model endpoint involved.
+    """
+
+    def __init__(self, labels, weights=None, bias=None):
+        self.labels = list(labels)
+        self.weights = weights or {label: {} for label in self.labels}
+        self.bias = bias or {label: 0.0 for label in self.labels}
+
+    @staticmethod
+    def features(text):
+        return vectorize(normalize_prompt(text))
+
+    def _scores(self, features):
+        return {
+            label: self.bias[label] + sum(self.weights[label].get(feature, 0.0) * value for feature, value in features.items())
+            for label in self.labels
+        }
+
+    def probabilities(self, text):
+        scores = self._scores(self.features(text))
+        top = max(scores.values())
+        exps = {label: math.exp(score - top) for label, score in scores.items()}
+        total = sum(exps.values())
+        return {label: value / total for label, value in exps.items()}
+
+    def predict(self, text):
+        """
+        :return: Returns (label, probability) of the most likely label
+        """
+        probabilities = self.probabilities(text)
+        label = max(probabilities, key=probabilities.get)
+        return label, probabilities[label]
+
+    def fit(self, examples, epochs=20, learning_rate=0.5, l2=1e-4, seed=0):
+        """
+        Trains with stochastic gradient descent
+        :param examples: List of (text, label) pairs
+        """
+        rng = random.Random(seed)
+        featurized = [(self.features(text), label) for text, label in examples]
+        for epoch in range(epochs):
+            rng.shuffle(featurized)
+            for features, label in featurized:
+                scores = self._scores(features)
+                top = max(scores.values())
+                exps = {candidate: math.exp(score - top) for candidate, score in scores.items()}
+                total = sum(exps.values())
+                for candidate in self.labels:
+                    gradient = exps[candidate] / total - (1.0 if candidate == label else 0.0)
+                    weights = self.weights[candidate]
+                    for feature, value in features.items():
+                        weight = weights.get(feature, 0.0)
+                        weights[feature] = weight - learning_rate * (gradient * value + l2 * weight)
+                    self.bias[candidate] -= learning_rate * gradient
+        # Drop weights too small to matter so the saved model stays compact
+        for label in self.labels:
+            self.weights[label] = {feature: round(weight, 4) for feature, weight in self.weights[label].items() if abs(weight) >= 1e-3}
+        return self
+
+    def save(self, path):
+        with open(path, "w") as file:
+            json.dump({"labels": self.labels, "weights": self.weights, "bias": self.bias}, file, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as file:
+            model = json.load(file)
+        return cls(model["labels"], model["weights"], model["bias"])
+
+
+def load_optional(path):
+    # Returns the model at path, or None when no path is configured or it cannot be read
+    if not path:
+        return None
+    try:
+        return TextClassifier.load(path)
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Could not load text classifier from {path}: {e}")
+        return None
@@ -0,0 +1,151 @@
+from collections import OrderedDict
+import datetime
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Rolling on-disk ledger of per-turn token usage, rotated to <path>.1 once it grows past the limit
+ledger_path = os.environ.get("TOKEN_LEDGER_PATH", ".token_ledger.jsonl")
+ledger_max_bytes = int(os.environ.get("TOKEN_LEDGER_MAX_BYTES", str(10 * 1024 * 1024)))
+# Sessions with a running total in memory, the least recently active one is dropped first
+ledger_max_sessions = int(os.environ.get("TOKEN_LEDGER_MAX_SESSIONS", "10000"))
+
+phase_by_trace_type = {
+    "preProcessingTrace": "pre_processing",
+    "orchestrationTrace": "orchestration",
+    "postProcessingTrace": "post_processing"
+}
+
+
+def new_usage():
+    return {"input_tokens": 0, "output_tokens": 0, "model_invocations": 0}
+
+
+def add_usage(total, usage):
+    for field in total:
+        total[field] += usage.get(field, 0)
+
+
+class TurnUsage:
+    """
+    Token usage of one agent turn, summed from the usage metadata of every
+    modelInvocationOutput step in the trace stream and attributed to its phase.
+    Usage replayed from a coalesced call (see request_coalescer) was already counted
+    by the leading session, it is kept apart under coalesced.
+    """
+
+    def __init__(self):
+        self.phases = {phase: new_usage() for phase in phase_by_trace_type.values()}
+        self.coalesced = new_usage()
+
+    def observe(self, event):
+        if event["type"] != "trace" or event["trace_type"] not in phase_by_trace_type:
+            return
+        output = event["trace"].get("modelInvocationOutput")
+        if output is None:
+            return
+        usage = output.get("metadata", {}).get("usage", {})
+        if event.get("coalesced"):
+            bucket = self.coalesced
+        else:
+            bucket = self.phases[phase_by_trace_type[event["trace_type"]]]
+        bucket["input_tokens"] += usage.get("inputTokens", 0)
+        bucket["output_tokens"] += usage.get("outputTokens", 0)
+        bucket["model_invocations"] += 1
+
+    def total(self):
+        total = new_usage()
+        for usage in self.phases.values():
+            add_usage(total, usage)
+        return total
+
+    def summary(self):
+        return {"total": self.total(), "phases": self.phases, "coalesced": self.coalesced}
+
+
+def metered(events, turn_usage):
+    # Passes events through while accumulating their token usage
+    for event in events:
+        turn_usage.observe(event)
+        yield event
+
+
+class UsageLedger:
+    def __init__(self, path=ledger_path, max_bytes=ledger_max_bytes, max_sessions=ledger_max_sessions):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self.process_total = new_usage()
+        self.process_phases = {phase: new_usage() for phase in phase_by_trace_type.values()}
+        self.process_coalesced = new_usage()
+        self.session_totals = OrderedDict()
+
+    def record(self, session_id, agent_id, agent_alias_id, turn_usage):
+        """
+        Adds a finished turn to the session and process totals and appends it to the ledger.
+        Coalesced usage is recorded apart and left out of the totals
+        :return: Returns the running usage total of the session
+        """
+        summary = turn_usage.summary()
+        entry = {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "session_id": session_id,
+            "agent_id": agent_id,
+            "agent_alias_id": agent_alias_id,
+            **summary
+        }
+        with self._lock:
+            add_usage(self.process_total, summary["total"])
+            for phase, usage in summary["phases"].items():
+                add_usage(self.process_phases[phase], usage)
+            add_usage(self.process_coalesced, summary["coalesced"])
+            session_total = self.session_totals.get(session_id)
+            if session_total is None:
+                session_total = self.session_totals[session_id] = new_usage()
+                while len(self.session_totals) > self.max_sessions:
+                    self.session_totals.popitem(last=False)
+            else:
+                self.session_totals.move_to_end(session_id)
+            add_usage(session_total, summary["total"])
+            session_total = dict(session_total)
+            try:
+                self._append(entry)
+            except OSError as e:
+                logger.warning(f"Could not write token ledger {self.path}: {e}")
+        return session_total
+
+    def _append(self, entry):
+        if self.path is None or self.path == "":
+            return
+        if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+            os.replace(self.path, self.path + ".1")
+        with open(self.path, "a") as file:
+            file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "total": dict(self.process_total),
+                "phases": {phase: dict(usage) for phase, usage in self.process_phases.items()},
+                "coalesced": dict(self.process_coalesced),
+                "sessions": len(self.session_totals)
+            }
+
+
+ledger = UsageLedger()
+
+
+def record(session_id, agent_id, agent_alias_id, turn_usage):
+    return ledger.record(session_id, agent_id, agent_alias_id, turn_usage)
+
+
+def stats():
+    return ledger.stats()
+
+
+def format_usage(usage):
+    return f"{usage['input_tokens']:,} in / {usage['output_tokens']:,} out tokens, {usage['model_invocations']} model calls"
@@ -0,0 +1,127 @@
+import json
+import sys
+
+from services.agent_response import trace_info_types_map, trace_types_map
+
+
+class TraceStep:
+    """
+    One trace step as shown in the Bedrock console: every trace part sharing a traceId
+    within a trace type, numbered across the whole turn. Parts are kept as compact JSON,
+    which takes a fraction of the memory of the decoded nested dicts. The pretty-printed
+    text is only built for steps that are shown, once.
+    """
+    __slots__ = ("number", "trace_type", "trace_id", "parts", "_texts")
+
+    def __init__(self, trace_type, trace_id):
+        self.number = 0
+        self.trace_type = trace_type
+        self.trace_id = trace_id
+        self.parts = []
+        self._texts = None
+
+    def add_part(self, trace):
+        self.parts.append(json.dumps(trace, separators=(",", ":"), ensure_ascii=False, default=str))
+        self._texts = None
+
+    def documents(self):
+        return [json.loads(part) for part in self.parts]
+
+    def texts(self):
+        # Every rerun showing the step reuses the same strings
+        if self._texts is None:
+            self._texts = [json.dumps(document, indent=2, default=str) for document in self.documents()]
+        return self._texts
+
+
+class TraceIndex:
+    """
+    Trace of one agent turn, indexed by trace type and traceId while the events stream in.
+    Step numbers are assigned once when the turn is complete, so rendering never regroups.
+    """
+    __slots__ = ("_steps", "_numbered", "_step_count")
+
+    def __init__(self):
+        self._steps = {}
+        self._numbered = True
+        self._step_count = 0
+
+    def add(self, trace_type, trace):
+        """
+        Adds one trace part
+        :param trace_type: The mapped trace type, e.g. preGuardrailTrace or orchestrationTrace
+        :param trace: The trace part as found in the event under its trace type
+        """
+        steps = self._steps.get(trace_type)
+        if steps is None:
+            steps = self._steps[trace_type] = {}
+
+        if trace_type in trace_info_types_map:
+            for trace_info_type in trace_info_types_map[trace_type]:
+                if trace_info_type in trace:
+                    trace_id = sys.intern(trace[trace_info_type]["traceId"])
+                    step = steps.get(trace_id)
+                    if step is None:
+                        step = steps[trace_id] = TraceStep(trace_type, trace_id)
+                        self._step_count += 1
+                    step.add_part(trace)
+                    break
+        else:
+            # Guardrail traces carry their traceId at the top level and form a step on their own
+            trace_id = sys.intern(trace["traceId"])
+            if trace_id not in steps:
+                self._step_count += 1
+            step = steps[trace_id] = TraceStep(trace_type, trace_id)
+            step.add_part({trace_type: trace})
+        self._numbered = False
+
+    def add_event(self, event):
+        if event["type"] == "trace":
+            self.add(event["mapped_trace_type"], event["trace"])
+
+    def _number(self):
+        number = 1
+        for trace_type_header in trace_types_map:
+            for trace_type in trace_types_map[trace_type_header]:
+                for step in self._steps.get(trace_type, {}).values():
+                    step.number = number
+                    number += 1
+        self._numbered = True
+
+    def steps(self, trace_type):
+        if not self._numbered:
+            self._number()
+        return list(self._steps.get(trace_type, {}).values())
+
+    def phase_steps(self, trace_type_header):
+        """
+        :param trace_type_header: One of the headers of trace_types_map, e.g. Orchestration
+        :return: Returns the steps of the phase in display order
+        """
+        steps = []
+        for trace_type in trace_types_map[trace_type_header]:
+            steps += self.steps(trace_type)
+        return steps
+
+    def has_trace_type(self, trace_type):
+        return trace_type in self._steps
+
+    def __len__(self):
+        return self._step_count
+
+
+def indexed(events, trace_index):
+    # Passes events through while adding their traces to the index
+    for event in events:
+        trace_index.add_event(event)
+        yield event
+
+
+def from_trace(trace):
+    # Builds an index from the trace dict returned by invoke_agent
+    trace_index = TraceIndex()
+    for trace_type_header in trace_types_map:
+        for trace_type in trace_types_map[trace_type_header]:
+            for part in trace.get(trace_type, []):
+                trace_index.add(trace_type, part)
+    return trace_index
@@ -0,0 +1,237 @@
+"""
+Runs a JSONL question set through the agent (BedRockClient.invoke_bedrock_agent) and the
+Knowledge Base only retrieve_and_generate path, and compares the runs.
+
+    python batch_evaluate.py sample_questions.jsonl --target agent:ALIAS_A --target agent:ALIAS_B --target kb
+    python batch_evaluate.py sample_questions.jsonl --fake --output results.jsonl
+    python batch_evaluate.py --summarize results.jsonl older_results.parquet
+
+Each line of the question set is {"question": ...} with an optional "id". Every question
+gets its own session id, so answers do not depend on the order they run in. Each result
+row holds the latency, time to first chunk, token usage, citations and the answer.
+--fake answers from the local runtime stub, to try the tool without an AWS account.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import json
+import os
+import sys
+import time
+import uuid
+
+# Make the shared services and benchmarks packages importable when running from the src/ directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from call_bedrock_agent import BedRockClient
+from services import answer_cache, bedrock_agent_runtime, knowledge_base_runtime, latency_analyzer, rate_limiter, token_usage
+
+load_dotenv()
+
+
+class FakeBedRockClient(BedRockClient):
+    def __init__(self, stub):
+        super().__init__()
+        self.stub = stub
+
+    def return_runtime_client(self, run_time=True):
+        return self.stub
+
+
+def read_questions(path):
+    with open(path, "r") as file:
+        questions = [json.loads(line) for line in file if line.strip()]
+    for num, question in enumerate(questions):
+        question.setdefault("id", str(num + 1))
+    return questions
+
+
+def citation_uris(citations):
+    uris = []
+    for citation in citations:
+        for retrieved_ref in citation["retrievedReferences"]:
+            location = retrieved_ref.get("location", {})
+            uri = location.get("s3Location", {}).get("uri") or location.get("webLocation", {}).get("url")
+            if uri and uri not in uris:
+                uris.append(uri)
+    return uris
+
+
+def run_agent(bedrock_client, agent_id, agent_alias_id, question):
+    events = []
+    first_chunk = []
+    started = time.monotonic()
+
+    def on_event(event):
+        if "chunk" in event and not first_chunk:
+            first_chunk.append(time.monotonic() - started)
+        events.append(event)
+
+    answer, _ = bedrock_client.invoke_bedrock_agent(
+        agent_id, agent_alias_id, str(uuid.uuid4()), question, enable_trace=True, on_event=on_event, verbose=False
+    )
+    latency = time.monotonic() - started
+
+    response = bedrock_agent_runtime.new_response()
+    turn_usage = token_usage.TurnUsage()
+    timer = latency_analyzer.TurnTimer()
+    for event in bedrock_agent_runtime.parse_completion(events):
+        bedrock_agent_runtime.add_event(response, event)
+        turn_usage.observe(event)
+        timer.observe(event)
+    total = turn_usage.total()
+    return {
+        "latency_seconds": latency,
+        "time_to_first_chunk_seconds": first_chunk[0] if first_chunk else None,
+        "input_tokens": total["input_tokens"],
+        "output_tokens": total["output_tokens"],
+        "model_invocations": timer.model_invocations,
+        "citations": citation_uris(response["citations"]),
+        "answer": answer
+    }
+
+
+def run_knowledge_base(client, question):
+    started = time.monotonic()
+    response = knowledge_base_runtime.retrieve_and_generate(question, client=client)
+    latency = time.monotonic() - started
+    # retrieve_and_generate returns the whole answer at once and reports no token usage
+    return {
+        "latency_seconds": latency,
+        "time_to_first_chunk_seconds": latency,
+        "input_tokens": None,
+        "output_tokens": None,
+        "model_invocations": None,
+        "citations": citation_uris(response["citations"]),
+        "answer": response["output"]["text"]
+    }
+
+
+def run_question(target, question, bedrock_client, runtime_client, agent_id):
+    result = {"target": target, "id": question["id"], "question": question["question"], "error": None}
+    try:
+        if target == "kb":
+            result.update(run_knowledge_base(runtime_client, question["question"]))
+        else:
+            result.update(run_agent(bedrock_client, agent_id, target.split(":", 1)[1], question["question"]))
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def write_results(path, results):
+    if path.endswith(".parquet"):
+        # Needs pyarrow or fastparquet next to pandas
+        import pandas
+        pandas.DataFrame(results).to_parquet(path, index=False)
+    else:
+        with open(path, "w") as file:
+            for result in results:
+                file.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+def read_results(path):
+    if path.endswith(".parquet"):
+        import pandas
+        frame = pandas.read_parquet(path)
+        return json.loads(frame.to_json(orient="records"))
+    with open(path, "r") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def summarize(results):
+    summary = {}
+    for result in results:
+        summary.setdefault(result["target"], []).append(result)
+
+    def mean(values):
+        values = [value for value in values if value is not None]
+        return sum(values) / len(values) if values else None
+
+    rows = []
+    for target, target_results in summary.items():
+        ok = [result for result in target_results if result["error"] is None]
+        latencies = sorted(result["latency_seconds"] for result in ok)
+        first_chunks = sorted(result["time_to_first_chunk_seconds"] for result in ok
+                              if result["time_to_first_chunk_seconds"] is not None)
+        rows.append({
+            "target": target,
+            "questions": len(target_results),
+            "errors": len(target_results) - len(ok),
+            "p50_seconds": latency_analyzer.percentile(latencies, 0.50),
+            "p95_seconds": latency_analyzer.percentile(latencies, 0.95),
+            "p50_first_chunk_seconds": latency_analyzer.percentile(first_chunks, 0.50),
+            "mean_input_tokens": mean(result["input_tokens"] for result in ok),
+            "mean_output_tokens": mean(result["output_tokens"] for result in ok),
+            "mean_citations": mean(len(result["citations"]) for result in ok)
+        })
+    return rows
+
+
+def print_summary(rows):
+    def cell(value, digits):
+        return "-" if value is None else f"{value:.{digits}f}"
+
+    print(f"{'target':<28}{'questions':>10}{'errors':>8}{'p50 s':>8}{'p95 s':>8}{'p50 ttfc':>10}"
+          f"{'in tok':>9}{'out tok':>9}{'citations':>11}")
+    for row in rows:
+        print(f"{row['target']:<28}{row['questions']:>10}{row['errors']:>8}{cell(row['p50_seconds'], 2):>8}"
+              f"{cell(row['p95_seconds'], 2):>8}{cell(row['p50_first_chunk_seconds'], 2):>10}"
+              f"{cell(row['mean_input_tokens'], 0):>9}{cell(row['mean_output_tokens'], 0):>9}"
+              f"{cell(row['mean_citations'], 1):>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions", nargs="?", help="JSONL question set")
+    parser.add_argument("--target", action="append",
+                        help="agent:<alias id> or kb, repeat to compare, default the configured alias and kb")
+    parser.add_argument("--agent-id", default=os.environ.get("BEDROCK_AGENT_ID"))
+    parser.add_argument("--concurrency", type=int, default=4, help="Questions in flight at once")
+    parser.add_argument("--output", help="Write one result per question and target, .jsonl or .parquet")
+    parser.add_argument("--use-cache", action="store_true", help="Allow answers from the answer cache")
+    parser.add_argument("--fake", action="store_true", help="Answer from the local runtime stub")
+    parser.add_argument("--summarize", nargs="+", metavar="RESULTS", help="Only print the summary of earlier result files")
+    args = parser.parse_args()
+
+    if args.summarize:
+        results = []
+        for path in args.summarize:
+            results += read_results(path)
+        print_summary(summarize(results))
+        return
+    if not args.questions:
+        parser.error("the questions file is required unless --summarize is given")
+
+    targets = args.target or [f"agent:{os.environ.get('BEDROCK_AGENT_ALIAS_ID', 'TSTALIASID')}", "kb"]
+    # Repeated questions would otherwise measure the cache rather than the path under test
+    answer_cache.enabled = args.use_cache
+
+    if args.fake:
+        from benchmarks.stub_runtime import StubAgentRuntimeClient
+        runtime_client = StubAgentRuntimeClient(latency=0.005, first_event_latency=0.05)
+        bedrock_client = FakeBedRockClient(runtime_client)
+        args.agent_id = args.agent_id or "fake-agent"
+        rate_limiter.rate_overrides[rate_limiter.agent_key(args.agent_id)] = 1e9
+        rate_limiter.rate_overrides[rate_limiter.knowledge_base_key(knowledge_base_runtime.get_knowledge_base_id())] = 1e9
+    else:
+        runtime_client = None
+        bedrock_client = BedRockClient(region_name=os.environ.get("REGION_NAME", "us-east-1"))
+
+    questions = read_questions(args.questions)
+    jobs = [(target, question) for target in targets for question in questions]
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(
+            lambda job: run_question(job[0], job[1], bedrock_client, runtime_client, args.agent_id), jobs
+        ))
+
+    for result in results:
+        if result["error"] is not None:
+            print(f"{result['target']} question {result['id']} failed: {result['error']}")
+    if args.output:
+        write_results(args.output, results)
+        print(f"Wrote {len(results)} results to {args.output}")
+    print_summary(summarize(results))
+
+
+if __name__ == "__main__":
+    main()
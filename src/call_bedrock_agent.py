@@ -1,8 +1,12 @@
-import boto3
 from botocore.client import BaseClient
 from botocore.exceptions import ClientError
 from dotenv import load_dotenv
 import os
+import sys
+
+# Make the shared services package importable when running from the src/ directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services import client_registry, input_filter, rate_limiter
 
 load_dotenv()
 
@@ -34,16 +38,16 @@ class BedRockClient():
 
     def return_runtime_client(self, run_time=True) -> BaseClient:
         """
-        This funtion returns the appropriate bedrock client
+        This funtion returns the appropriate bedrock client from the shared client registry
         :param run_time: If true, returns the run time client, else the normal client
         :return: Returns the bedrock client
         """
         if run_time:
-            bedrock_client = boto3.client(
+            bedrock_client = client_registry.get_client(
                 service_name="bedrock-agent-runtime",
                 region_name=self.region_name)
         else:
-            bedrock_client = boto3.client(
+            bedrock_client = client_registry.get_client(
                 service_name="bedrock-agent",
                 region_name=self.region_name)
 
@@ -73,28 +77,49 @@ class BedRockClient():
                              agent_id,
                              agent_alias_id,
                              session_id,
-                             prompt=None):
+                             prompt=None,
+                             enable_trace=False,
+                             on_event=None,
+                             verbose=True):
         """
         This function will be interacting with the agent
         :param agent_id: The agent id of the agent
         :param agent_alias_id: The agent alias id of the agent
         :param session_id: A unique id that identifies the chat session
         :param prompt: The prompt or the question that needs to be answered
+        :param enable_trace: If true, the agent returns the trace of every step, including token usage
+        :param on_event: Optional callable receiving every raw event as it arrives
+        :param verbose: If true, prints every event
         :return: Returns the response
         """
 
         completion = ""
         traces =[]
+        # Same local screening as the app, the agent may run without its PRE_PROCESSING phase
+        if prompt is not None and not input_filter.allowed(prompt):
+            if verbose:
+                print(f"Rejected by the local input filter: {prompt}")
+            return input_filter.rejection_message, traces
+
         try:
             bedrock_client = self.return_runtime_client(run_time=True)
-            response = bedrock_client.invoke_agent(
-                agentId=agent_id,
-                agentAliasId=agent_alias_id,
-                sessionId=session_id,
-                inputText=prompt,
-            )
-            for event in response.get("completion"):
-                print(event)
+
+            def start_stream():
+                response = bedrock_client.invoke_agent(
+                    agentId=agent_id,
+                    agentAliasId=agent_alias_id,
+                    sessionId=session_id,
+                    inputText=prompt,
+                    enableTrace=enable_trace
+                )
+                return response.get("completion")
+
+            # Throttled calls are retried with backoff, any other error is raised to the caller
+            for event in rate_limiter.stream(rate_limiter.agent_key(agent_id), start_stream):
+                if verbose:
+                    print(event)
+                if on_event is not None:
+                    on_event(event)
                 try:
                     trace = event["trace"]
                     traces.append(trace['trace'])
@@ -106,6 +131,7 @@ class BedRockClient():
 
         except ClientError as e:
             print(e)
+            raise
 
         return completion, traces
 
@@ -0,0 +1,44 @@
+"""
+Named latency profiles for the agent. A profile decides the foundation model and, for each
+advanced prompt phase, whether it runs, its maximum output length and whether the full or
+the trimmed prompt template is used. Every enabled phase is one more model call per turn.
+
+    thorough    - all three phases with the full templates, the original configuration
+    balanced    - short pre-processing classification, no post-processing rewrite
+    low-latency - orchestration only on a faster model, with a trimmed template
+"""
+
+default_profile = "thorough"
+
+profiles = {
+    "thorough": {
+        "foundation_model": "anthropic.claude-v2",
+        "phases": {
+            "PRE_PROCESSING": {"state": "ENABLED", "maximum_length": 2048, "template": "full"},
+            "ORCHESTRATION": {"state": "ENABLED", "maximum_length": 2048, "template": "full"},
+            "POST_PROCESSING": {"state": "ENABLED", "maximum_length": 2048, "template": "full"}
+        }
+    },
+    "balanced": {
+        "foundation_model": "anthropic.claude-v2",
+        "phases": {
+            "PRE_PROCESSING": {"state": "ENABLED", "maximum_length": 256, "template": "trimmed"},
+            "ORCHESTRATION": {"state": "ENABLED", "maximum_length": 2048, "template": "full"},
+            "POST_PROCESSING": {"state": "DISABLED", "maximum_length": 2048, "template": "full"}
+        }
+    },
+    "low-latency": {
+        "foundation_model": "anthropic.claude-instant-v1",
+        "phases": {
+            "PRE_PROCESSING": {"state": "DISABLED", "maximum_length": 256, "template": "trimmed"},
+            "ORCHESTRATION": {"state": "ENABLED", "maximum_length": 1024, "template": "trimmed"},
+            "POST_PROCESSING": {"state": "DISABLED", "maximum_length": 2048, "template": "full"}
+        }
+    }
+}
+
+
+def get_profile(name):
+    if name not in profiles:
+        raise ValueError(f"Unknown agent latency profile '{name}', choose one of {', '.join(profiles)}")
+    return profiles[name]
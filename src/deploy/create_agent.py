@@ -1,8 +1,9 @@
 import boto3
-import time
 import zipfile
 from io import BytesIO
 import json 
+from agent_profiles import default_profile, get_profile
+import waiters
 
 
 # getting boto3 clients for required AWS services
@@ -81,10 +82,12 @@ schema_json_string = {
 }
 
 
-def get_prompt_override_config(region,account_id):
+def get_prompt_override_config(region,account_id,profile=default_profile,local_input_filter=False):
         """
         This function returns the value for the key promptOverrideConfiguration which will be used
         while creating the agent
+        :param profile: Name of the latency profile in agent_profiles.py deciding which phases run and how
+        :param local_input_filter: Disable PRE_PROCESSING because the app classifies input itself (services/input_filter.py)
         :return: value for the key promptOverrideConfiguration
         """
 
@@ -101,6 +104,18 @@ Here is how you should classify the input:
 
 Please think hard about the input in <thinking> XML tags and provide the category letter to sort the input into within <category> XML tags.Please also share the rationale for categorization.
 
+Assistant:
+        """
+
+        # Classification only, without the reasoning the full template asks for
+        PRE_PROCESSING_PROMPT_TRIMMED="""
+Human: 
+Classify the input. Category M: harmful and/or malicious, even if fictional. Category N: anything else.
+
+<input>$question$</input>
+
+Reply with only the category letter within <category> XML tags.
+
 Assistant:
         """
 
@@ -123,6 +138,23 @@ Use the following format:
 <context>$instruction$</context>
 <question>$question$</question>
 
+Assistant:
+"""
+
+        # Same action format as the full template with the instructions cut down to the essentials
+        ORCHESTRATION_PROMPT_TRIMMED = """
+Human:
+Answer only from the context below, otherwise say you cannot answer. Use this format, repeating thought/action/action_input/observation as needed:
+
+<thought>what to do</thought>
+<action>the action to take, based on $instruction$</action>
+<action_input>the input to the action</action_input>
+<observation>the result of the action</observation>
+<answer>the final answer</answer>
+
+<context>$instruction$</context>
+<question>$question$</question>
+
 Assistant:
 """
 
@@ -156,62 +188,43 @@ Please output your transformed response within <final_response></final_response>
 Assistant:
         """
 
+        templates = {
+            "PRE_PROCESSING": {"full": PRE_PROCESSING_PROMPT, "trimmed": PRE_PROCESSING_PROMPT_TRIMMED},
+            "ORCHESTRATION": {"full": ORCHESTRATION_PROMPT, "trimmed": ORCHESTRATION_PROMPT_TRIMMED},
+            "POST_PROCESSING": {"full": POST_PROCESSING_PROMPT}
+        }
+
         config = {
             "overrideLambda": f"arn:aws:lambda:{region}:{account_id}:function:preprocess-lambda",
-            "promptConfigurations": [
-                {
-                    "basePromptTemplate": PRE_PROCESSING_PROMPT,
-                    "inferenceConfiguration": {
-                        "maximumLength": 2048,
-                        "stopSequences": ["Human:"],
-                        "temperature": 0,
-                        "topK": 1,
-                        "topP": 1
-                    },
-                    "parserMode": "OVERRIDDEN",
-                    "promptCreationMode": "OVERRIDDEN",
-                    "promptState": "ENABLED",
-                    "promptType": "PRE_PROCESSING"
-                },
-                {
-                    "basePromptTemplate": ORCHESTRATION_PROMPT,
-                    "inferenceConfiguration": {
-                        "maximumLength": 2048,
-                        "stopSequences": ["Human:"],
-                        "temperature": 0,
-                        "topK": 1,
-                        "topP": 1
-                    },
-                    "parserMode": "OVERRIDDEN",
-                    "promptCreationMode": "OVERRIDDEN",
-                    "promptState": "ENABLED",
-                    "promptType": "ORCHESTRATION"
-                },
-                {
-                    "basePromptTemplate": POST_PROCESSING_PROMPT,
-                    "inferenceConfiguration": {
-                        "maximumLength": 2048,
-                        "stopSequences": ["Human:"],
-                        "temperature": 0,
-                        "topK": 1,
-                        "topP": 1
-                    },
-                    "parserMode": "OVERRIDDEN",
-                    "promptCreationMode": "OVERRIDDEN",
-                    "promptState": "ENABLED",
-                    "promptType": "POST_PROCESSING"
-                }
-            ]
+            "promptConfigurations": []
         }
+        for prompt_type, phase in get_profile(profile)["phases"].items():
+            state = phase["state"]
+            if prompt_type == "PRE_PROCESSING" and local_input_filter:
+                state = "DISABLED"
+            config["promptConfigurations"].append({
+                "basePromptTemplate": templates[prompt_type][phase["template"]],
+                "inferenceConfiguration": {
+                    "maximumLength": phase["maximum_length"],
+                    "stopSequences": ["Human:"],
+                    "temperature": 0,
+                    "topK": 1,
+                    "topP": 1
+                },
+                "parserMode": "OVERRIDDEN",
+                "promptCreationMode": "OVERRIDDEN",
+                "promptState": state,
+                "promptType": prompt_type
+            })
 
-      
         return config
 
 
-def create_agent(region, account_id, kb_arn, kb_id):
+def create_agent(region, account_id, kb_arn, kb_id, profile=default_profile, local_input_filter=False):
 
     #create all the required policies and roles
-    va_agent_role_arn = create_agent_role(region, account_id, kb_arn)
+    with waiters.step("Agent role"):
+        va_agent_role_arn = create_agent_role(region, account_id, kb_arn)
     #va_agent_role_arn = 'arn:aws:iam::722665529886:role/AmazonBedrockExecutionRoleForAgents_va'
     #print(va_agent_role_arn)
 
@@ -224,40 +237,46 @@ def create_agent(region, account_id, kb_arn, kb_id):
     If the user request for a password reset, ask for email address, name and ID which are required information before fulfilling the <user-request>, 
     once you have all the required information, you can reset the password and provide temporary password to the user"""
 
-    va_agent_obj = bedrock_agent_client.create_agent(
-        agentName=agent_name,
-        agentResourceRoleArn=va_agent_role_arn,
-        description="Virtual assistant agent with ability to answer queries based on QIP Documents.",
-        idleSessionTTLInSeconds=1800,
-        foundationModel= "anthropic.claude-v2",    #"anthropic.claude-3-haiku-20240307-v1:0",
-        instruction=agent_instruction,
-        promptOverrideConfiguration=get_prompt_override_config(region,account_id)
-    )
-    print("Agent created successfully")
+    # Retried until Bedrock can assume the new role
+    with waiters.step("Agent"):
+        va_agent_obj = waiters.call_until_accepted("agent role assumable", lambda: bedrock_agent_client.create_agent(
+            agentName=agent_name,
+            agentResourceRoleArn=va_agent_role_arn,
+            description="Virtual assistant agent with ability to answer queries based on QIP Documents.",
+            idleSessionTTLInSeconds=1800,
+            foundationModel= get_profile(profile)["foundation_model"],    #"anthropic.claude-3-haiku-20240307-v1:0",
+            instruction=agent_instruction,
+            promptOverrideConfiguration=get_prompt_override_config(region,account_id,profile,local_input_filter)
+        ), ("ValidationException",), initial_delay=2, max_delay=10, timeout=180)
+    print(f"Agent created successfully with the {profile} latency profile")
     #print(va_agent_obj)
     va_agent_id = va_agent_obj['agent']['agentId']
-    create_action_group(region, account_id, va_agent_id, kb_id)
+    with waiters.step("Action group"):
+        create_action_group(region, account_id, va_agent_id, kb_id)
 
     #prepare agent
-    bedrock_agent_client.prepare_agent(
-        agentId=va_agent_id
-    )
-    # nosemgrep
-    time.sleep(25)
+    with waiters.step("Prepare agent"):
+        bedrock_agent_client.prepare_agent(
+            agentId=va_agent_id
+        )
+        waiters.wait_until(f"agent {va_agent_id} PREPARED", waiters.agent_status(bedrock_agent_client, va_agent_id, ("PREPARED",)),
+                           initial_delay=2, max_delay=10)
     #create alias once agent is prepared
-    create_alias(va_agent_id)
+    with waiters.step("Agent alias"):
+        create_alias(va_agent_id, profile)
 
     print("Agent prepared and new alias created")
     return va_agent_id
 
-def create_alias(va_agent_id):
-    #create alias
+def create_alias(va_agent_id, profile=default_profile):
+    #create alias, tagged with the latency profile the agent version was built with
     alias_name = "latest"
-    alias_description = "Alias for latest version of the agent"
+    alias_description = f"Alias for latest version of the agent, latency profile {profile}"
     alias_arn = bedrock_agent_client.create_agent_alias(
         agentId=va_agent_id,
         agentAliasName=alias_name,
-        description=alias_description
+        description=alias_description,
+        tags={"latency-profile": profile}
     )
     #print(alias_arn)
     return alias_arn
@@ -275,11 +294,11 @@ def create_action_group(region, account_id, va_agent_id, kb_id):
     #bucket_name = f'{agent_name}-{suffix}'
     #schema_key = f'{agent_name}-schema.json'
 
+    print("Creating Agent action group")
+    # Make sure agent is created & in available state
+    waiters.wait_until(f"agent {va_agent_id} created", waiters.agent_status(bedrock_agent_client, va_agent_id, ("NOT_PREPARED", "PREPARED")),
+                       initial_delay=1, max_delay=10)
     try:
-        print("Creating Agent action group")
-        # Pause to make sure agent is created & in available state
-        # nosemgrep
-        time.sleep(15)
         assume_role_policy_document = {
             "Version": "2012-10-17",
             "Statement": [
@@ -301,9 +320,9 @@ def create_action_group(region, account_id, va_agent_id, kb_id):
             AssumeRolePolicyDocument=assume_role_policy_document_json
         )
 
-        # Pause to make sure role is created
-        # nosemgrep
-        time.sleep(10)
+        # Make sure role is created
+        waiters.wait_until(f"role {lambda_role_name} visible", waiters.role_exists(iam_client, lambda_role_name),
+                           initial_delay=1, max_delay=5)
     except:
         lambda_iam_role = iam_client.get_role(RoleName=lambda_role_name)
 
@@ -319,15 +338,15 @@ def create_action_group(region, account_id, va_agent_id, kb_id):
     z.close()
     zip_content = s.getvalue()
 
-    # Create Lambda Function
-    lambda_function = lambda_client.create_function(
+    # Create Lambda Function, retried until Lambda can assume the new role
+    lambda_function = waiters.call_until_accepted("lambda role assumable", lambda: lambda_client.create_function(
         FunctionName=lambda_name,
         Runtime='python3.12',
         Timeout=180,
         Role=lambda_iam_role['Role']['Arn'],
         Code={'ZipFile': zip_content},
         Handler='lambda_function.lambda_handler'
-    )
+    ), ("InvalidParameterValueException",), initial_delay=2, max_delay=10, timeout=180)
 
     agent_action_group_response = bedrock_agent_client.create_agent_action_group(
         agentId=va_agent_id,
@@ -464,8 +483,8 @@ def create_agent_role(region, account_id,knowledge_base_arn ):
         RoleName=agent_role_name,
         AssumeRolePolicyDocument=assume_role_policy_document_json
     )
-    # nosemgrep
-    time.sleep(15)
+    waiters.wait_until(f"role {agent_role_name} visible", waiters.role_exists(iam_client, agent_role_name),
+                       initial_delay=1, max_delay=5)
 
     iam_client.attach_role_policy(
         RoleName=agent_role_name,
@@ -9,11 +9,13 @@ import json
 import uuid
 import pprint
 import os
+import sys
 load_dotenv()
 #from requests_aws4auth import AWS4Auth
 #from create_kb import create_knowledgebase
 from create_knowledgeBase_stack import create_kb_stack
 from create_agent import create_agent
+import waiters
 
 
 
@@ -28,6 +30,12 @@ bedrock_agent_runtime_client = boto3.client('bedrock-agent-runtime')
 # Get config from environment variables
 region =  os.environ.get("REGION_NAME") #"us-east-1"
 account_id = os.environ.get("AWS_ACCOUNT_ID") # "123456789"
+# Latency profile of the agent, one of agent_profiles.profiles
+agent_profile = os.environ.get("AGENT_LATENCY_PROFILE", "thorough")
+# Skip the PRE_PROCESSING model call when the app screens input locally (services/input_filter.py)
+local_input_filter = os.environ.get("AGENT_LOCAL_INPUT_FILTER", "false").lower() in ("1", "true", "yes")
+# Recorded traffic to check the local filter against, the labeled set in benchmarks/data otherwise
+input_filter_eval_cassettes = os.environ.get("INPUT_FILTER_EVAL_CASSETTES") or None
 
 s3_suffix = f"{region}-{account_id}"
 bucket_name = f'bedrock-kb-6915-{s3_suffix}'
@@ -41,6 +49,18 @@ def setup_logging():
  #call logging
 logger = setup_logging()
 
+def local_input_filter_passes():
+    # The filter only replaces PRE_PROCESSING once it rejects INPUT_FILTER_MIN_RECALL of the malicious examples
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    from benchmarks import eval_input_filter
+    from services import input_filter
+    passed, result = eval_input_filter.evaluate_for_deploy(cassettes=input_filter_eval_cassettes)
+    eval_input_filter.print_evaluation("Local input filter", result)
+    if not passed:
+        print(f"Recall {result['recall']:.1%} is below INPUT_FILTER_MIN_RECALL {input_filter.min_recall:.1%}, "
+              f"keeping PRE_PROCESSING enabled despite AGENT_LOCAL_INPUT_FILTER")
+    return passed
+
 def main():
     
     # Create Knowledge base
@@ -50,10 +70,12 @@ def main():
     print("Knowledge base created with KB_Id - {} and KB_Arn - {}!".format(kb_id, kb_arn))
     print("====================")    
     print("Creating Agent...")
-    va_agent_id = create_agent(region, account_id, kb_arn, kb_id)
+    va_agent_id = create_agent(region, account_id, kb_arn, kb_id, agent_profile,
+                               local_input_filter and local_input_filter_passes())
     print("Agent created with Agent_Id - {}!".format(va_agent_id))
     print("====================")
     print("Setup Complete!")
+    waiters.report()
 
 if __name__ == "__main__":
     main()
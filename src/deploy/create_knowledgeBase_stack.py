@@ -3,9 +3,9 @@ import json
 import os
 import boto3
 from botocore.exceptions import ClientError
-from utility import create_bedrock_execution_role, create_oss_policy_attach_bedrock_execution_role, create_policies_in_oss, interactive_sleep
+from utility import create_bedrock_execution_role, create_oss_policy_attach_bedrock_execution_role, create_policies_in_oss
 import random
-from retrying import retry
+import waiters
 credentials = boto3.Session().get_credentials()
 from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth, RequestError
 from dotenv import load_dotenv
@@ -63,14 +63,11 @@ def create_oss_collection(vector_store_name, bucket_name,bedrock_kb_execution_ro
     print("Host - {}".format(host))
 
     # Wait for collection to be ready
+    waiters.wait_until(f"collection {vector_store_name} ACTIVE", waiters.collection_active(aoss_client, vector_store_name),
+                       initial_delay=2, max_delay=15)
     response = aoss_client.batch_get_collection(names=[vector_store_name])
-    while response['collectionDetails'][0]['status'] == 'CREATING':
-        print("Waiting for collection to be ready...")
-        interactive_sleep(5)
-        response = aoss_client.batch_get_collection(names=[vector_store_name])
-        print('\nCollection successfully created:')
-        print("\nCollection Details - {}".format(response["collectionDetails"]))
-        print("\nCollection Status - {}".format(response["collectionDetails"][0]["status"]))
+    print('\nCollection successfully created:')
+    print("\nCollection Details - {}".format(response["collectionDetails"]))
     collection_arn = collection["createCollectionDetail"]['arn']
     print("Collection ARN - {}".format(collection_arn))
     return host, collection_arn,collection_id
@@ -81,8 +78,7 @@ def attach_oss_policy(collection_id,bedrock_kb_execution_role,account_ID,region_
         create_oss_policy_attach_bedrock_execution_role(collection_id=collection_id,
                                                        bedrock_kb_execution_role=bedrock_kb_execution_role,
                                                        account_number=account_ID,region_name=region_name)
-        # It can take upto a minn for data access rules to be effective
-        interactive_sleep(60)
+        # Data access rules can take up to a minute to be effective, create_vector_index probes for them
 
         #return host, collection_arn
     except ClientError as e:
@@ -130,6 +126,10 @@ def create_vector_index(host,index_name):
         timeout=300
     )
 
+    # The collection answers 403 until the data access policy is effective
+    waiters.wait_until("data access policy effective", waiters.data_access_effective(opensearch_client, index_name),
+                       initial_delay=2, max_delay=15)
+
     # Create Index
     try:
         response = opensearch_client.indices.create(index_name, body=body_json)
@@ -137,7 +137,8 @@ def create_vector_index(host,index_name):
         print(response)
 
         # Index creation can take up to a minute
-        interactive_sleep(60)
+        waiters.wait_until(f"index {index_name} visible", waiters.index_exists(opensearch_client, index_name),
+                           initial_delay=1, max_delay=10)
     except RequestError as e:
         print("Index already exists")
         print(e)
@@ -146,7 +147,6 @@ def create_vector_index(host,index_name):
     #return index_name
 
 # Function to Create Knowledge Base
-@retry(wait_random_min=1000, wait_random_max=2000,stop_max_attempt_number=7)
 def create_bedrock_knowledge_base(region_name, collection_arn,knowledge_base_name,index_name,bedrock_kb_execution_role_arn):
     
 
@@ -168,8 +168,9 @@ def create_bedrock_knowledge_base(region_name, collection_arn,knowledge_base_nam
     roleArn = bedrock_kb_execution_role_arn
 
     # Create a KnowledgeBase
+    # Retried while the new index and the role's OSS policy propagate to Bedrock
     try:
-        create_kb_response = bedrock_agent_client.create_knowledge_base(
+        create_kb_response = waiters.call_until_accepted("knowledge base accepted", lambda: bedrock_agent_client.create_knowledge_base(
             name=knowledge_base_name,
             description=description,
             roleArn=roleArn,
@@ -186,7 +187,7 @@ def create_bedrock_knowledge_base(region_name, collection_arn,knowledge_base_nam
                 "type": "OPENSEARCH_SERVERLESS",
                 "opensearchServerlessConfiguration": opensearchServerlessConfiguration
             }
-        )
+        ), ("ValidationException", "AccessDeniedException"), max_attempts=25, initial_delay=2, max_delay=15, timeout=300)
         print("Knowledge base created successfully")
         return create_kb_response["knowledgeBase"]
     # print(create_kb_response)
@@ -233,23 +234,17 @@ def create_kb_data_source(data_source_name,kb_id,bucket_name): # Create a DataSo
     return ds_id
 
 def start_ingestion_job(kb_id,dataSource_ID):
-    interactive_sleep(30)
-    start_job_response = bedrock_agent_client.start_ingestion_job(
+    # Retried while the new data source settles
+    start_job_response = waiters.call_until_accepted("ingestion job accepted", lambda: bedrock_agent_client.start_ingestion_job(
         knowledgeBaseId = kb_id,
         dataSourceId = dataSource_ID
-    )
+    ), {"ValidationException": waiters.propagation_message, "ConflictException": None}, initial_delay=2, max_delay=10, timeout=120)
     job = start_job_response["ingestionJob"]
     #print("Job started successfully with Job ID - {}".format(job["ingestionJobId"]))
     # Get job
-    while(job['status']!='COMPLETE' ):
-        get_job_response = bedrock_agent_client.get_ingestion_job(
-        knowledgeBaseId = kb_id,
-            dataSourceId = dataSource_ID,
-            ingestionJobId = job["ingestionJobId"]
-        )
-        job = get_job_response["ingestionJob"]
-        
-        interactive_sleep(30)
+    job = waiters.wait_until(f"ingestion job {job['ingestionJobId']} COMPLETE",
+                             waiters.ingestion_job_complete(bedrock_agent_client, kb_id, dataSource_ID, job["ingestionJobId"]),
+                             initial_delay=5, max_delay=30, timeout=3600)
     print("Job Completed successfully with Job ID - {}".format(job))
 
 
@@ -266,33 +261,39 @@ def create_kb_stack(account_ID,region_name,bucket_name):
     index_name = f"bedrock-sample-rag-index-{suffix}"
     
     print("Creating required policies for KB role...")
-    bedrock_kb_execution_role = create_bedrock_execution_role(bucket_name,account_ID,region_name)
+    with waiters.step("KB execution role"):
+        bedrock_kb_execution_role = create_bedrock_execution_role(bucket_name,account_ID,region_name)
     bedrock_kb_execution_role_arn = bedrock_kb_execution_role['Role']['Arn']
     
     print("Creating Collection...")
     # Call function to create Collection
-    host, collection_arn,collection_id = create_oss_collection(vector_store_name, bucket_name,bedrock_kb_execution_role,bedrock_kb_execution_role_arn)
+    with waiters.step("OSS collection"):
+        host, collection_arn,collection_id = create_oss_collection(vector_store_name, bucket_name,bedrock_kb_execution_role,bedrock_kb_execution_role_arn)
     
     print("Creating required policies for OSS...")
     # create opensearch serverless access policy and attach it to Bedrock execution role
-    attach_oss_policy(collection_id,bedrock_kb_execution_role,account_ID,region_name)
+    with waiters.step("OSS policy"):
+        attach_oss_policy(collection_id,bedrock_kb_execution_role,account_ID,region_name)
     
     print("Host and Collection ARN - {}, {}".format(host, collection_arn))
     
     print("Creating Vector Index...")
     # Call function to create Vector Index
-    create_vector_index(host,index_name)
+    with waiters.step("Vector index"):
+        create_vector_index(host,index_name)
 
     print("Uploading data to S3 for Knowledge base Data Source...")
     # Upload the data to S3
-    uploadDirectory(data_root, bucket_name)
+    with waiters.step("Upload documents"):
+        uploadDirectory(data_root, bucket_name)
 
 
     print("Creating Knowledge Base...")
     # create Knowledge Base
     knowledge_base_name = f'bedrock-sample-rag-kb-{suffix}'
     #print("Creating KB phase with collection ARn - {}".format(collection_arn))
-    kb = create_bedrock_knowledge_base(region_name, collection_arn,knowledge_base_name,index_name,bedrock_kb_execution_role_arn)
+    with waiters.step("Knowledge base"):
+        kb = create_bedrock_knowledge_base(region_name, collection_arn,knowledge_base_name,index_name,bedrock_kb_execution_role_arn)
     kb_id = kb['knowledgeBaseId']
     kb_arn = kb['knowledgeBaseArn']
     
@@ -300,11 +301,13 @@ def create_kb_stack(account_ID,region_name,bucket_name):
     print("Creating Data Source...")
     # Create datasource
     data_source_name = f'bedrock-sample-rag-kb-ds-{suffix}'
-    dataSource_ID = create_kb_data_source(data_source_name,kb_id,bucket_name)
+    with waiters.step("Data source"):
+        dataSource_ID = create_kb_data_source(data_source_name,kb_id,bucket_name)
 
     print("Starting ingestion job...")
     # Call function start_ingestion_job to Start ingestion job
-    start_ingestion_job(kb_id,dataSource_ID)
+    with waiters.step("Ingestion job"):
+        start_ingestion_job(kb_id,dataSource_ID)
     
     print("Knowledge Based ID and ARN are {}, {} respectively".format(kb_id, kb_arn))
-    return kb_arn, kb_id
\ No newline at end of file
+    return kb_arn, kb_id
@@ -1,6 +1,5 @@
 import boto3
 import random
-import time
 import json
 
 suffix = random.randrange(200, 900)
@@ -230,13 +229,6 @@ def delete_iam_role_and_policies(account_number):
     return 0
 
 
-def interactive_sleep(seconds: int):
-    dots = ''
-    for i in range(seconds):
-        dots += '.'
-        print(dots, end='\r')
-        time.sleep(1)
-
 def create_bedrock_execution_role_multi_ds(bucket_names = None, secrets_arns = None):
     
     # 0. Create bedrock execution role
@@ -0,0 +1,156 @@
+import re
+import time
+from contextlib import contextmanager
+from botocore.exceptions import ClientError
+from opensearchpy import AuthorizationException
+
+# Deploy steps and waits in the order they ran, printed by report()
+timings = []
+# Messages of calls rejected only because a new IAM role or data access policy has not propagated yet
+propagation_message = re.compile(
+    r"assume|role|trust|propagat|security_exception|forbidden|\b403\b|not authori[sz]ed|permission|access denied",
+    re.IGNORECASE
+)
+
+
+def wait_until(description, probe, initial_delay=1, max_delay=20, timeout=900, backoff=2):
+    """
+    Calls probe until it returns a truthy value, sleeping with exponential backoff in between,
+    so a deploy moves on as soon as the resource is ready instead of after a fixed sleep
+    :param description: What is waited for, e.g. collection bedrock-sample-rag-123 ACTIVE
+    :param probe: Callable returning a truthy value once ready, it raises to abort the wait
+    :return: Returns the truthy value of the last probe
+    """
+    started = time.monotonic()
+    delay = initial_delay
+    attempts = 0
+    while True:
+        attempts += 1
+        result = probe()
+        elapsed = time.monotonic() - started
+        if result:
+            timings.append({"name": f"wait: {description}", "seconds": elapsed, "attempts": attempts})
+            print(f"{description} after {elapsed:.1f}s ({attempts} checks)")
+            return result
+        if elapsed + delay > timeout:
+            raise TimeoutError(f"{description} not reached after {elapsed:.0f}s")
+        print(f"Waiting for {description}... {elapsed:.0f}s", end='\r')
+        time.sleep(delay)
+        delay = min(delay * backoff, max_delay)
+
+
+def call_until_accepted(description, fn, retry_codes, retry_message=propagation_message, max_attempts=12, **kwargs):
+    """
+    Calls an AWS API until it stops failing with one of retry_codes, e.g. while a new IAM role
+    or data access policy propagates. Only errors whose message matches retry_message are
+    retried, so a genuine ValidationException of a bad parameter is raised straight away like
+    any other error. The error of the last of max_attempts calls is raised as well.
+    :param retry_codes: Error codes to retry, or {code: message pattern, None for any message}
+    :param retry_message: Message pattern of the codes given as a list
+    :return: Returns the response of the accepted call
+    """
+    if not isinstance(retry_codes, dict):
+        retry_codes = {code: retry_message for code in retry_codes}
+    attempts = 0
+
+    def probe():
+        nonlocal attempts
+        attempts += 1
+        try:
+            return fn()
+        except ClientError as e:
+            error = e.response.get("Error", {})
+            if error.get("Code") not in retry_codes or attempts >= max_attempts:
+                raise
+            pattern = retry_codes[error.get("Code")]
+            if pattern is not None and not pattern.search(error.get("Message", "")):
+                raise
+            return None
+
+    return wait_until(description, probe, **kwargs)
+
+
+@contextmanager
+def step(name):
+    # Times one deploy step, the waits it contains are listed after it by report()
+    started = time.monotonic()
+    entry = {"name": name, "seconds": None, "attempts": None}
+    timings.append(entry)
+    try:
+        yield
+    finally:
+        entry["seconds"] = time.monotonic() - started
+
+
+def report():
+    print("====================")
+    print("Deploy timing:")
+    for entry in timings:
+        attempts = f" ({entry['attempts']} checks)" if entry["attempts"] else ""
+        indent = "    " if entry["name"].startswith("wait: ") else ""
+        print(f"{indent}{entry['name']}: {entry['seconds']:.1f}s{attempts}")
+
+
+# Readiness probes, each returns True once the resource can be used and raises if it failed
+
+def collection_active(aoss_client, name):
+    def probe():
+        status = aoss_client.batch_get_collection(names=[name])['collectionDetails'][0]['status']
+        if status == 'FAILED':
+            raise RuntimeError(f"Collection {name} failed to create")
+        return status == 'ACTIVE'
+    return probe
+
+
+def data_access_effective(opensearch_client, index_name):
+    # Any index call is rejected with 403 until the data access policy applies to the caller,
+    # the Bedrock role shares the same policy
+    def probe():
+        try:
+            opensearch_client.indices.exists(index=index_name)
+            return True
+        except AuthorizationException:
+            return False
+    return probe
+
+
+def index_exists(opensearch_client, index_name):
+    def probe():
+        try:
+            return opensearch_client.indices.exists(index=index_name)
+        except AuthorizationException:
+            return False
+    return probe
+
+
+def role_exists(iam_client, role_name):
+    # Visible to IAM reads first, callers also retry the first call that assumes the role
+    def probe():
+        try:
+            iam_client.get_role(RoleName=role_name)
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "NoSuchEntity":
+                raise
+            return False
+    return probe
+
+
+def agent_status(bedrock_agent_client, agent_id, statuses):
+    def probe():
+        status = bedrock_agent_client.get_agent(agentId=agent_id)['agent']['agentStatus']
+        if status == 'FAILED':
+            raise RuntimeError(f"Agent {agent_id} failed")
+        return status in statuses
+    return probe
+
+
+def ingestion_job_complete(bedrock_agent_client, kb_id, data_source_id, job_id):
+    def probe():
+        job = bedrock_agent_client.get_ingestion_job(
+            knowledgeBaseId=kb_id, dataSourceId=data_source_id, ingestionJobId=job_id
+        )['ingestionJob']
+        if job['status'] in ('FAILED', 'STOPPED'):
+            raise RuntimeError(f"Ingestion job {job_id} ended {job['status']}: {job.get('failureReasons')}")
+        return job if job['status'] == 'COMPLETE' else None
+    return probe
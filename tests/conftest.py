@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+# The tests import the services package the way the pages do, from the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("botocore")
+
+from services import answer_cache, request_coalescer, session_store  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    # Every test gets its own answer cache, coalescer and session store instead of the process-wide ones
+    monkeypatch.setattr(answer_cache, "cache", answer_cache.AnswerCache())
+    monkeypatch.setattr(request_coalescer, "coalescer", request_coalescer.RequestCoalescer())
+    monkeypatch.setattr(session_store, "store", session_store.InMemorySessionStore())
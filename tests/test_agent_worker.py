@@ -0,0 +1,139 @@
+import socket
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from benchmarks.stub_runtime import StubAgentRuntimeClient
+from services import agent_worker, answer_cache, bedrock_agent_runtime, cassette, request_coalescer
+
+agent_id = "stub-agent"
+agent_alias_id = "stub-alias"
+prompt = "What are the key insights of the quarterly investment perspective?"
+
+
+class SocketEventStream:
+    """
+    Completion stream read from a socket like botocore's EventStream, one chunk per line.
+    Exposes the socket where cancellation.close_stream looks for it.
+    """
+
+    def __init__(self, sock):
+        self._raw_stream = SimpleNamespace(_connection=SimpleNamespace(sock=sock))
+        self._file = sock.makefile("rb")
+
+    def __iter__(self):
+        for line in self._file:
+            yield {"chunk": {"bytes": line}}
+
+    def close(self):
+        self._file.close()
+
+
+class SocketClient(StubAgentRuntimeClient):
+    def __init__(self, sock):
+        super().__init__()
+        self.sock = sock
+
+    def invoke_agent(self, **kwargs):
+        self.calls += 1
+        return {"completion": SocketEventStream(self.sock), "sessionId": kwargs.get("sessionId")}
+
+
+@pytest.fixture(autouse=True)
+def agent_route(monkeypatch):
+    # Without a Knowledge Base every turn is routed to the agent
+    monkeypatch.delenv("KNOWLEDGE_BASE_ID", raising=False)
+
+
+def cached_answer():
+    return answer_cache.get(answer_cache.agent_namespace(agent_id, agent_alias_id), prompt)
+
+
+def test_completed_turn_is_cached():
+    run = agent_worker.start(agent_id, agent_alias_id, "s1", prompt, first_turn=True, client=StubAgentRuntimeClient())
+    assert run.wait(5)
+    assert not run.cancelled and run.error is None
+    assert cached_answer()["output_text"] == run.response["output_text"]
+
+
+def test_stop_interrupts_a_blocked_read(monkeypatch):
+    monkeypatch.setattr(request_coalescer, "policy", "off")
+    reader, writer = socket.socketpair()
+    try:
+        writer.sendall(b"first part of the answer\n")
+        run = agent_worker.start(agent_id, agent_alias_id, "s1", prompt, first_turn=True, client=SocketClient(reader))
+        deadline = time.monotonic() + 5
+        while not run.text() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        # The worker is now blocked reading the socket, nothing more will arrive
+        started = time.monotonic()
+        run.cancel()
+        assert run.wait(2)
+        assert time.monotonic() - started < 1
+    finally:
+        reader.close()
+        writer.close()
+
+    assert run.cancelled and run.error is None
+    assert run.text() == "first part of the answer\n"
+    # The stream ended quietly on the shut down socket, the partial answer must not pass for a complete one
+    assert cached_answer() is None
+    assert bedrock_agent_runtime.unrecorded_turns("s1") == []
+
+
+
+def test_stop_interrupts_a_blocked_read_while_recording(monkeypatch, tmp_path):
+    monkeypatch.setattr(request_coalescer, "policy", "off")
+    reader, writer = socket.socketpair()
+    try:
+        writer.sendall(b"first part of the answer\n")
+        client = cassette.CassetteClient(SocketClient(reader), mode="record", directory=str(tmp_path))
+        run = agent_worker.start(agent_id, agent_alias_id, "s1", prompt, first_turn=True, client=client)
+        deadline = time.monotonic() + 5
+        while not run.text() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        started = time.monotonic()
+        run.cancel()
+        assert run.wait(2)
+        assert time.monotonic() - started < 1
+    finally:
+        reader.close()
+        writer.close()
+
+    assert run.cancelled and run.error is None
+    # A stopped stream is not recorded
+    assert list(tmp_path.iterdir()) == []
+
+def test_stop_on_a_coalesced_turn_caches_nothing():
+    client = StubAgentRuntimeClient(chunk_count=50, latency=0.02)
+    run = agent_worker.start(agent_id, agent_alias_id, "s1", prompt, first_turn=True, client=client)
+    time.sleep(0.3)
+    run.cancel()
+    assert run.wait(2)
+
+    assert run.cancelled and run.error is None
+    assert len(run.response["output_text"]) < client.chunk_count * client.chunk_size
+    assert cached_answer() is None
+    assert bedrock_agent_runtime.unrecorded_turns("s1") == []
+
+
+def test_stop_on_one_coalesced_turn_leaves_the_other_complete():
+    client = StubAgentRuntimeClient(chunk_count=30, latency=0.02)
+    stopped = agent_worker.start(agent_id, agent_alias_id, "s1", prompt, first_turn=True, client=client)
+    time.sleep(0.05)
+    kept = agent_worker.start(agent_id, agent_alias_id, "s2", prompt, first_turn=True, client=client)
+    time.sleep(0.3)
+    stopped.cancel()
+    assert stopped.wait(2) and stopped.cancelled
+    assert kept.wait(5) and not kept.cancelled
+
+    assert client.calls == 1
+    assert cached_answer()["output_text"] == kept.response["output_text"]
+    assert len(stopped.response["output_text"]) < len(kept.response["output_text"])
+    # Only the follower that received the whole answer records it for its agent session
+    assert bedrock_agent_runtime.unrecorded_turns("s1") == []
+    assert bedrock_agent_runtime.unrecorded_turns("s2")[-1]["content"][0]["text"] == kept.response["output_text"]
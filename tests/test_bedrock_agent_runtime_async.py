@@ -0,0 +1,33 @@
+import asyncio
+
+from benchmarks.stub_runtime import StubAgentRuntimeClient
+from services import answer_cache, bedrock_agent_runtime_async
+
+agent_id = "stub-agent"
+agent_alias_id = "stub-alias"
+prompt = "What are the key insights of the quarterly investment perspective?"
+
+
+class RecordingClient(StubAgentRuntimeClient):
+    def __init__(self):
+        super().__init__(chunk_count=2, citation_count=0)
+        self.requests = []
+
+    def invoke_agent(self, **kwargs):
+        self.requests.append(kwargs)
+        return super().invoke_agent(**kwargs)
+
+
+def test_first_turn_and_retrieval_filter_are_forwarded(monkeypatch):
+    monkeypatch.setenv("KNOWLEDGE_BASE_ID", "stub-kb")
+    client = RecordingClient()
+    retrieval_filter = {"equals": {"key": "year", "value": 2024}}
+    response = asyncio.run(bedrock_agent_runtime_async.invoke_agent(
+        agent_id, agent_alias_id, "s1", prompt, client, first_turn=True, retrieval_filter=retrieval_filter
+    ))
+
+    configuration = client.requests[0]["sessionState"]["knowledgeBaseConfigurations"][0]
+    assert configuration["knowledgeBaseId"] == "stub-kb"
+    assert configuration["retrievalConfiguration"]["vectorSearchConfiguration"]["filter"] == retrieval_filter
+    namespace = answer_cache.filtered_namespace(answer_cache.agent_namespace(agent_id, agent_alias_id), retrieval_filter)
+    assert answer_cache.get(namespace, prompt)["output_text"] == response["output_text"]
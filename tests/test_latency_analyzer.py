@@ -0,0 +1,36 @@
+from services import latency_analyzer
+
+
+def breakdown(trace_events, orchestration_seconds, total_seconds):
+    return {
+        "total_seconds": total_seconds,
+        "time_to_first_chunk_seconds": 0.1,
+        "trace_events": trace_events,
+        "pre_processing_seconds": 0.0,
+        "orchestration_seconds": orchestration_seconds,
+        "post_processing_seconds": 0.0,
+        "response_seconds": 0.1,
+        "kb_retrieval_seconds": 0.0
+    }
+
+
+def test_turns_without_a_trace_leave_out_the_agent_phases():
+    histogram = latency_analyzer.LatencyHistogram()
+    histogram.record(breakdown(8, 2.0, 3.0))
+    histogram.record(breakdown(0, 0.0, 0.2))
+
+    result = histogram.percentiles()
+    assert result["orchestration_seconds"]["count"] == 1
+    assert result["orchestration_seconds"]["p50"] == 2.0
+    assert result["total_seconds"]["count"] == 2
+
+
+def test_routes_are_kept_apart(monkeypatch):
+    monkeypatch.setattr(latency_analyzer, "histograms", {})
+    latency_analyzer.record(breakdown(8, 2.0, 3.0), "agent")
+    latency_analyzer.record(breakdown(0, 0.0, 0.5), "knowledge_base")
+
+    result = latency_analyzer.percentiles()
+    assert result["agent"]["total_seconds"]["p50"] == 3.0
+    assert result["knowledge_base"]["total_seconds"]["p50"] == 0.5
+    assert "orchestration_seconds" not in result["knowledge_base"]
@@ -0,0 +1,62 @@
+import pytest
+
+from benchmarks.stub_runtime import StubAgentRuntimeClient
+from services import knowledge_base_runtime, query_router, session_store
+
+agent_id = "stub-agent"
+agent_alias_id = "stub-alias"
+question = "What are the key insights of the quarterly investment perspective?"
+
+
+class RecordingClient(StubAgentRuntimeClient):
+    def __init__(self):
+        super().__init__(chunk_count=2, citation_count=0)
+        self.requests = []
+
+    def retrieve_and_generate_stream(self, **kwargs):
+        self.requests.append(kwargs)
+        return super().retrieve_and_generate_stream(**kwargs)
+
+
+@pytest.fixture(autouse=True)
+def knowledge_base(monkeypatch):
+    monkeypatch.setenv("KNOWLEDGE_BASE_ID", "stub-kb")
+    monkeypatch.setenv("KNOWLEDGE_BASE_MODEL_ARN", "arn:aws:bedrock:us-east-1::foundation-model/stub")
+
+
+def ask(client, session_id, prompt, first_turn):
+    decision = query_router.classify(session_id, prompt)
+    assert decision["route"] == query_router.KNOWLEDGE_BASE
+    events = query_router.stream(decision, agent_id, agent_alias_id, session_id, prompt, client, first_turn)
+    return "".join(event["text"] for event in events if event["type"] == "chunk")
+
+
+def test_cached_first_turn_is_handed_to_the_follow_up():
+    client = RecordingClient()
+    answer = ask(client, "s1", question, first_turn=True)
+    assert ask(client, "s2", question, first_turn=True) == answer
+    assert len(client.requests) == 1
+
+    state = session_store.store.load_state("s2")
+    assert state["kb_session_id"] is None
+    assert knowledge_base_runtime.unrecorded_turns("s2") == [{"prompt": question, "answer": answer}]
+
+    ask(client, "s2", "What about the risks?", first_turn=False)
+    request = client.requests[-1]
+    assert "sessionId" not in request
+    assert question in request["input"]["text"] and answer in request["input"]["text"]
+    state = session_store.store.load_state("s2")
+    assert state["kb_session_id"] == "stub-kb-session"
+    assert state["kb_history"] == []
+
+
+def test_follow_up_after_a_cached_first_turn_is_not_served_from_the_cache():
+    client = RecordingClient()
+    follow_up = "What is the outlook for bonds?"
+    ask(client, "s1", question, first_turn=True)
+    ask(client, "s2", follow_up, first_turn=True)
+    ask(client, "s3", question, first_turn=True)
+    ask(client, "s3", follow_up, first_turn=False)
+
+    assert len(client.requests) == 3
+    assert question in client.requests[-1]["input"]["text"]
@@ -0,0 +1,96 @@
+from botocore.exceptions import ClientError, EndpointConnectionError, EventStreamError
+import pytest
+
+from services import cancellation, rate_limiter
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "retry_base_delay", 0.001)
+
+
+def client_error(code, status=400, error_class=ClientError):
+    return error_class({"Error": {"Code": code, "Message": code},
+                        "ResponseMetadata": {"HTTPStatusCode": status}}, "InvokeAgent")
+
+
+def failing(errors, result="answer"):
+    # Raises the given errors one call at a time, then returns result
+    errors = list(errors)
+
+    def fn():
+        if errors:
+            raise errors.pop(0)
+        return result
+    return fn
+
+
+def failing_stream(errors):
+    errors = list(errors)
+
+    def start():
+        if errors:
+            raise errors.pop(0)
+        yield {"type": "chunk", "text": "answer"}
+    return start
+
+
+@pytest.mark.parametrize("error", [
+    client_error("ThrottlingException"),
+    client_error("throttlingException", error_class=EventStreamError),
+    client_error("serviceQuotaExceededException", error_class=EventStreamError)
+], ids=["client-error", "event-stream-throttling", "event-stream-quota"])
+def test_throttles_are_retried_and_counted_whatever_the_code_case(error, request):
+    key = f"test:{request.node.callspec.id}"
+    assert rate_limiter.call(key, failing([error])) == "answer"
+
+    stats = rate_limiter.stats()[key]
+    assert stats["throttles"] == 1
+    assert stats["retries"] == 1
+    assert stats["rate"] < rate_limiter.default_rate
+
+
+@pytest.mark.parametrize("error", [
+    client_error("ThrottlingException"),
+    client_error("throttlingException", error_class=EventStreamError)
+], ids=["client-error", "event-stream"])
+def test_throttled_stream_is_retried_before_its_first_event(error, request):
+    key = f"test:stream-{request.node.callspec.id}"
+    events = list(rate_limiter.stream(key, failing_stream([error])))
+
+    assert [event["text"] for event in events] == ["answer"]
+    assert rate_limiter.stats()[key]["throttles"] == 1
+
+
+@pytest.mark.parametrize("error", [
+    client_error("InternalServerException", status=500),
+    client_error("modelNotReadyException", status=424, error_class=EventStreamError),
+    client_error("ServiceUnavailable", status=503),
+    EndpointConnectionError()
+], ids=["server-error", "model-not-ready", "status-503", "connection"])
+def test_transient_errors_are_retried_without_slowing_down(error, request):
+    key = f"test:transient-{request.node.callspec.id}"
+    assert rate_limiter.call(key, failing([error])) == "answer"
+
+    stats = rate_limiter.stats()[key]
+    assert stats["transient_errors"] == 1
+    assert stats["throttles"] == 0
+    assert stats["retries"] == 1
+    assert stats["rate"] == rate_limiter.default_rate
+
+
+def test_other_errors_are_not_retried():
+    error = client_error("ValidationException")
+    with pytest.raises(ClientError):
+        rate_limiter.call("test:validation", failing([error]))
+
+    assert rate_limiter.stats()["test:validation"]["retries"] == 0
+
+
+def test_stream_dropped_by_stop_is_not_retried():
+    scope = cancellation.CancelScope()
+    scope.cancel()
+    with cancellation.active(scope), pytest.raises(EndpointConnectionError):
+        list(rate_limiter.stream("test:stopped", failing_stream([EndpointConnectionError()])))
+
+    assert rate_limiter.stats()["test:stopped"]["retries"] == 0
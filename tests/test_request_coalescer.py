@@ -0,0 +1,112 @@
+import threading
+import time
+
+import pytest
+
+from services import cancellation, request_coalescer
+
+
+def slow_upstream(count=5, delay=0.05, error=None):
+    def start():
+        for num in range(count):
+            time.sleep(delay)
+            yield {"type": "chunk", "text": str(num)}
+        if error is not None:
+            raise error
+    return start
+
+
+def consume(stream, results, name, scope=None):
+    try:
+        with cancellation.active(scope or cancellation.CancelScope()):
+            results[name] = [event["text"] for event in stream]
+    except Exception as e:
+        results[name] = e
+
+
+def test_identical_requests_share_one_upstream_call():
+    coalescer = request_coalescer.RequestCoalescer()
+    start = slow_upstream()
+    results = {}
+    threads = [threading.Thread(target=consume, args=(coalescer.stream("key", start), results, name))
+               for name in ("leader", "follower")]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join(5)
+
+    assert results["leader"] == results["follower"] == ["0", "1", "2", "3", "4"]
+    assert coalescer.stats()["upstream_calls"] == 1
+    assert coalescer.stats()["upstream_calls_saved"] == 1
+
+
+def test_subscriber_leaving_does_not_stop_the_others():
+    coalescer = request_coalescer.RequestCoalescer()
+    start = slow_upstream()
+    results = {}
+    leaving = cancellation.CancelScope()
+    threads = [
+        threading.Thread(target=consume, args=(coalescer.stream("key", start), results, "leader", leaving)),
+        threading.Thread(target=consume, args=(coalescer.stream("key", start), results, "follower"))
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.12)
+    leaving.cancel()
+    threads[0].join(1)
+
+    assert not threads[0].is_alive()
+    assert isinstance(results["leader"], cancellation.Cancelled)
+    threads[1].join(5)
+    assert results["follower"] == ["0", "1", "2", "3", "4"]
+
+
+def test_upstream_error_reaches_every_subscriber():
+    coalescer = request_coalescer.RequestCoalescer()
+    start = slow_upstream(count=2, error=RuntimeError("upstream failed"))
+    results = {}
+    threads = [threading.Thread(target=consume, args=(coalescer.stream("key", start), results, name))
+               for name in ("leader", "follower")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    for name in ("leader", "follower"):
+        assert isinstance(results[name], RuntimeError)
+    assert coalescer.stats()["in_flight"] == 0
+
+
+def test_upstream_call_is_closed_once_nobody_follows():
+    closed = threading.Event()
+
+    def start():
+        def events():
+            try:
+                for num in range(100):
+                    time.sleep(0.02)
+                    yield {"type": "chunk", "text": str(num)}
+            finally:
+                closed.set()
+        return events()
+
+    coalescer = request_coalescer.RequestCoalescer()
+    scope = cancellation.CancelScope()
+    results = {}
+    thread = threading.Thread(target=consume, args=(coalescer.stream("key", start), results, "leader", scope))
+    thread.start()
+    time.sleep(0.05)
+    scope.cancel()
+    thread.join(1)
+
+    assert closed.wait(1)
+    assert coalescer.stats()["in_flight"] == 0
+
+
+@pytest.mark.parametrize("policy,first_turn,expected", [
+    ("off", True, False), ("first_turn", True, True), ("first_turn", False, False), ("always", False, True)
+])
+def test_policy(monkeypatch, policy, first_turn, expected):
+    monkeypatch.setattr(request_coalescer, "policy", policy)
+    assert request_coalescer.allowed(first_turn) is expected
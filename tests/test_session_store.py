@@ -0,0 +1,37 @@
+import time
+
+from services import session_store
+
+
+def test_least_recently_used_session_is_evicted():
+    store = session_store.InMemorySessionStore(max_sessions=2)
+    store.create("s1", {"page": "agent"})
+    store.save_state("s2", {"route": "agent"})
+    store.load("s1")
+    store.create("s3", {"page": "agent"})
+
+    assert store.load("s1") is not None
+    assert store.load_state("s2") == {}
+    assert store.load("s3") is not None
+
+
+def test_idle_session_expires():
+    store = session_store.InMemorySessionStore(ttl_seconds=0.05)
+    store.create("s1", {"page": "agent"})
+    store.append_turn("s1", 0, {"message": {"role": "user", "text": "hi"}})
+    store.save_state("s1", {"route": "agent"})
+    assert store.load("s1")["turns"] == [{"message": {"role": "user", "text": "hi"}}]
+    time.sleep(0.1)
+
+    assert store.load("s1") is None
+    assert store.load_state("s1") == {}
+
+
+def test_turn_of_an_evicted_session_starts_it_over():
+    store = session_store.InMemorySessionStore(max_sessions=1)
+    store.create("s1", {"page": "agent"})
+    store.create("s2", {"page": "agent"})
+    store.append_turn("s1", 3, {"message": {"role": "user", "text": "hi"}})
+
+    assert store.load("s1") == {"meta": {}, "turns": [{"message": {"role": "user", "text": "hi"}}]}
+    assert store.load("s2") is None
@@ -0,0 +1,46 @@
+import json
+import os
+import streamlit as st
+
+# Payloads longer than this are shown truncated until the user asks for the full text
+preview_max_chars = int(os.environ.get("SIDEBAR_JSON_PREVIEW_CHARS", "20000"))
+
+
+def _memo(turn_id):
+    # Serialized strings of the current turn only, older turns are dropped
+    memo = st.session_state.get("json_memo")
+    if memo is None or memo["turn_id"] != turn_id:
+        memo = {"turn_id": turn_id, "strings": {}}
+        st.session_state.json_memo = memo
+    return memo["strings"]
+
+
+def lazy_json(label, key, turn_id, documents=None, texts=None):
+    """
+    Renders a toggle that reveals a JSON payload. Unlike an st.expander, nothing is
+    serialized or sent to the browser until the toggle is switched on, and the
+    serialized text is memoized for the rest of the turn.
+    :param label: The toggle label, e.g. Trace Step 3
+    :param key: Key of the payload, unique within the turn
+    :param turn_id: Identifies the turn the payload belongs to
+    :param documents: Callable returning the list of JSON documents to show
+    :param texts: Callable returning the serialized documents instead, for payloads that
+        memoize their own text such as trace_index.TraceStep.texts
+    """
+    if not st.toggle(label, key=f"lazy_json:{turn_id}:{key}"):
+        return
+
+    if texts is not None:
+        serialized = texts()
+    else:
+        strings = _memo(turn_id)
+        if key not in strings:
+            strings[key] = [json.dumps(document, indent=2, default=str) for document in documents()]
+        serialized = strings[key]
+
+    for num, text in enumerate(serialized):
+        if len(text) > preview_max_chars and not st.checkbox(
+                f"Show all {len(text):,} characters", key=f"lazy_json_full:{turn_id}:{key}:{num}"):
+            st.caption(f"Preview of the first {preview_max_chars:,} characters")
+            text = text[:preview_max_chars]
+        st.code(text, language="json", line_numbers=True, wrap_lines=True)
@@ -0,0 +1,23 @@
+import streamlit as st
+from services import document_manifest, document_metadata
+
+labels = {"title": "Document", "publisher": "Publisher", "quarter": "Quarter", "year": "Year"}
+
+
+def retrieval_filter_sidebar(key):
+    """
+    Renders a multiselect in the sidebar for every metadata attribute of the uploaded
+    documents, options come from the document manifest
+    :param key: Prefix of the widget keys, unique per page
+    :return: Returns the retrieval filter of the selection, or None to search every document
+    """
+    values = document_manifest.manifest.attribute_values()
+    st.sidebar.subheader("Search Only")
+    if not any(values.values()):
+        st.sidebar.caption("Documents uploaded with metadata can be filtered on here")
+        return None
+    selection = {
+        attribute: st.sidebar.multiselect(labels[attribute], options, key=f"{key}:{attribute}")
+        for attribute, options in values.items() if options
+    }
+    return document_metadata.build_filter(selection)